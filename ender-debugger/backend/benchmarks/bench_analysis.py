@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Throughput and latency of the analysis scheduler against the fake model backend.
+
+Simulates an editing session: ``--files`` files, a few of them open in a
+client, each saved ``--saves`` times in interleaved bursts ``--interval``
+seconds apart, followed by a round of reverts to content seen earlier.
+Everything goes through ``AnalysisScheduler`` with the deterministic
+``FakeModelBackend``, so runs are comparable offline.
+
+Reports the model calls and model time next to analyzing every save on its
+own, the latency from save to result for open and background files, and
+the outcome counts (coalesced, cancelled, cached). Exits with status 1 if
+a superseded result is delivered after a file's final content, or if the
+p95 latency of open files goes over ``--max-open-p95``.
+
+Run from anywhere: python benchmarks/bench_analysis.py
+"""
+import os
+import sys
+import time
+import argparse
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from analysis_scheduler import AnalysisRequest, AnalysisScheduler, FakeModelBackend  # noqa: E402
+
+def content(index: int, version: int) -> str:
+    lines = [f'def handler_{index}_{line}(event):' if line % 8 == 0 else f'    value_{line} = event[{line}]'
+             for line in range(40)]
+    lines[version % 40] += f'  # TODO revisit v{version}'
+    return '\n'.join(lines) + '\n'
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analysis scheduler')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--open', type=int, default=5, help='Files open in a client')
+    parser.add_argument('--saves', type=int, default=4, help='Saves per file')
+    parser.add_argument('--interval', type=float, default=0.0005, help='Seconds between saves')
+    parser.add_argument('--batch-window', type=float, default=0.02)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--max-open-p95', type=float, default=0.5, help='Seconds')
+    args = parser.parse_args()
+
+    backend = FakeModelBackend(max_batch=args.max_batch)
+    results = []
+    scheduler = AnalysisScheduler(backend, results.append, batch_window=args.batch_window)
+    scheduler.set_open('client', [f'/bench/file{index}.py' for index in range(args.open)])
+    scheduler.start()
+
+    final = {}
+    saves = 0
+    started = time.perf_counter()
+    versions = list(range(args.saves)) + [0]  # The last round reverts every file to its first content.
+    for version in versions:
+        for index in range(args.files):
+            key = f'/bench/file{index}.py'
+            final[key] = content(index, version)
+            scheduler.submit(key, '/bench', f'file{index}.py', 'python', final[key])
+            saves += 1
+            time.sleep(args.interval)
+    while scheduler.pending() or scheduler.running:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    scheduler.stop()
+
+    serial = sum(backend.latency([AnalysisRequest('', None, '', 'python', content(index, version), None, 0)])
+                 for version in versions for index in range(args.files))
+    latest = {}
+    for result in results:
+        latest[f"/bench/{result['path']}"] = result
+    stale = sum(1 for key, text in final.items()
+                if key not in latest or latest[key]['summary'] != backend.findings(text)['summary']
+                or latest[key]['findings'] != backend.findings(text)['findings'])
+    open_keys = {f'file{index}.py' for index in range(args.open)}
+    open_latency = [result['latency_ms'] / 1000 for result in results if result['path'] in open_keys]
+    background_latency = [result['latency_ms'] / 1000 for result in results if result['path'] not in open_keys]
+    outcomes = scheduler.outcomes
+
+    print(f"{args.files} files ({args.open} open), {saves} saves in {elapsed:.2f}s")
+    print(f"  model calls {scheduler.batches} ({saves / max(1, scheduler.batches):.1f} saves per call), "
+          f"model time {scheduler.model_seconds:.2f}s vs {serial:.2f}s analyzing every save alone")
+    print(f"  throughput {saves / elapsed:.0f} saves/s, {len(results)} results")
+    for name, latencies in (('open', open_latency), ('background', background_latency)):
+        print(f"  {name:10} latency p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms  ({len(latencies)} results)")
+    print('  outcomes ' + ', '.join(f'{name} {count}' for name, count in sorted(outcomes.items())))
+    failed = 0
+    if stale:
+        print(f"{stale} files ended on a result for superseded content")
+        failed = 1
+    if percentile(open_latency, 0.95) > args.max_open_p95:
+        print(f"open-file p95 latency is over {args.max_open_p95 * 1000:.0f} ms")
+        failed = 1
+    return failed
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Per-event cost of language detection: Pygments lookup vs. LanguageResolver.
+
+Run from anywhere: python benchmarks/bench_language.py
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from language import LanguageResolver  # noqa: E402
+
+SAMPLE_PATHS = [
+    'src/app/main.py', 'web/index.ts', 'web/App.tsx', 'lib/util.js', 'core/engine.cpp',
+    'core/engine.h', 'svc/Handler.java', 'svc/server.go', 'db/schema.sql', 'README.md',
+    'tools/Makefile', 'ci/Dockerfile', 'scripts/build.gradle', 'infra/main.tf', 'docs/api.rst',
+]
+
+STATIC_TABLE = {
+    '.py': 'python', '.ts': 'typescript', '.tsx': 'typescript', '.js': 'javascript',
+    '.cpp': 'cpp', '.h': 'cpp', '.java': 'java', '.go': 'go', '.sql': 'sql', '.md': 'markdown',
+}
+
+def bench_pygments(paths, iterations):
+    from pygments.lexers import get_lexer_for_filename
+    from pygments.util import ClassNotFound
+
+    def get_language(file_path):
+        try:
+            return get_lexer_for_filename(file_path).name.lower()
+        except ClassNotFound:
+            return "text"
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for path in paths:
+            get_language(path)
+    return time.perf_counter() - start
+
+def bench_resolver(paths, iterations):
+    resolver = LanguageResolver(STATIC_TABLE)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for path in paths:
+            resolver.resolve(path)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-event language detection')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    events = args.iterations * len(SAMPLE_PATHS)
+    before = bench_pygments(SAMPLE_PATHS, args.iterations)
+    after = bench_resolver(SAMPLE_PATHS, args.iterations)
+    print(f"events:            {events}")
+    print(f"pygments per call: {before / events * 1e6:10.2f} us")
+    print(f"resolver per call: {after / events * 1e6:10.2f} us")
+    print(f"speedup:           {before / after:10.1f}x")
+
+if __name__ == "__main__":
+    main()
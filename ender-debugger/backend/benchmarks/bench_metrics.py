@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""CPU cost of the metrics sampler while it tracks many processes.
+
+Spawns ``--processes`` idle children of this process (so the sampler picks
+them up as tracked children), samples at ``--rate`` Hz for ``--seconds`` and
+reports the sampler thread's share of one core, the process stride it
+settled on, and how far the tick rate drifted. Exits with status 1 when the
+share goes over ``--budget`` percent.
+
+Run from anywhere: python benchmarks/bench_metrics.py
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from metrics_sampler import MetricsCursor, MetricsSampler  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the system metrics sampler')
+    parser.add_argument('--rate', type=float, default=10.0, help='Samples per second')
+    parser.add_argument('--processes', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--budget', type=float, default=1.0, help='Allowed CPU, percent of one core')
+    args = parser.parse_args()
+
+    children = [subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3600)'])
+                for _ in range(args.processes)]
+    try:
+        sampler = MetricsSampler(interval=1 / args.rate)
+        if not sampler.start():
+            print("psutil is not installed")
+            return 1
+        cursor = MetricsCursor()
+        cursor.batch(sampler)
+        start = time.monotonic()
+        time.sleep(args.seconds)
+        elapsed = time.monotonic() - start
+        batch = cursor.batch(sampler) or {'series': {}}
+        sampler.stop()
+        share = sampler.cpu_used * 100
+        system = batch['series'].get('system.cpu_percent', {'t': []})
+        print(f"{len(sampler.tracked)} tracked processes, {len(sampler.series)} series, "
+              f"stride {sampler.stride}")
+        print(f"sampler CPU {share:.3f}% of one core, {len(system['t']) / elapsed:.1f} ticks/s "
+              f"(target {args.rate:g})")
+        return 1 if share > args.budget else 0
+    finally:
+        for child in children:
+            child.kill()
+            child.wait()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Trigram search index on a generated tree (100k files by default).
+
+Writes ``--files`` synthetic source files under a temporary directory (or
+indexes ``--root`` if given), builds the index under ``--budget-mb``, and
+reports build time, compactions, segment size and peak RSS. Then it times
+literal and regex queries against the index and against a brute-force scan
+of every file.
+
+Run from anywhere: python benchmarks/bench_search.py
+"""
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import resource
+import argparse
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from search_index import SearchIndex  # noqa: E402
+
+WORDS = ('request', 'response', 'handler', 'session', 'buffer', 'stream', 'config', 'client', 'server',
+         'record', 'event', 'index', 'cursor', 'token', 'parser', 'result', 'value', 'error', 'cache', 'queue')
+
+def generate(root, count, rng):
+    """Files of a few functions each, built from a small vocabulary so trigrams repeat like real code."""
+    for number in range(count):
+        directory = os.path.join(root, f'pkg{number % 100}', f'mod{number // 100 % 10}')
+        os.makedirs(directory, exist_ok=True)
+        lines = [f'import {rng.choice(WORDS)}', '']
+        for _ in range(rng.randint(3, 8)):
+            name = f'{rng.choice(WORDS)}_{rng.choice(WORDS)}'
+            lines += [f'def {name}({rng.choice(WORDS)}, {rng.choice(WORDS)}):',
+                      f'    {rng.choice(WORDS)} = {rng.choice(WORDS)}.get({rng.randint(0, 9999)})',
+                      f'    return {rng.choice(WORDS)}_{rng.choice(WORDS)}({rng.choice(WORDS)})', '']
+        if number % 1000 == 0:
+            lines.append(f'RARE_MARKER_{number} = True')
+        with open(os.path.join(directory, f'file{number}.py'), 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines))
+
+def walk(root):
+    for directory, _, files in os.walk(root):
+        for name in files:
+            yield os.path.join(directory, name)
+
+def brute_force(paths, regex):
+    hits = 0
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as file:
+            for line in file:
+                if regex.search(line):
+                    hits += 1
+    return hits
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trigram search index')
+    parser.add_argument('--files', type=int, default=100_000)
+    parser.add_argument('--root', default=None, help='Index an existing tree instead of generating one')
+    parser.add_argument('--budget-mb', type=int, default=64)
+    parser.add_argument('--brute-force', type=int, default=3, help='Queries to also time by scanning every file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ender-search-bench-')
+    try:
+        root = args.root
+        if root is None:
+            root = os.path.join(workdir, 'tree')
+            started = time.perf_counter()
+            generate(root, args.files, random.Random(0))
+            print(f"generated {args.files} files in {time.perf_counter() - started:.1f}s")
+        paths = list(walk(root))
+
+        index = SearchIndex(os.path.join(workdir, 'index'), memory_budget=args.budget_mb * 1024 * 1024)
+        started = time.perf_counter()
+        for path in paths:
+            text = index.read(path)
+            if text is not None:
+                index.add(path, root, text)
+        index.compact()
+        elapsed = time.perf_counter() - started
+        stats = index.stats()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"indexed {stats['files']} files in {elapsed:.1f}s ({len(paths) / elapsed:.0f} files/s), "
+              f"{stats['compactions']} compactions, segment {stats['segment_bytes'] / 2**20:.1f} MiB, "
+              f"peak RSS {peak:.0f} MiB")
+
+        queries = [('RARE_MARKER_5000', True), (r'def \w+_token\(', False), ('return cache_queue(', True),
+                   (r'get\(12\d\d\)', False), ('no such string anywhere', True)]
+        print(f"  {'query':32} {'matches':>8} {'first page ms':>14} {'all ms':>10}")
+        for pattern, literal in queries:
+            started = time.perf_counter()
+            results = index.search(pattern, literal=literal)
+            first = None
+            matches = 0
+            for _ in results:
+                matches += 1
+                if matches == 50:
+                    first = time.perf_counter() - started
+            total = time.perf_counter() - started
+            first = total if first is None else first
+            print(f"  {pattern:32} {matches:8} {first * 1000:14.1f} {total * 1000:10.1f}")
+        for pattern, literal in queries[:args.brute_force]:
+            regex = re.compile(re.escape(pattern) if literal else pattern)
+            started = time.perf_counter()
+            hits = brute_force(paths, regex)
+            print(f"  brute force {pattern:20} {hits:8} {'':>14} {(time.perf_counter() - started) * 1000:10.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Import-time cost of the backend entry points, from ``python -X importtime``.
+
+Each module is imported in a fresh interpreter. The heaviest imports are
+listed by cumulative time. The script exits with status 1 when a module's
+median import time goes over ``--budget-ms``, so it can guard against
+regressions in CI.
+
+Run from anywhere: python benchmarks/bench_startup.py
+"""
+import os
+import sys
+import statistics
+import subprocess
+import argparse
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+def import_times(module):
+    """Map of module name -> (self us, cumulative us) for one cold import of ``module``."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SRC, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark backend import time')
+    parser.add_argument('--modules', nargs='+', default=['websocket_server', 'main', 'file_monitor'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='Fail if any module takes longer than this to import')
+    args = parser.parse_args()
+
+    over_budget = []
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        totals = [run[module][1] / 1000 for run in runs]
+        median = statistics.median(totals)
+        print(f"{module}: median {median:.1f} ms, min {min(totals):.1f} ms over {args.runs} runs")
+        heaviest = sorted(runs[-1].items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in heaviest[1:args.top + 1]:
+            print(f"  {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+        if args.budget_ms is not None and median > args.budget_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"over the {args.budget_ms} ms budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Symbol index cost: per-file parse time, and query latency once the index is built.
+
+Indexes every source file under ``--root`` (default: this backend) ``--copies``
+times under distinct paths to simulate a larger repository, then times
+"where is X defined/used" queries for names picked from the index.
+
+Run from anywhere: python benchmarks/bench_symbols.py
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from symbol_index import EXTENSION_LANGUAGES, SymbolIndex  # noqa: E402
+
+def source_files(root):
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if not name.startswith('.') and name not in ('node_modules', '__pycache__')]
+        for name in files:
+            language = EXTENSION_LANGUAGES.get(os.path.splitext(name)[1].lower())
+            if language is not None:
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, encoding='utf-8') as file:
+                        yield path, language, file.read()
+                except (OSError, UnicodeDecodeError):
+                    continue
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the symbol index')
+    parser.add_argument('--root', default=os.path.join(SRC, '..'))
+    parser.add_argument('--copies', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    files = list(source_files(args.root))
+    index = SymbolIndex(None)
+    start = time.perf_counter()
+    for copy in range(args.copies):
+        for path, language, text in files:
+            index.update(f'/copy{copy}{path}', f'/copy{copy}', language, text)
+    elapsed = time.perf_counter() - start
+    count = len(files) * args.copies
+    print(f"indexed {count} files in {elapsed:.2f}s ({elapsed / count * 1000:.2f} ms/file), {index.stats()}")
+
+    names = random.Random(0).choices(sorted(index.defined_in), k=args.queries)
+    start = time.perf_counter()
+    for name in names:
+        index.definitions(name, limit=20)
+        index.references(name, limit=20)
+    elapsed = time.perf_counter() - start
+    print(f"{args.queries} definition+reference queries: {elapsed / args.queries * 1000:.3f} ms each")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Slowdown of code running under the variable-state trace recorder.
+
+Times four functions untraced, then with the recorder watching some of
+their locals:
+
+- ``workload``: decodes and aggregates JSON events, with two watched stores
+  per event, as in the application code the debugger is pointed at
+- ``dense``: a string-splitting loop storing a watched variable on three of
+  its six lines
+- ``untraced``: the same loop, not watched, while other functions are; this
+  is the cost the recorder puts on everything else in the process
+- ``tight``: a loop that does nothing but update a watched counter (worst case)
+
+Each watched store costs one Python-level callback (about a microsecond),
+so the slowdown depends on how much work happens between watched stores.
+
+Reports the slowdown, records per second, and the time the streamer takes
+to pack them into binary records (off the traced thread). Exits with
+status 1 when the ``workload`` slowdown goes over ``--max-slowdown`` (2x)
+with ``sys.monitoring``, or over ``--max-settrace-slowdown`` (5x) with the
+``settrace`` fallback. The fallback still calls its hook on every frame, so
+even unwatched code runs about 2x slower under it.
+
+Run from anywhere: python benchmarks/bench_trace.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from trace_recorder import RECORD, TraceRecorder, TraceStreamer, WatchSpec  # noqa: E402
+
+EVENTS = [json.dumps({'id': index, 'kind': ('click', 'view', 'buy')[index % 3], 'user': f'u{index % 50}',
+                      'amount': index * 7 % 300, 'tags': ['web', 'eu'] if index % 2 else ['app']})
+          for index in range(2000)]
+LINES = [f'{index} GET /api/v{index % 3}/items/{index % 97} status={200 + index % 5} bytes={index * 37 % 9000}'
+         for index in range(2000)]
+
+def workload(events):
+    users = {}
+    total = 0
+    for raw in events:
+        event = json.loads(raw)
+        if event['kind'] != 'buy' or 'web' not in event['tags']:
+            continue
+        user = event['user']
+        users[user] = users.get(user, 0) + event['amount']
+        total += event['amount']
+    return total
+
+def dense(lines):
+    counts = {}
+    total = 0
+    for line in lines:
+        fields = line.split()
+        method, path = fields[1], fields[2]
+        status = int(fields[3].partition('=')[2])
+        key = f'{method} {path.rsplit("/", 1)[0]}'
+        counts[key] = counts.get(key, 0) + 1
+        total += int(fields[4].partition('=')[2]) if status == 200 else 0
+    return total
+
+def untraced(lines):
+    counts = {}
+    total = 0
+    for line in lines:
+        fields = line.split()
+        method, path = fields[1], fields[2]
+        status = int(fields[3].partition('=')[2])
+        key = f'{method} {path.rsplit("/", 1)[0]}'
+        counts[key] = counts.get(key, 0) + 1
+        total += int(fields[4].partition('=')[2]) if status == 200 else 0
+    return total
+
+def tight(n):
+    total = 0
+    for i in range(n):
+        total += i
+    return total
+
+def best(function, argument, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trace recorder overhead')
+    parser.add_argument('--backend', choices=('monitoring', 'settrace'), default=None,
+                        help='Defaults to sys.monitoring where available (3.12+)')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per round; the fastest counts')
+    parser.add_argument('--max-slowdown', type=float, default=2.0,
+                        help='Workload slowdown allowed with the sys.monitoring backend')
+    parser.add_argument('--max-settrace-slowdown', type=float, default=5.0,
+                        help='Workload slowdown allowed with the settrace fallback (before 3.12)')
+    args = parser.parse_args()
+
+    cases = [('workload', workload, EVENTS), ('dense', dense, LINES), ('untraced', untraced, LINES),
+             ('tight', tight, 20000)]
+    recorder = TraceRecorder([WatchSpec('workload', ['event', 'total']), WatchSpec('dense', ['status', 'key', 'total']),
+                              WatchSpec('tight', ['total'])], capacity=1 << 20)
+    streamer = TraceStreamer(recorder, -1)
+    baseline = {name: float('inf') for name, _, _ in cases}
+    traced = dict(baseline)
+    counts = {name: 0 for name, _, _ in cases}
+    pack_seconds = packed = 0
+    # Alternate untraced and traced rounds so machine noise hits both alike.
+    for _ in range(args.rounds):
+        for name, function, argument in cases:
+            baseline[name] = min(baseline[name], best(function, argument, args.repeats))
+        for name, function, argument in cases:
+            recorder.start(args.backend)
+            try:
+                traced[name] = min(traced[name], best(function, argument, args.repeats))
+            finally:
+                recorder.stop()
+            started = time.perf_counter()
+            chunk = streamer.chunk()
+            pack_seconds += time.perf_counter() - started
+            count = len(chunk[1]) // RECORD.size if chunk else 0
+            packed += count
+            counts[name] += count
+    records = {name: counts[name] / (args.rounds * args.repeats) for name in counts}
+
+    print(f"Python {sys.version.split()[0]}, backend {recorder.backend}")
+    print(f"  {'case':10} {'untraced ms':>12} {'traced ms':>10} {'slowdown':>9} {'records':>8} {'records/s':>10}")
+    for name, _, _ in cases:
+        slowdown = traced[name] / baseline[name]
+        rate = records[name] / traced[name] if traced[name] else 0
+        print(f"  {name:10} {baseline[name] * 1000:12.2f} {traced[name] * 1000:10.2f} {slowdown:8.2f}x "
+              f"{records[name]:8.0f} {rate:10.0f}")
+    if packed:
+        print(f"  streamer packs {packed / pack_seconds:.0f} records/s into {RECORD.size}-byte records")
+    slowdown = traced['workload'] / baseline['workload']
+    limit = args.max_slowdown if recorder.backend == 'monitoring' else args.max_settrace_slowdown
+    if slowdown > limit:
+        print(f"workload slowdown {slowdown:.2f}x is over {limit:.2f}x for the {recorder.backend} backend")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
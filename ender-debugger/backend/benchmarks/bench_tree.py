@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Opening a large project through the file tree service without stalling the event loop.
+
+Generates a project of ``--files`` files (default 50,000) in nested
+directories, then walks the whole tree through ``FileTree`` the way a
+client would: every directory, page by page (``--page-size``), with
+read-ahead of the subdirectories on each page. A ticker coroutine stands in
+for the other clients and records how late the loop runs it.
+
+Reports the cold walk (directories read in the executor), the warm walk
+(served from the cache), the longest loop stall during each, how long
+reading every directory on the loop (as a blocking server does) would hold
+it, and how fast create/delete events are applied to the cache. Exits with
+status 1 when the worst stall goes over ``--max-stall-ms``.
+
+Run from anywhere: python benchmarks/bench_tree.py
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from file_tree import FileTree  # noqa: E402
+
+def generate(root: str, files: int, fanout: int, per_directory: int) -> int:
+    """Write ``files`` small files, ``per_directory`` to a directory, ``fanout`` subdirectories each, breadth-first."""
+    directories = 0
+    written = 0
+    pending = [root]
+    while written < files:
+        directory = pending.pop(0)
+        for index in range(min(per_directory, files - written)):
+            with open(os.path.join(directory, f'module_{index}.py'), 'w') as file:
+                file.write(f'value = {index}\n')
+            written += 1
+        for index in range(fanout):
+            child = os.path.join(directory, f'package_{index}')
+            os.mkdir(child)
+            directories += 1
+            pending.append(child)
+    return directories
+
+async def ticker(stalls: list, stop: asyncio.Event, interval: float = 0.001):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - started - interval)
+
+async def walk(tree: FileTree, root: str, page_size: int):
+    directories = entries = 0
+    pending = ['']
+    while pending:
+        path = pending.pop()
+        directory = os.path.join(root, path) if path else root
+        cursor = None
+        while True:
+            listing = await tree.listing(directory, root)
+            rows, cursor = listing.page(cursor, page_size)
+            tree.prefetch(directory, root, rows)
+            entries += len(rows)
+            pending.extend(os.path.join(path, name) for name, is_dir, _ in rows if is_dir)
+            if cursor is None:
+                break
+        directories += 1
+    return directories, entries
+
+async def measure(tree: FileTree, root: str, page_size: int):
+    stalls = []
+    stop = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(stalls, stop))
+    started = time.perf_counter()
+    directories, entries = await walk(tree, root, page_size)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    return elapsed, directories, entries, max(stalls, default=0)
+
+async def run(args, root: str):
+    tree = FileTree()
+    tree.add_root(root)
+    cold = await measure(tree, root, args.page_size)
+    warm = await measure(tree, root, args.page_size)
+
+    started = time.perf_counter()
+    for directory in list(tree.listings):
+        tree._scan(directory, root)
+    blocking = time.perf_counter() - started
+
+    events = [{'type': kind, 'root': root, 'path': f'package_0/new_{index}.py', 'language': 'python'}
+              for kind in ('file_created', 'file_deleted') for index in range(5000)]
+    started = time.perf_counter()
+    for event in events:
+        tree.apply(event)
+    applied = len(events) / (time.perf_counter() - started)
+    await asyncio.sleep(0.1)  # Let the directory checks the deletes scheduled finish.
+    return cold, warm, blocking, applied, tree
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the file tree service')
+    parser.add_argument('--files', type=int, default=50000)
+    parser.add_argument('--per-directory', type=int, default=40)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--max-stall-ms', type=float, default=100.0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_tree_')
+    try:
+        started = time.perf_counter()
+        directories = generate(root, args.files, args.fanout, args.per_directory)
+        print(f"Generated {args.files} files in {directories} directories in {time.perf_counter() - started:.1f}s")
+        cold, warm, blocking, applied, tree = asyncio.run(run(args, root))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    for name, (elapsed, walked, entries, stall) in (('cold', cold), ('warm', warm)):
+        print(f"  {name} walk: {walked} directories, {entries} entries in {elapsed * 1000:.0f} ms, "
+              f"longest loop stall {stall * 1000:.1f} ms")
+    print(f"  cache: {len(tree.listings)} listings, {tree.entries} entries")
+    print(f"  reading every directory on the loop would hold it for {blocking * 1000:.0f} ms")
+    print(f"  events applied: {applied:.0f}/s")
+    stall = max(cold[3], warm[3])
+    if stall * 1000 > args.max_stall_ms:
+        print(f"loop stalled {stall * 1000:.1f} ms, over {args.max_stall_ms:.0f} ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Bytes on the wire and encode+decode throughput per event for each wire format.
+
+Formats whose optional packages (msgpack, cbor2, zstandard) are not
+installed are skipped. ``json+permessage-deflate`` approximates the
+websockets transport extension: raw deflate with a context shared across
+messages, applied to every frame regardless of size.
+
+Run from anywhere: python benchmarks/bench_wire.py
+"""
+import os
+import sys
+import time
+import zlib
+import argparse
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from wire_format import Wire, available_compressions, available_formats  # noqa: E402
+
+def sample_events(size):
+    """file_modified events carrying real source text cut to ``size`` characters."""
+    sources = []
+    for name in sorted(os.listdir(SRC)):
+        if name.endswith('.py'):
+            with open(os.path.join(SRC, name), encoding='utf-8') as file:
+                sources.append((name, file.read()))
+    events = []
+    for seq, (name, text) in enumerate(sources):
+        while len(text) < size:
+            text += text
+        events.append({'type': 'file_modified', 'root': '/home/dev/project', 'path': f'src/{name}',
+                       'language': 'python', 'seq': seq, 'content': text[:size],
+                       'hash': '0123456789abcdef0123456789abcdef', 'timestamp': 1700000000.0 + seq})
+    return events
+
+def bench_wire(wire, events, iterations):
+    total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for event in events:
+            frame = wire.encode(event)
+            total_bytes += len(frame)
+            wire.decode(frame)
+    return time.perf_counter() - start, total_bytes
+
+def bench_permessage_deflate(events, iterations):
+    wire = Wire()
+    total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        compressor = zlib.compressobj(wbits=-15)
+        decompressor = zlib.decompressobj(wbits=-15)
+        for event in events:
+            frame = compressor.compress(wire.encode(event).encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            total_bytes += len(frame)
+            wire.decode(decompressor.decompress(frame).decode('utf-8'))
+    return time.perf_counter() - start, total_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WebSocket wire formats')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 4096, 65536])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        events = sample_events(size)
+        count = len(events) * args.iterations
+        print(f"content size {size} bytes, {count} events")
+        print(f"  {'wire':28} {'bytes/event':>12} {'events/s':>12}")
+        rows = []
+        for format in available_formats():
+            for compression in available_compressions():
+                rows.append((f"{format}+{compression}", bench_wire(Wire(format, compression), events, args.iterations)))
+        rows.append(('json+permessage-deflate', bench_permessage_deflate(events, args.iterations)))
+        for name, (elapsed, total_bytes) in rows:
+            print(f"  {name:28} {total_bytes / count:12.0f} {count / elapsed:12.0f}")
+
+if __name__ == "__main__":
+    main()
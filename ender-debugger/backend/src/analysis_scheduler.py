@@ -0,0 +1,310 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from content_reader import ContentReader, hash_bytes
+from instrumentation import ANALYSIS_BATCH_SIZE, ANALYSIS_REQUESTS, ANALYSIS_SECONDS
+from symbol_index import EXTENSION_LANGUAGES
+
+class AnalysisRequest:
+    """One file's content, waiting for or going through the model."""
+    __slots__ = ('key', 'root', 'path', 'language', 'content', 'digest', 'queued', 'submitted', 'cancelled')
+
+    def __init__(self, key: str, root: Optional[str], path: str, language: Optional[str],
+                 content: Optional[str], digest: Optional[str], queued: float):
+        self.key = key
+        self.root = root
+        self.path = path
+        self.language = language
+        self.content = content
+        self.digest = digest
+        # When the key first joined the queue (its batching deadline) and when this content arrived (its latency).
+        self.queued = queued
+        self.submitted = queued
+        self.cancelled = False
+
+class FakeModelBackend:
+    """Deterministic stand-in for a local model runner, for measuring the scheduler offline.
+
+    A call sleeps ``base_latency + request_latency * n + kilobyte_latency * KB``,
+    the shape of a batched model call where a fixed cost per call is shared by
+    the whole batch, and returns findings computed from the content alone, so
+    the same content always gets the same answer.
+    """
+    name = 'fake'
+
+    def __init__(self, base_latency: float = 0.05, request_latency: float = 0.005,
+                 kilobyte_latency: float = 0.001, max_batch: int = 8, max_findings: int = 20):
+        self.base_latency = base_latency
+        self.request_latency = request_latency
+        self.kilobyte_latency = kilobyte_latency
+        self.max_batch = max_batch
+        self.max_findings = max_findings
+
+    def latency(self, requests: List[AnalysisRequest]) -> float:
+        kilobytes = sum(len(request.content) for request in requests) / 1024
+        return self.base_latency + self.request_latency * len(requests) + self.kilobyte_latency * kilobytes
+
+    def analyze(self, requests: List[AnalysisRequest]) -> List[Dict[str, Any]]:
+        time.sleep(self.latency(requests))
+        return [self.findings(request.content) for request in requests]
+
+    def findings(self, content: str) -> Dict[str, Any]:
+        findings = []
+        lines = content.splitlines()
+        for number, line in enumerate(lines, 1):
+            marker = next((marker for marker in ('TODO', 'FIXME', 'XXX') if marker in line), None)
+            if marker is not None:
+                findings.append({'line': number, 'severity': 'info', 'message': f'{marker} left in the code'})
+            if line.strip() in ('except:', 'catch {'):
+                findings.append({'line': number, 'severity': 'warning', 'message': 'Bare handler catches everything'})
+            if len(line) > 120:
+                findings.append({'line': number, 'severity': 'hint', 'message': f'Line is {len(line)} characters long'})
+            if len(findings) >= self.max_findings:
+                break
+        return {'findings': findings[:self.max_findings], 'summary': f'{len(lines)} lines, {len(findings)} findings'}
+
+# Backends selectable with --analysis-backend.
+BACKENDS = {'fake': FakeModelBackend}
+
+def create_backend(name: str):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown analysis backend {name!r}; choose from {', '.join(sorted(BACKENDS))}")
+
+class AnalysisScheduler:
+    """Background thread that feeds file changes to a model backend.
+
+    - One request per file: newer content replaces a pending request in
+      place (keeping its queue position) and marks an in-flight one
+      cancelled, so its stale result is never delivered.
+    - Files open in any client (``set_open``) are queued ahead of the rest.
+    - Requests are micro-batched: the worker holds the oldest request up to
+      ``batch_window`` seconds so a burst of saves shares one model call of
+      up to ``backend.max_batch`` files.
+    - Results are cached by content hash and language; a revert, or a copy
+      of another file, is answered without calling the model.
+
+    Changes without content are read here, off the event loop. Each result
+    is handed to ``on_result`` as an ``analysis`` message.
+    """
+
+    def __init__(self, backend, on_result: Callable[[Dict[str, Any]], None], batch_window: float = 0.02,
+                 cache_size: int = 4096):
+        self.backend = backend
+        self.on_result = on_result
+        self.batch_window = batch_window
+        self.max_batch = max(1, backend.max_batch)
+        self.cache_size = cache_size
+        self.cache: 'OrderedDict[Tuple[str, Optional[str]], Dict[str, Any]]' = OrderedDict()
+        self.content_reader = ContentReader()
+        # Pending requests by key, oldest first; files open in a client go first.
+        self.focused: 'OrderedDict[str, AnalysisRequest]' = OrderedDict()
+        self.background: 'OrderedDict[str, AnalysisRequest]' = OrderedDict()
+        self.running: Dict[str, AnalysisRequest] = {}
+        self.open_counts: Dict[str, int] = {}
+        self.open_by_client: Dict[Hashable, Set[str]] = {}
+        self.outcomes: Dict[str, int] = {}
+        self.batches = 0
+        self.model_seconds = 0.0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='analysis-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pending(self) -> int:
+        return len(self.focused) + len(self.background)
+
+    def submit(self, key: str, root: Optional[str], path: str, language: Optional[str],
+               content: Optional[str] = None, digest: Optional[str] = None):
+        """Queue new content of ``key``; cheap enough to call from the event loop.
+
+        Without ``content`` the file is read when its turn comes.
+        """
+        if language is None:
+            # Opened files and offline changes arrive without one; cached results are keyed by it.
+            language = EXTENSION_LANGUAGES.get(os.path.splitext(path)[1].lower())
+        if content is not None and digest is None:
+            digest = hash_bytes(content.encode('utf-8'))
+        now = time.monotonic()
+        with self._condition:
+            running = self.running.get(key)
+            latest = self.focused.get(key) or self.background.get(key) or running
+            if digest is not None and latest is not None and not latest.cancelled and latest.digest == digest:
+                self._count('duplicate')
+                return
+            if running is not None and not running.cancelled:
+                running.cancelled = True
+                self._count('cancelled')
+            cached = self.cache.get((digest, language)) if digest is not None else None
+            queue = self.focused if key in self.open_counts else self.background
+            previous = queue.get(key)
+            request = AnalysisRequest(key, root, path, language, content, digest,
+                                      previous.queued if previous is not None else now)
+            request.submitted = now
+            if previous is not None:
+                self._count('coalesced')
+            if cached is not None:
+                queue.pop(key, None)
+                self.cache.move_to_end((digest, language))
+            else:
+                queue[key] = request
+                self._condition.notify()
+        if cached is not None:
+            self._deliver(request, cached, True, 0)
+
+    def cancel(self, key: str):
+        """Drop whatever is pending or running for a deleted file."""
+        with self._condition:
+            request = self.focused.pop(key, None) or self.background.pop(key, None)
+            running = self.running.get(key)
+            if running is not None and not running.cancelled:
+                running.cancelled = True
+                request = running
+            if request is not None:
+                self._count('cancelled')
+
+    def set_open(self, client: Hashable, keys: Iterable[str]) -> List[str]:
+        """Replace the files ``client`` has open; returns the keys no client had open before."""
+        keys = set(keys)
+        opened = []
+        with self._condition:
+            previous = self.open_by_client.pop(client, set())
+            if keys:
+                self.open_by_client[client] = keys
+            for key in keys - previous:
+                self.open_counts[key] = self.open_counts.get(key, 0) + 1
+                if self.open_counts[key] == 1:
+                    opened.append(key)
+                    request = self.background.pop(key, None)
+                    if request is not None:
+                        self.focused[key] = request
+            for key in previous - keys:
+                self.open_counts[key] -= 1
+                if not self.open_counts[key]:
+                    del self.open_counts[key]
+                    request = self.focused.pop(key, None)
+                    if request is not None:
+                        self.background[key] = request
+        return opened
+
+    def _count(self, outcome: str, amount: int = 1):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + amount
+        ANALYSIS_REQUESTS.labels(outcome).inc(amount)
+
+    def _next_batch(self) -> Optional[List[AnalysisRequest]]:
+        while True:
+            if self._stopped:
+                return None
+            pending = self.pending()
+            if not pending:
+                self._condition.wait()
+                continue
+            if pending < self.max_batch:
+                oldest = min(next(iter(queue.values())).queued for queue in (self.focused, self.background) if queue)
+                remaining = oldest + self.batch_window - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+            break
+        batch = []
+        for queue in (self.focused, self.background):
+            while queue and len(batch) < self.max_batch:
+                request = queue.popitem(last=False)[1]
+                self.running[request.key] = request
+                batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._process(batch)
+            except Exception as e:
+                logging.error(f"Error analyzing {len(batch)} files: {e}")
+                with self._condition:
+                    for request in batch:
+                        if self.running.get(request.key) is request:
+                            del self.running[request.key]
+
+    def _process(self, batch: List[AnalysisRequest]):
+        answered: List[Tuple[AnalysisRequest, Dict[str, Any], bool]] = []
+        ready = []
+        for request in batch:
+            if request.cancelled:
+                continue
+            if request.content is None:
+                result = self.content_reader.read(request.key)
+                if result.error is not None:
+                    self._count('skipped')  # Gone or unreadable since it was queued.
+                    continue
+                if result.binary or result.streamed or result.truncated or result.text is None:
+                    self._count('skipped')  # Too large or not text for the model.
+                    continue
+                request.content, request.digest = result.text, result.digest
+            with self._condition:
+                cached = self.cache.get((request.digest, request.language))
+                if cached is not None:
+                    self.cache.move_to_end((request.digest, request.language))
+            if cached is not None:
+                answered.append((request, cached, True))
+            else:
+                ready.append(request)
+        if ready:
+            ANALYSIS_BATCH_SIZE.observe(len(ready))
+            started = time.perf_counter()
+            try:
+                results = self.backend.analyze(ready)
+            except Exception as e:
+                logging.error(f"Analysis backend {self.backend.name} failed on {len(ready)} files: {e}")
+                self._count('failed', len(ready))
+                results = []
+            self.model_seconds += time.perf_counter() - started
+            self.batches += 1
+            with self._condition:
+                for request, result in zip(ready, results):
+                    # Cached even when cancelled meanwhile: the content may well come back.
+                    self.cache[(request.digest, request.language)] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+            answered.extend((request, result, False) for request, result in zip(ready, results))
+        with self._condition:
+            for request in batch:
+                if self.running.get(request.key) is request:
+                    del self.running[request.key]
+            deliver = [answer for answer in answered if not answer[0].cancelled]
+        for request, result, cached in deliver:
+            self._deliver(request, result, cached, len(ready))
+
+    def _deliver(self, request: AnalysisRequest, result: Dict[str, Any], cached: bool, batch_size: int):
+        latency = time.monotonic() - request.submitted
+        ANALYSIS_SECONDS.observe(latency)
+        self._count('cached' if cached else 'analyzed')
+        message = {'type': 'analysis', 'root': request.root, 'path': request.path, 'language': request.language,
+                   'hash': request.digest, 'backend': self.backend.name, 'cached': cached,
+                   'latency_ms': round(latency * 1000, 1)}
+        if not cached:
+            message['batch_size'] = batch_size
+        message.update(result)
+        try:
+            self.on_result(message)
+        except Exception as e:
+            logging.error(f"Error publishing analysis of {request.key}: {e}")
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+class BlobStore:
+    """Content-addressed LRU store of file contents, bounded by ``max_bytes``.
+
+    Keys are the content hashes carried on change events, so identical
+    content seen in several events or files is held once. Sizes are the
+    UTF-8 byte length, the same measure as the file on disk. The digests of
+    evicted blobs are passed to ``on_evict``, outside the lock.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024,
+                 on_evict: Optional[Callable[[List[str]], None]] = None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self._blobs: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, digest: str, content: str):
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return
+            self._blobs[digest] = (content, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                old, (_, old_size) = self._blobs.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old)
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                self.misses += 1
+                return None
+            self._blobs.move_to_end(digest)
+            self.hits += 1
+            return blob[0]
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._blobs
+
+    def __len__(self):
+        return len(self._blobs)
+
+class PathHashes:
+    """Last emitted content hash per path, for dropping saves that changed nothing.
+
+    Bounded to ``max_entries`` paths, least recently written first, and
+    ``forget`` drops every path holding any of the given digests, so the
+    map can shrink with the blob store instead of growing with every file
+    ever saved. Safe to use from the read pool's workers and the event loop.
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[str, str]" = OrderedDict()
+        self._paths: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[str]:
+        return self._hashes.get(path)
+
+    def __setitem__(self, path: str, digest: str):
+        with self._lock:
+            self._unlink_locked(path)
+            self._hashes[path] = digest
+            self._paths.setdefault(digest, set()).add(path)
+            while len(self._hashes) > self.max_entries:
+                self._unlink_locked(next(iter(self._hashes)))
+
+    def pop(self, path: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            digest = self._unlink_locked(path)
+        return default if digest is None else digest
+
+    def forget(self, digests: List[str]):
+        with self._lock:
+            for digest in digests:
+                for path in self._paths.pop(digest, ()):
+                    self._hashes.pop(path, None)
+
+    def _unlink_locked(self, path: str) -> Optional[str]:
+        digest = self._hashes.pop(path, None)
+        if digest is not None:
+            paths = self._paths.get(digest)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._paths[digest]
+        return digest
+
+    def __len__(self):
+        return len(self._hashes)
+
+class HeldBlobs:
+    """Bounded record of which blobs one client has been sent and can reuse."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._held: "OrderedDict[str, None]" = OrderedDict()
+
+    def add(self, digest: str):
+        self._held[digest] = None
+        self._held.move_to_end(digest)
+        if len(self._held) > self.max_entries:
+            self._held.popitem(last=False)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._held
@@ -0,0 +1,160 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Union
+import websockets
+from file_delta import ClientSyncState
+from blob_store import HeldBlobs
+from wire_format import JSON_WIRE, Frame, Wire, WireMessage
+from instrumentation import SEND_SECONDS, SENT_BYTES
+
+_SEND_SECONDS = SEND_SECONDS.labels()
+_SENT_BYTES = SENT_BYTES.labels()
+
+# What to do when a client's outbound queue is full.
+OVERFLOW_COALESCE = 'coalesce'      # Replace the queued version of the same path, else request a resync.
+OVERFLOW_DISCONNECT = 'disconnect'  # Close the connection; the client reconnects and resyncs.
+OVERFLOW_POLICIES = (OVERFLOW_COALESCE, OVERFLOW_DISCONNECT)
+
+RESYNC_REQUIRED = WireMessage({'type': 'resync_required'})
+
+class _Outbound:
+    __slots__ = ('message', 'path')
+
+    def __init__(self, message: Frame, path: Optional[str]):
+        self.message = message
+        self.path = path
+
+class ClientSession:
+    """One connected client: a bounded outbound queue drained by its own writer task.
+
+    Messages are encoded once per wire format and shared between all
+    sessions on that wire, so a slow client only ever delays itself.
+    """
+
+    def __init__(self, websocket: websockets.WebSocketServerProtocol,
+                 max_queue: int = 1024, overflow_policy: str = OVERFLOW_COALESCE):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.sync = ClientSyncState()
+        self.held_blobs = HeldBlobs()
+        # Set by the client's capabilities message; only such clients get hash references.
+        self.blob_refs = False
+        # Serialization and compression negotiated through the capabilities message.
+        self.wire: Wire = JSON_WIRE
+        self.queue: Deque[_Outbound] = deque()
+        self._latest: Dict[str, _Outbound] = {}
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        self.closed = True
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def wait_for_room(self):
+        """Wait until the queue is at most half full; for producers that can pause instead of overflowing it."""
+        while not self.closed and len(self.queue) > self.max_queue // 2:
+            self._room.clear()
+            await self._room.wait()
+
+    def frame(self, message: Union[Frame, WireMessage]) -> Frame:
+        return message.frame(self.wire) if isinstance(message, WireMessage) else message
+
+    def enqueue(self, message: Union[Frame, WireMessage], path: Optional[str] = None, seq: Optional[int] = None,
+                full_message: Optional[Union[Frame, WireMessage]] = None) -> bool:
+        """Queue a message; ``full_message`` is the patch-free form used if this entry gets coalesced."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_queue:
+            if not self._handle_overflow(path, self.frame(full_message or message)):
+                return False
+            if path is not None and seq is not None:
+                self.sync.record_sent(path, seq)
+            return True
+        entry = _Outbound(self.frame(message), path)
+        self.queue.append(entry)
+        if path is not None:
+            self._latest[path] = entry
+            if seq is not None:
+                self.sync.record_sent(path, seq)
+        self._ready.set()
+        return True
+
+    def _handle_overflow(self, path: Optional[str], full_message: Frame) -> bool:
+        if self.overflow_policy == OVERFLOW_DISCONNECT:
+            logging.warning("Client send queue overflowed, disconnecting it")
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self._latest.clear()
+            self.closed = True
+            asyncio.ensure_future(self.websocket.close(code=1013, reason='resync required'))
+            return False
+
+        queued = self._latest.get(path) if path is not None else None
+        if queued is not None:
+            # Drop the intermediate version; full content keeps the client consistent
+            # even though it never saw the versions in between.
+            queued.message = full_message
+            self.coalesced += 1
+            return True
+
+        logging.warning("Client send queue overflowed, requesting resync")
+        self.dropped += len(self.queue) + 1
+        self.queue.clear()
+        self._latest.clear()
+        self.sync = ClientSyncState(self.sync.max_unacked)
+        self.held_blobs = HeldBlobs(self.held_blobs.max_entries)
+        self.queue.append(_Outbound(self.frame(RESYNC_REQUIRED), None))
+        self._ready.set()
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queue_depth': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced
+        }
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                entry = self.queue.popleft()
+                self._room.set()
+                if entry.path is not None and self._latest.get(entry.path) is entry:
+                    del self._latest[entry.path]
+                started = time.perf_counter()
+                await self.websocket.send(entry.message)
+                _SEND_SECONDS.observe(time.perf_counter() - started)
+                _SENT_BYTES.inc(len(entry.message))
+                self.sent += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error sending message to client: {e}")
+        finally:
+            self.closed = True
+            self._room.set()
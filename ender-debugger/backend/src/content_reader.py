@@ -0,0 +1,121 @@
+import os
+import codecs
+import hashlib
+import logging
+from typing import Iterator, Optional
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> Optional[str]:
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+class FileContent:
+    """Result of a bounded read.
+
+    ``text`` is None for binary files and for files that are streamed in
+    chunks instead of being held in memory at once. ``digest`` is the hash
+    of the raw bytes when the whole file was read. ``error`` is set (and
+    ``text`` is None) when the file could not be read at all, so callers
+    never mistake a vanished file for an empty one.
+    """
+    __slots__ = ('text', 'size', 'binary', 'truncated', 'streamed', 'digest', 'error')
+
+    def __init__(self, text: Optional[str], size: int, binary: bool = False,
+                 truncated: bool = False, streamed: bool = False, digest: Optional[str] = None,
+                 error: Optional[str] = None):
+        self.text = text
+        self.size = size
+        self.binary = binary
+        self.truncated = truncated
+        self.streamed = streamed
+        self.digest = digest
+        self.error = error
+
+class ContentReader:
+    """Reads watched files without ever pulling an unbounded file into memory.
+
+    - Files whose first ``sniff_size`` bytes contain NUL or are not valid
+      UTF-8 are reported as binary and never read further.
+    - Files up to ``stream_threshold`` bytes are read whole.
+    - Files up to ``max_size`` bytes are marked ``streamed``; callers pull
+      them through ``iter_chunks``, which decodes one chunk at a time.
+    - Anything larger returns a ``preview_size`` preview marked ``truncated``.
+    """
+
+    def __init__(self,
+                 max_size: int = 8 * 1024 * 1024,
+                 stream_threshold: int = 1024 * 1024,
+                 preview_size: int = 64 * 1024,
+                 sniff_size: int = 8192,
+                 chunk_size: int = 256 * 1024):
+        self.max_size = max_size
+        self.stream_threshold = stream_threshold
+        self.preview_size = preview_size
+        self.sniff_size = sniff_size
+        self.chunk_size = chunk_size
+
+    def read(self, file_path: str) -> FileContent:
+        try:
+            with open(file_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                head = file.read(min(self.sniff_size, size) if size else self.sniff_size)
+                if self._looks_binary(head, complete=len(head) >= size):
+                    return FileContent(None, size, binary=True)
+                if size > self.max_size:
+                    preview = head + file.read(max(0, self.preview_size - len(head)))
+                    return FileContent(self._decode_partial(preview), size, truncated=True)
+                if size > self.stream_threshold:
+                    return FileContent(None, size, streamed=True)
+                data = head + file.read()
+                return FileContent(data.decode('utf-8', errors='replace'), len(data), digest=hash_bytes(data))
+        except Exception as e:
+            logging.error(f"Error reading file {file_path}: {e}")
+            return FileContent(None, 0, error=str(e))
+
+    def iter_chunks(self, file_path: str) -> Iterator[str]:
+        """Decode ``file_path`` in ``chunk_size`` byte reads, one chunk in memory at a time.
+
+        Each read is bounded by the file's current size, so a file that
+        shrinks mid-stream ends the stream early instead of faulting.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        with open(file_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            offset = 0
+            while offset < size:
+                size = min(size, os.fstat(file.fileno()).st_size)
+                want = min(self.chunk_size, size - offset)
+                data = file.read(want) if want > 0 else b''
+                offset += len(data)
+                final = len(data) < want or offset >= size
+                text = decoder.decode(data, final=final)
+                if data or text:
+                    yield text
+                if len(data) < want or not data:
+                    return
+
+    def chunk_count(self, size: int) -> int:
+        return max(1, -(-size // self.chunk_size))
+
+    @staticmethod
+    def _looks_binary(head: bytes, complete: bool) -> bool:
+        if b'\x00' in head:
+            return True
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(head, final=complete)
+        except UnicodeDecodeError:
+            return True
+        return False
+
+    @staticmethod
+    def _decode_partial(data: bytes) -> str:
+        # The preview may end in the middle of a multi-byte sequence.
+        return codecs.getincrementaldecoder('utf-8')(errors='replace').decode(data, final=False)
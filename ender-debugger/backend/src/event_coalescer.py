@@ -0,0 +1,193 @@
+import time
+import threading
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+FILE_CREATED = 'file_created'
+FILE_MODIFIED = 'file_modified'
+FILE_DELETED = 'file_deleted'
+
+class _PendingChange:
+    __slots__ = ('kind', 'first_seen', 'last_seen')
+
+    def __init__(self, kind: str, now: float):
+        self.kind = kind
+        self.first_seen = now
+        self.last_seen = now
+
+def merge_kinds(previous: str, incoming: str) -> Optional[str]:
+    """Collapse two consecutive change kinds for one path; None means the changes cancel out."""
+    if previous == FILE_CREATED:
+        if incoming == FILE_DELETED:
+            return None  # Created and removed inside one window: nobody needs to know.
+        return FILE_CREATED
+    if previous == FILE_DELETED:
+        if incoming == FILE_DELETED:
+            return FILE_DELETED
+        return FILE_MODIFIED  # Delete then recreate is how many editors save.
+    # previous == FILE_MODIFIED
+    if incoming == FILE_DELETED:
+        return FILE_DELETED
+    return FILE_MODIFIED
+
+class EventCoalescer:
+    """Sits between the watchdog thread and the change callback.
+
+    Raw events are recorded per path and only emitted once the path has been
+    quiet for ``settle_window`` seconds (or ``max_delay`` has passed since the
+    first event, so a file that is rewritten continuously still surfaces).
+    When more than ``bulk_threshold`` paths are pending at once, for example
+    during a branch switch, settled paths are handed to ``emit_batch`` in
+    chunks of ``batch_size`` instead of one ``emit`` call each.
+    """
+
+    def __init__(self,
+                 emit: Callable[[str, str], None],
+                 emit_batch: Callable[[List[Tuple[str, str]]], None],
+                 settle_window: float = 0.1,
+                 max_delay: float = 1.0,
+                 bulk_threshold: int = 200,
+                 batch_size: int = 500):
+        self.emit = emit
+        self.emit_batch = emit_batch
+        self.settle_window = settle_window
+        self.max_delay = max_delay
+        self.bulk_threshold = bulk_threshold
+        self.batch_size = batch_size
+        self.pending: Dict[str, _PendingChange] = {}
+        self.bulk_mode = False
+        self._last_push = 0.0
+        self._bulk_since = 0.0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        """Start the background flush thread."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='event-coalescer', daemon=True)
+        self._thread.start()
+
+    def stop(self, flush: bool = True):
+        """Stop the flush thread, optionally emitting everything still pending."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self._flush(force=True)
+
+    def push(self, path: str, kind: str):
+        """Record a raw change for ``path``."""
+        with self._condition:
+            was_idle = not self.pending
+            self._merge_locked(path, kind, time.monotonic())
+            self._after_push_locked(was_idle)
+
+    def push_move(self, src_path: str, dest_path: str):
+        """Record a rename.
+
+        A rename from a path that never settled (the usual write-temp-then-rename
+        save) collapses into a single modification of the destination.
+        """
+        now = time.monotonic()
+        with self._condition:
+            was_idle = not self.pending
+            source = self.pending.pop(src_path, None)
+            if source is not None and source.kind == FILE_CREATED:
+                dest_kind = FILE_MODIFIED
+            else:
+                self._merge_locked(src_path, FILE_DELETED, now)
+                dest_kind = FILE_CREATED
+            self._merge_locked(dest_path, dest_kind, now)
+            self._after_push_locked(was_idle)
+
+    def _after_push_locked(self, was_idle: bool):
+        self._last_push = time.monotonic()
+        if not self.bulk_mode and len(self.pending) > self.bulk_threshold:
+            self.bulk_mode = True
+            self._bulk_since = self._last_push
+            logging.info(f"Event storm detected ({len(self.pending)} pending paths), switching to bulk mode")
+        # Later pushes can only push deadlines further out, so the flush
+        # thread only needs waking when the first change arrives.
+        if was_idle and self.pending:
+            self._condition.notify()
+
+    def _merge_locked(self, path: str, kind: str, now: float):
+        entry = self.pending.get(path)
+        if entry is None:
+            self.pending[path] = _PendingChange(kind, now)
+            return
+        merged = merge_kinds(entry.kind, kind)
+        if merged is None:
+            del self.pending[path]
+        else:
+            entry.kind = merged
+            entry.last_seen = now
+
+    def _bulk_deadline(self) -> float:
+        # During a storm the whole tree settles together, which keeps batches large.
+        return min(self._last_push + self.settle_window, self._bulk_since + self.max_delay)
+
+    def _take_ready(self, now: float, force: bool) -> List[Tuple[str, str]]:
+        if self.bulk_mode and not force:
+            if now < self._bulk_deadline():
+                return []
+            self._bulk_since = now
+            ready = list((path, entry.kind) for path, entry in self.pending.items())
+            self.pending.clear()
+            return ready
+        ready = []
+        for path, entry in list(self.pending.items()):
+            if force or now - entry.last_seen >= self.settle_window or now - entry.first_seen >= self.max_delay:
+                ready.append((path, entry.kind))
+                del self.pending[path]
+        return ready
+
+    def _next_deadline(self, now: float) -> Optional[float]:
+        if not self.pending:
+            return None
+        if self.bulk_mode:
+            return max(0.0, self._bulk_deadline() - now)
+        deadline = min(min(entry.last_seen + self.settle_window, entry.first_seen + self.max_delay)
+                       for entry in self.pending.values())
+        return max(0.0, deadline - now)
+
+    def _flush(self, force: bool = False):
+        with self._condition:
+            ready = self._take_ready(time.monotonic(), force)
+            bulk = self.bulk_mode
+            if bulk and not self.pending:
+                self.bulk_mode = False
+                logging.info("Event storm settled, leaving bulk mode")
+        if not ready:
+            return
+        if bulk:
+            for i in range(0, len(ready), self.batch_size):
+                self._safe_call(self.emit_batch, ready[i:i + self.batch_size])
+        else:
+            for path, kind in ready:
+                self._safe_call(self.emit, path, kind)
+
+    def _safe_call(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Error emitting coalesced file change: {e}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                timeout = self._next_deadline(time.monotonic())
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+            self._flush()
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, List, Optional, TextIO, Tuple
+
+DEFAULT_JOURNAL_PATH = str(Path.home() / ".ender-debugger" / "journal")
+
+# One journal record: [journal_seq, type, root, path, language, hash].
+Record = List[Any]
+
+class EventJournal:
+    """Bounded, disk-backed ring of change events with a global sequence number.
+
+    Records are JSON lines in segment files named after their first sequence
+    number. A new segment is started once the current one passes
+    ``segment_bytes``, and the oldest segment is deleted once there are more
+    than ``max_segments``, so the journal never holds more than roughly
+    ``segment_bytes * max_segments`` bytes. Records carry metadata only; the
+    content a client is missing is looked up when it resumes. A torn last
+    line from a crash is skipped on open.
+
+    Appends are flushed at most every ``flush_interval`` seconds; the owner
+    calls ``flush`` on that interval too, so the last records of a burst
+    reach the file even if nothing is appended after them.
+    """
+
+    def __init__(self, directory: str = DEFAULT_JOURNAL_PATH, segment_bytes: int = 4 * 1024 * 1024,
+                 max_segments: int = 8, flush_interval: float = 0.5):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(2, max_segments)
+        self.flush_interval = flush_interval
+        self.head = 0
+        self.segments: List[Tuple[int, str]] = []
+        self._file: Optional[TextIO] = None
+        self._size = 0
+        self._last_flush = 0.0
+        self._unflushed = False
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for name in sorted(os.listdir(self.directory)):
+                if name.startswith('journal-') and name.endswith('.log'):
+                    try:
+                        first = int(name[len('journal-'):-len('.log')])
+                    except ValueError:
+                        continue
+                    self.segments.append((first, os.path.join(self.directory, name)))
+            if self.segments:
+                first, path = self.segments[-1]
+                self.head = first - 1
+                for record in self._read_segment(path):
+                    self.head = record[0]
+                self._file = open(path, 'a', encoding='utf-8')
+                self._size = self._file.tell()
+                if self._size and not self._ends_with_newline(path):
+                    self._file.write('\n')  # Keep the next record off a torn line.
+                    self._size += 1
+            logging.info(f"Opened event journal at {self.directory}, head {self.head}, "
+                         f"oldest {self.oldest_seq}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._unflushed = False
+
+    def flush(self):
+        """Write out appends still buffered; a no-op when there are none."""
+        with self._lock:
+            if self._file is not None and self._unflushed:
+                self._file.flush()
+                self._unflushed = False
+                self._last_flush = time.monotonic()
+
+    @property
+    def oldest_seq(self) -> int:
+        """The first sequence number still retained (head + 1 when empty)."""
+        return self.segments[0][0] if self.segments else self.head + 1
+
+    def append(self, type: str, root: Optional[str], path: str, language: Optional[str] = None,
+               digest: Optional[str] = None) -> int:
+        with self._lock:
+            self.head += 1
+            if self._file is None or self._size >= self.segment_bytes:
+                self._rotate_locked()
+            line = json.dumps([self.head, type, root, path, language, digest], separators=(',', ':')) + '\n'
+            self._file.write(line)
+            self._size += len(line)
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+                self._unflushed = False
+            else:
+                self._unflushed = True
+            return self.head
+
+    def _rotate_locked(self):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f'journal-{self.head:016d}.log')
+        self.segments.append((self.head, path))
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = 0
+        while len(self.segments) > self.max_segments:
+            _, evicted = self.segments.pop(0)
+            try:
+                os.remove(evicted)
+            except OSError as e:
+                logging.warning(f"Could not remove journal segment {evicted}: {e}")
+
+    def read_since(self, seq: int) -> Optional[List[Record]]:
+        """Every record after ``seq``, or None if part of that range has been evicted."""
+        with self._lock:
+            if seq > self.head or seq + 1 < self.oldest_seq:
+                # Evicted, or a sequence number from a journal that has since been wiped.
+                return None
+            if self._file is not None:
+                self._file.flush()
+                self._unflushed = False
+            # Segments from the one holding seq + 1 onwards.
+            start = 0
+            for index, (first, _) in enumerate(self.segments):
+                if first <= seq + 1:
+                    start = index
+            paths = [path for _, path in self.segments[start:]]
+            head = self.head
+        records = []
+        for path in paths:
+            for record in self._read_segment(path):
+                if seq < record[0] <= head:
+                    records.append(record)
+        with self._lock:
+            if seq + 1 < self.oldest_seq:
+                return None  # A segment was rotated away while we were reading it.
+        return records
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        with open(path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b'\n'
+
+    @staticmethod
+    def _read_segment(path: str) -> List[Record]:
+        records = []
+        try:
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # Torn write from a crash.
+        except OSError:
+            pass
+        return records
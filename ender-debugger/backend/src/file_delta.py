@@ -0,0 +1,159 @@
+import os
+import difflib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+
+# A hunk replaces old lines [start, end) with ``lines``. Hunks are listed in
+# ascending order against the previous snapshot, so clients apply them back to front.
+Hunk = Tuple[int, int, List[str]]
+
+HUNK_OVERHEAD = 16  # Rough JSON cost of "[start, end, []]" per hunk.
+
+def change_key(root: Optional[str], path: str) -> str:
+    """Absolute path used to key per-path state; relative paths collide across roots."""
+    return os.path.join(root, path) if root else path
+
+class SnapshotCache:
+    """Last-sent content per path, evicted least-recently-used beyond ``max_bytes``."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[int, List[str], int]]" = OrderedDict()
+
+    def get(self, path: str) -> Optional[Tuple[int, List[str]]]:
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        self._entries.move_to_end(path)
+        return entry[0], entry[1]
+
+    def put(self, path: str, seq: int, lines: List[str], size: int):
+        self.discard(path)
+        if size > self.max_bytes:
+            return
+        self._entries[path] = (seq, lines, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def discard(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+def diff_lines(old: List[str], new: List[str]) -> List[Hunk]:
+    """Line-range hunks that turn ``old`` into ``new``."""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    return [(i1, i2, new[j1:j2]) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+def apply_hunks(old: List[str], hunks: List[Hunk]) -> List[str]:
+    """Apply hunks produced by ``diff_lines``; used by Python clients and for verification."""
+    lines = list(old)
+    for start, end, replacement in reversed(hunks):
+        lines[start:end] = replacement
+    return lines
+
+def hunks_size(hunks: List[Hunk]) -> int:
+    return sum(HUNK_OVERHEAD + sum(len(line) for line in replacement) for _, _, replacement in hunks)
+
+class FileUpdate:
+    """Full and (optionally) patch forms of one change, with its per-path sequence numbers."""
+    __slots__ = ('path', 'seq', 'base_seq', 'full', 'patch')
+
+    def __init__(self, path: str, seq: int, base_seq: Optional[int],
+                 full: Dict[str, Any], patch: Optional[Dict[str, Any]]):
+        self.path = path
+        self.seq = seq
+        self.base_seq = base_seq
+        self.full = full
+        self.patch = patch
+
+class DeltaEncoder:
+    """Turns full-content change events into ``file_patch`` messages where that is cheaper."""
+
+    def __init__(self, max_snapshot_bytes: int = 64 * 1024 * 1024):
+        self.snapshots = SnapshotCache(max_snapshot_bytes)
+        self.sequences: Dict[str, int] = {}
+
+    def encode(self, change: Dict[str, Any]) -> Optional[FileUpdate]:
+        """Stamp ``change`` with a sequence number and build a patch against the last snapshot."""
+        if change.get('path') is None or change.get('type') not in ('file_created', 'file_modified', 'file_deleted'):
+            return None
+        path = change_key(change.get('root'), change['path'])
+        seq = self.sequences.get(path, 0) + 1
+        self.sequences[path] = seq
+        full = dict(change, seq=seq)
+
+        if change['type'] == 'file_deleted' or 'content' not in change or change.get('truncated'):
+            self.snapshots.discard(path)
+            return FileUpdate(path, seq, None, full, None)
+
+        content = change['content']
+        new_lines = content.splitlines(keepends=True)
+        previous = self.snapshots.get(path)
+        self.snapshots.put(path, seq, new_lines, len(content))
+        if previous is None or previous[0] != seq - 1:
+            return FileUpdate(path, seq, None, full, None)
+
+        hunks = diff_lines(previous[1], new_lines)
+        if hunks_size(hunks) >= len(content):
+            return FileUpdate(path, seq, previous[0], full, None)
+        patch = {
+            'type': 'file_patch',
+            'root': change.get('root'),
+            'path': change['path'],
+            'language': change.get('language'),
+            'seq': seq,
+            'base_seq': previous[0],
+            'hunks': hunks,
+            'timestamp': change.get('timestamp')
+        }
+        return FileUpdate(path, seq, previous[0], full, patch)
+
+    def encode_batch(self, change: Dict[str, Any]) -> Dict[str, Any]:
+        """Stamp each entry of a ``files_changed`` batch; batched paths carry no content to diff against."""
+        stamped = []
+        for entry in change.get('changes', []):
+            path = change_key(entry.get('root'), entry['path'])
+            seq = self.sequences.get(path, 0) + 1
+            self.sequences[path] = seq
+            self.snapshots.discard(path)
+            stamped.append(dict(entry, seq=seq))
+        return dict(change, changes=stamped)
+
+    def current(self, path: str) -> Optional[Tuple[int, str]]:
+        """Latest known (seq, content) for ``path``, used to answer resync requests."""
+        snapshot = self.snapshots.get(path)
+        if snapshot is None:
+            return None
+        return snapshot[0], ''.join(snapshot[1])
+
+class ClientSyncState:
+    """What one client holds per path, so the server knows whether a patch will apply."""
+
+    def __init__(self, max_unacked: int = 16):
+        self.max_unacked = max_unacked
+        self.sent: Dict[str, int] = {}
+        self.acked: Dict[str, int] = {}
+
+    def can_patch(self, path: str, base_seq: Optional[int]) -> bool:
+        # Clients that never acknowledge (older UIs) keep receiving full content.
+        if base_seq is None or path not in self.acked or self.sent.get(path) != base_seq:
+            return False
+        return base_seq - self.acked[path] < self.max_unacked
+
+    def record_sent(self, path: str, seq: int):
+        self.sent[path] = seq
+
+    def ack(self, path: str, seq: int):
+        if seq > self.acked.get(path, 0):
+            self.acked[path] = seq
+
+    def reset(self, path: str):
+        self.sent.pop(path, None)
+        self.acked.pop(path, None)
@@ -0,0 +1,225 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set
+from content_reader import hash_file
+
+if TYPE_CHECKING:
+    import sqlite3
+
+DEFAULT_INDEX_PATH = str(Path.home() / ".ender-debugger" / "file_index.sqlite3")
+
+SNAPSHOT_FIELDS = ['path', 'size', 'mtime', 'language', 'hash']
+
+class IndexEntry:
+    __slots__ = ('root', 'size', 'mtime_ns', 'inode', 'language', 'hash')
+
+    def __init__(self, root: str, size: int, mtime_ns: int, inode: int,
+                 language: Optional[str], hash: Optional[str]):
+        self.root = root
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.language = language
+        self.hash = hash
+
+    def same_stat(self, stat: os.stat_result) -> bool:
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns and self.inode == stat.st_ino
+
+class FileIndex:
+    """On-disk index of watched files: path, size, mtime, inode, language and content hash.
+
+    The index is loaded into memory at start, brought up to date by a
+    parallel ``os.scandir`` walk that only re-hashes files whose stat changed,
+    kept current from live change events, and written back to SQLite in
+    batches.
+    """
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH, scan_workers: int = 8, flush_threshold: int = 500):
+        self.index_path = index_path
+        self.scan_workers = scan_workers
+        self.flush_threshold = flush_threshold
+        self.entries: Dict[str, IndexEntry] = {}
+        self._dirty: Set[str] = set()
+        self._removed: Set[str] = set()
+        self._lock = threading.RLock()
+        self._db: Optional['sqlite3.Connection'] = None
+
+    def open(self):
+        """Open (or create) the database and load every entry into memory."""
+        with self._lock:
+            if self._db is not None:
+                return
+            self._open_locked()
+
+    def _open_locked(self):
+        import sqlite3  # Deferred: only needed once the first scan opens the index.
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, root TEXT NOT NULL, size INTEGER, mtime_ns INTEGER,
+            inode INTEGER, language TEXT, hash TEXT)''')
+        self._db.commit()
+        for path, root, size, mtime_ns, inode, language, digest in self._db.execute(
+                'SELECT path, root, size, mtime_ns, inode, language, hash FROM files'):
+            self.entries[path] = IndexEntry(root, size, mtime_ns, inode, language, digest)
+        logging.info(f"Loaded file index with {len(self.entries)} entries from {self.index_path}")
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def flush(self):
+        """Write changed entries back to disk."""
+        with self._lock:
+            if self._db is None or (not self._dirty and not self._removed):
+                return
+            rows = [(path, entry.root, entry.size, entry.mtime_ns, entry.inode, entry.language, entry.hash)
+                    for path, entry in ((path, self.entries.get(path)) for path in self._dirty) if entry]
+            removed = [(path,) for path in self._removed]
+            self._dirty.clear()
+            self._removed.clear()
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self._db.executemany('DELETE FROM files WHERE path = ?', removed)
+
+    def _put_locked(self, path: str, entry: IndexEntry):
+        self.entries[path] = entry
+        self._dirty.add(path)
+        self._removed.discard(path)
+
+    def _remove_locked(self, path: str) -> bool:
+        if self.entries.pop(path, None) is None:
+            return False
+        self._dirty.discard(path)
+        self._removed.add(path)
+        return True
+
+    def _maybe_flush(self):
+        if len(self._dirty) + len(self._removed) >= self.flush_threshold:
+            self.flush()
+
+    def update(self, root: str, path: str, language: Optional[str], digest: Optional[str] = None):
+        """Record a live create/modify of ``path``; ``digest`` avoids re-hashing when the caller has it."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return
+        with self._lock:
+            previous = self.entries.get(path)
+            if digest is None and previous is not None and previous.same_stat(stat):
+                digest = previous.hash
+            self._put_locked(path, IndexEntry(root, stat.st_size, stat.st_mtime_ns, stat.st_ino, language, digest))
+            self._maybe_flush()
+
+    def remove(self, path: str):
+        with self._lock:
+            if self._remove_locked(path):
+                self._maybe_flush()
+
+    def scan(self, root: str, should_ignore: Callable[[str], bool], is_ignored_dir: Callable[[str], bool],
+             get_language: Callable[[str], str],
+             cancelled: Optional[threading.Event] = None) -> Optional[Dict[str, List[str]]]:
+        """Walk ``root`` in parallel and reconcile it with the index.
+
+        Returns the paths (relative to ``root``) added, modified and deleted
+        since the index was last written, or None if the scan was cancelled.
+        ``first_scan`` is set when the root had never been indexed before; ``files``
+        counts every file the walk found.
+        """
+        started = time.perf_counter()
+        seen: Dict[str, os.stat_result] = {}
+        seen_lock = threading.Lock()
+
+        def scan_dir(directory: str) -> List[str]:
+            if cancelled is not None and cancelled.is_set():
+                return []
+            subdirs = []
+            found = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not is_ignored_dir(entry.path):
+                                    subdirs.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False) and not should_ignore(entry.path):
+                                found.append((entry.path, entry.stat(follow_symlinks=False)))
+                        except OSError:
+                            continue
+            except OSError as e:
+                logging.debug(f"Cannot scan {directory}: {e}")
+            with seen_lock:
+                seen.update(found)
+            return subdirs
+
+        with ThreadPoolExecutor(max_workers=self.scan_workers, thread_name_prefix='index-scan') as executor:
+            pending = [executor.submit(scan_dir, root)]
+            while pending:
+                future = pending.pop()
+                pending.extend(executor.submit(scan_dir, subdir) for subdir in future.result())
+            if cancelled is not None and cancelled.is_set():
+                # A partial walk would report everything unvisited as deleted.
+                return None
+
+            with self._lock:
+                stale = {path: entry for path, entry in self.entries.items() if entry.root == root}
+            first_scan = not stale
+            to_hash = [path for path, stat in seen.items()
+                       if path not in stale or not stale[path].same_stat(stat) or stale[path].hash is None]
+            digests = dict(zip(to_hash, executor.map(hash_file, to_hash)))
+
+        added, modified, deleted = [], [], []
+        with self._lock:
+            for path, stat in seen.items():
+                previous = stale.pop(path, None)
+                if path in digests:
+                    digest = digests[path]
+                    if previous is None:
+                        added.append(path)
+                    elif previous.hash != digest:
+                        modified.append(path)
+                    self._put_locked(path, IndexEntry(root, stat.st_size, stat.st_mtime_ns, stat.st_ino,
+                                                      get_language(path), digest))
+            for path in stale:
+                self._remove_locked(path)
+                deleted.append(path)
+        self.flush()
+
+        def relative(paths: List[str]) -> List[str]:
+            return sorted(path[len(root):].lstrip(os.sep) for path in paths)
+
+        logging.info(f"Indexed {root}: {len(seen)} files, {len(digests)} hashed, "
+                     f"{len(added)} added, {len(modified)} modified, {len(deleted)} deleted "
+                     f"in {time.perf_counter() - started:.2f}s")
+        return {'added': relative(added), 'modified': relative(modified), 'deleted': relative(deleted),
+                'first_scan': first_scan, 'files': len(seen)}
+
+    def snapshot(self, root: Optional[str] = None) -> Dict[str, List[List[Any]]]:
+        """Compact per-root listing: rows of ``SNAPSHOT_FIELDS`` with paths relative to the root."""
+        roots: Dict[str, List[List[Any]]] = {}
+        with self._lock:
+            items = list(self.entries.items())
+        for path, entry in items:
+            if root is not None and entry.root != root:
+                continue
+            roots.setdefault(entry.root, []).append([
+                path[len(entry.root):].lstrip(os.sep), entry.size, entry.mtime_ns // 1_000_000,
+                entry.language, entry.hash
+            ])
+        for rows in roots.values():
+            rows.sort()
+        return roots
+
+    def drop_root(self, root: str):
+        """Forget every entry under a root that is no longer watched."""
+        with self._lock:
+            for path in [path for path, entry in self.entries.items() if entry.root == root]:
+                self._remove_locked(path)
+        self.flush()
@@ -3,14 +3,34 @@ import sys
 import time
 import json
 import platform
+import threading
 from pathlib import Path
-from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from typing import Dict, List, Optional, Set, Callable, Any
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Callable, Any, Tuple
 import logging
-import pygments
-from pygments.lexers import get_lexer_for_filename
-from pygments.util import ClassNotFound
+from language import LanguageResolver
+from content_reader import ContentReader
+from blob_store import PathHashes
+from path_filter import PathFilter
+from path_trie import PathTrie, collapse_nested
+from worker_pool import OrderedWorkerPool
+from file_index import FileIndex
+from event_coalescer import EventCoalescer, FILE_CREATED, FILE_MODIFIED, FILE_DELETED
+from instrumentation import (REGISTRY, EMITTED_CHANGES, FILTER_SECONDS, FILTERED_EVENTS, LANGUAGE_SECONDS,
+                             READ_BYTES, READ_SECONDS, WATCHDOG_EVENTS)
+from watch_backend import (MODE_INOTIFY, MODE_INOTIFY_PRUNED, MODE_NATIVE, MODE_POLLING, PollingBackend,
+                           PollingScanner, estimate_watches, read_inotify_limit)
+
+if TYPE_CHECKING:
+    from watchdog.observers.api import ObservedWatch
+
+# Unlabelled children resolved once, so each event pays for an observe and nothing else.
+_FILTER_SECONDS = FILTER_SECONDS.labels()
+_FILTER_IGNORED = FILTERED_EVENTS.labels('ignored')
+_FILTER_PASSED = FILTERED_EVENTS.labels('passed')
+_READ_SECONDS = READ_SECONDS.labels()
+_READ_BYTES = READ_BYTES.labels()
+_LANGUAGE_SECONDS = LANGUAGE_SECONDS.labels()
 
 def get_common_dev_directories() -> List[str]:
     """Get a list of common development directories to monitor."""
@@ -42,8 +62,13 @@ def get_common_dev_directories() -> List[str]:
     return [path for path in common_paths if os.path.exists(path)]
 
 class FileChangeHandler(FileSystemEventHandler):
-    def __init__(self, callback: Callable[[Dict[str, Any]], None]):
+    def __init__(self, callback: Callable[[Dict[str, Any]], None],
+                 settle_window: float = 0.1, bulk_threshold: int = 200,
+                 read_workers: int = 4, read_queue_size: int = 256):
         self.callback = callback
+        self.coalescer = EventCoalescer(self.enqueue_change, self.enqueue_batch,
+                                        settle_window=settle_window, bulk_threshold=bulk_threshold)
+        self.read_pool = OrderedWorkerPool(workers=read_workers, queue_size=read_queue_size, name='file-reader')
         self.ignored_dirs = {'.git', '__pycache__', 'node_modules', '.idea', '.vscode', '.venv', 'env', '.env', 'dist', 'build', 'out', 'target', 'bin', 'obj'}
         self.ignored_extensions = {
             # System files
@@ -136,131 +161,565 @@ class FileChangeHandler(FileSystemEventHandler):
             '.sqlite': 'sql',
             '.sqlite3': 'sql'
         }
-        self.base_paths = set()
+        self.path_filter = PathFilter(self.ignored_dirs, self.ignored_extensions, self.supported_extensions)
+        self.language_resolver = LanguageResolver(self.path_filter.suffix_language)
+        self.content_reader = ContentReader()
+        self.base_paths = PathTrie()
+        # Optional (path, language) -> bool hook; when it says no, changes are
+        # sent as metadata only and the file is never read.
+        self.content_predicate: Optional[Callable[[str, str], bool]] = None
+        # Last emitted content hash per path, to drop saves that rewrote identical bytes.
+        self.content_hashes = PathHashes()
+        self.suppressed_unchanged = 0
+        # Optional hook for directories that appear under a watched root.
+        self.directory_created: Optional[Callable[[str], None]] = None
 
     def add_base_path(self, path: str):
         """Add a base path to track."""
-        self.base_paths.add(path)
+        path = os.path.normpath(path)
+        self.base_paths.insert(path)
+        self.path_filter.add_root(path)
+
+    def remove_base_path(self, path: str):
+        """Stop tracking a base path."""
+        path = os.path.normpath(path)
+        self.base_paths.remove(path)
+        self.path_filter.remove_root(path)
 
     def get_relative_path(self, full_path: str) -> str:
         """Convert full path to relative path."""
-        for base_path in self.base_paths:
-            if full_path.startswith(base_path):
-                return full_path[len(base_path):].lstrip('/\\')
-        return full_path
+        base_path = self.base_paths.longest_prefix(full_path)
+        if base_path is None:
+            return full_path
+        return full_path[len(base_path):].lstrip('/\\')
+
+    def get_root(self, full_path: str) -> Optional[str]:
+        """The watched root that ``full_path`` is reported relative to."""
+        return self.base_paths.longest_prefix(full_path)
 
     def should_ignore(self, path: str) -> bool:
         """Check if the path should be ignored."""
-        path_parts = Path(path).parts
-        return any(part in self.ignored_dirs for part in path_parts) or \
-               Path(path).suffix.lower() in self.ignored_extensions or \
-               Path(path).suffix.lower() not in self.supported_extensions
+        started = time.perf_counter()
+        ignored = self.path_filter.should_ignore(path)
+        _FILTER_SECONDS.observe(time.perf_counter() - started)
+        (_FILTER_IGNORED if ignored else _FILTER_PASSED).inc()
+        return ignored
 
     def get_file_content(self, file_path: str) -> str:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except Exception as e:
-            logging.error(f"Error reading file {file_path}: {e}")
-            return ""
+        result = self.content_reader.read(file_path)
+        return result.text or ""
 
     def get_language(self, file_path: str) -> str:
-        try:
-            lexer = get_lexer_for_filename(file_path)
-            return lexer.name.lower()
-        except ClassNotFound:
-            return "text"
+        started = time.perf_counter()
+        language = self.language_resolver.resolve(file_path)
+        _LANGUAGE_SECONDS.observe(time.perf_counter() - started)
+        return language
 
-    def on_created(self, event):
-        if not event.is_directory and not self.should_ignore(event.src_path):
-            logging.info(f"File created: {event.src_path}")
+    def enqueue_change(self, path: str, kind: str):
+        """Hand a settled change to the read pool; changes to one path stay in order."""
+        if self.get_root(path) is None:
+            return  # Its root was removed while the change was settling.
+        self.read_pool.submit(path, self.emit_change, path, kind)
+
+    def emit_change(self, path: str, kind: str):
+        """Emit a single settled change from the coalescer."""
+        if kind == FILE_DELETED:
+            self.content_hashes.pop(path, None)
+            logging.debug(f"File deleted: {path}")
+            EMITTED_CHANGES.labels(FILE_DELETED).inc()
             self.callback({
-                'type': 'file_created',
-                'path': self.get_relative_path(event.src_path),
-                'language': self.get_language(event.src_path),
-                'content': self.get_file_content(event.src_path),
+                'type': FILE_DELETED,
+                'root': self.get_root(path),
+                'path': self.get_relative_path(path),
                 'timestamp': time.time()
             })
+            return
+        relative_path = self.get_relative_path(path)
+        language = self.get_language(path)
+        change = {
+            'type': kind,
+            'root': self.get_root(path),
+            'path': relative_path,
+            'language': language,
+            'timestamp': time.time()
+        }
+        if self.content_predicate is not None and not self.content_predicate(path, language):
+            change['metadata_only'] = True
+            self.content_hashes.pop(path, None)
+            logging.debug(f"File {'created' if kind == FILE_CREATED else 'modified'}: {path}")
+            EMITTED_CHANGES.labels(kind).inc()
+            self.callback(change)
+            return
+        started = time.perf_counter()
+        result = self.content_reader.read(path)
+        _READ_SECONDS.observe(time.perf_counter() - started)
+        if result.error is not None:
+            # Deleted or unreadable since it settled; a delete event follows if it is gone.
+            return
+        _READ_BYTES.inc(result.size or 0)
+        if result.digest is not None:
+            if kind == FILE_MODIFIED and self.content_hashes.get(path) == result.digest:
+                self.suppressed_unchanged += 1
+                return
+            self.content_hashes[path] = result.digest
+        else:
+            self.content_hashes.pop(path, None)
+        logging.debug(f"File {'created' if kind == FILE_CREATED else 'modified'}: {path}")
+        EMITTED_CHANGES.labels(kind).inc()
+        if result.binary:
+            change['binary'] = True
+            change['size'] = result.size
+        elif result.streamed:
+            change['chunks'] = self.content_reader.chunk_count(result.size)
+            change['size'] = result.size
+        else:
+            change['content'] = result.text
+            if result.digest is not None:
+                change['hash'] = result.digest
+            if result.truncated:
+                change['truncated'] = True
+                change['size'] = result.size
+        self.callback(change)
+        if result.streamed:
+            self.stream_content(path, relative_path, language, change['chunks'])
 
-    def on_modified(self, event):
-        if not event.is_directory and not self.should_ignore(event.src_path):
-            logging.info(f"File modified: {event.src_path}")
+    def stream_content(self, path: str, relative_path: str, language: str, expected_chunks: int):
+        """Send a large file as a series of file_chunk messages following its change event."""
+        index = -1
+        try:
+            for index, data in enumerate(self.content_reader.iter_chunks(path)):
+                self.callback({
+                    'type': 'file_chunk',
+                    'root': self.get_root(path),
+                    'path': relative_path,
+                    'language': language,
+                    'index': index,
+                    'count': expected_chunks,
+                    'data': data,
+                    'final': index + 1 >= expected_chunks
+                })
+        except Exception as e:
+            logging.error(f"Error streaming file {path}: {e}")
+        if index + 1 < expected_chunks:
+            # The file shrank or vanished mid-stream; close the sequence explicitly.
             self.callback({
-                'type': 'file_modified',
-                'path': self.get_relative_path(event.src_path),
-                'language': self.get_language(event.src_path),
-                'content': self.get_file_content(event.src_path),
-                'timestamp': time.time()
+                'type': 'file_chunk',
+                'root': self.get_root(path),
+                'path': relative_path,
+                'language': language,
+                'index': index + 1,
+                'count': index + 1,
+                'data': '',
+                'final': True
             })
 
+    def enqueue_batch(self, changes: List[Tuple[str, str]]):
+        """Hand a batch to the read pool, split by worker, so it stays behind earlier changes to its paths."""
+        changes = [(path, kind) for path, kind in changes if self.get_root(path) is not None]
+        if changes:
+            self.read_pool.submit_grouped(changes, self.emit_batch)
+
+    def emit_batch(self, changes: List[Tuple[str, str]]):
+        """Emit a batch of settled changes without reading any content."""
+        changes = [(path, kind) for path, kind in changes if self.get_root(path) is not None]
+        if not changes:
+            return
+        for path, _ in changes:
+            # Not read here, so a later save must not be compared against the hash from before the batch.
+            self.content_hashes.pop(path, None)
+        logging.debug(f"Batched {len(changes)} file changes")
+        EMITTED_CHANGES.labels('files_changed').inc()
+        self.callback({
+            'type': 'files_changed',
+            'changes': [{'type': kind, 'root': self.get_root(path), 'path': self.get_relative_path(path),
+                         'language': self.get_language(path)}
+                        for path, kind in changes],
+            'timestamp': time.time()
+        })
+
+    def start(self):
+        """Start delivering coalesced events."""
+        self.read_pool.start()
+        self.coalescer.start()
+
+    def stop(self):
+        """Stop delivering events, flushing anything still pending."""
+        self.coalescer.stop(flush=True)
+        self.read_pool.stop(drain=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and drop counters for the read stage."""
+        return {
+            'pending_paths': len(self.coalescer.pending),
+            'bulk_mode': self.coalescer.bulk_mode,
+            'suppressed_unchanged': self.suppressed_unchanged,
+            'read_pool': self.read_pool.stats()
+        }
+
+    def on_any_event(self, event):
+        WATCHDOG_EVENTS.labels(event.event_type).inc()
+        # Ignore files are themselves filtered out, so catch their changes before that.
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path and self.path_filter.is_ignore_file(path):
+                self.path_filter.invalidate(os.path.dirname(path))
+
+    def on_created(self, event):
+        if event.is_directory:
+            if self.directory_created is not None:
+                self.directory_created(event.src_path)
+            return
+        if not self.should_ignore(event.src_path):
+            self.coalescer.push(event.src_path, FILE_CREATED)
+
+    def on_modified(self, event):
+        if not event.is_directory and not self.should_ignore(event.src_path):
+            self.coalescer.push(event.src_path, FILE_MODIFIED)
+
     def on_deleted(self, event):
         if not event.is_directory and not self.should_ignore(event.src_path):
-            logging.info(f"File deleted: {event.src_path}")
-            self.callback({
-                'type': 'file_deleted',
-                'path': self.get_relative_path(event.src_path),
-                'timestamp': time.time()
-            })
+            self.coalescer.push(event.src_path, FILE_DELETED)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            if self.directory_created is not None:
+                self.directory_created(event.dest_path)
+            return
+        src_ignored = self.should_ignore(event.src_path)
+        dest_ignored = self.should_ignore(event.dest_path)
+        if src_ignored and dest_ignored:
+            return
+        if src_ignored:
+            # Saved through an ignored temp file (foo.py.tmp -> foo.py).
+            self.coalescer.push(event.dest_path, FILE_MODIFIED)
+        elif dest_ignored:
+            # Moved aside to a backup name (foo.py -> foo.py~).
+            self.coalescer.push(event.src_path, FILE_DELETED)
+        else:
+            self.coalescer.push_move(event.src_path, event.dest_path)
 
 class FileMonitor:
-    def __init__(self):
+    def __init__(self, index_path: Optional[str] = None, watch_budget_fraction: float = 0.5):
         self.observer = None
         self.event_handler = None
         self.watched_paths: Set[str] = set()
+        # Root -> observer watch handles, for the roots that own a watch (none when polled).
+        self.watches: Dict[str, List['ObservedWatch']] = {}
+        # Root -> (watch mode, inotify watches it is estimated to use).
+        self.watch_modes: Dict[str, Tuple[str, int]] = {}
+        # Directories of pruned roots watched without recursion -> their root.
+        self.flat_dirs: Dict[str, str] = {}
+        self.inotify_limit = read_inotify_limit()
+        # Share of max_user_watches we allow ourselves; editors and other tools need the rest.
+        self.watch_budget_fraction = watch_budget_fraction
+        self.polling = PollingBackend()
+        self.started_at: Optional[float] = None
+        self.time_to_first_event: Optional[float] = None
         self.is_running = False
+        self.callback: Optional[Callable[[Dict[str, Any]], None]] = None
+        self.file_index = FileIndex(index_path) if index_path else None
+        self._scan_threads: List[threading.Thread] = []
+        self._scan_cancelled = threading.Event()
+        self._roots_lock = threading.RLock()
+        REGISTRY.gauge('ender_coalescer_pending_paths', 'Paths waiting in the coalescer settle window',
+                       lambda: len(self.event_handler.coalescer.pending) if self.event_handler else 0)
+        REGISTRY.gauge('ender_read_queue_depth', 'Settled changes queued for the read pool',
+                       lambda: self.event_handler.read_pool.queue_depth() if self.event_handler else 0)
+        REGISTRY.gauge('ender_watched_roots', 'Watched roots', lambda: len(self.watched_paths))
 
-    def start(self, paths: List[str], callback: Callable[[Dict[str, Any]], None]):
-        """Start monitoring the specified paths."""
+    def start(self, paths: List[str], callback: Callable[[Dict[str, Any]], None],
+              content_predicate: Optional[Callable[[str, str], bool]] = None, watch_common_dirs: bool = True):
+        """Start monitoring the specified paths (plus the common dev directories unless disabled)."""
         if self.is_running:
             self.stop()
 
-        self.event_handler = FileChangeHandler(callback)
+        self.started_at = time.perf_counter()
+        self.time_to_first_event = None
+        self.callback = callback
+        self.event_handler = FileChangeHandler(self._handle_change)
+        self.event_handler.content_predicate = content_predicate
+        self.event_handler.directory_created = self._directory_created
+        # The platform observer pulls in inotify/FSEvents bindings; load it on first start.
+        from watchdog.observers import Observer
         self.observer = Observer()
         
         # Get common development directories
-        dev_dirs = get_common_dev_directories()
+        dev_dirs = get_common_dev_directories() if watch_common_dirs else []
         
         # Combine with user-specified paths
-        all_paths = list(set(paths + dev_dirs))
-        
+        all_paths = sorted({os.path.normpath(p) for p in paths + dev_dirs})
+        existing = []
         for path in all_paths:
             if os.path.exists(path):
-                self.observer.schedule(self.event_handler, path, recursive=True)
-                self.event_handler.add_base_path(path)
-                logging.info(f"Monitoring path: {path}")
-                self.watched_paths.add(path)
+                existing.append(path)
             else:
                 logging.info(f"Path does not exist, skipping: {path}")
 
+        # Nested roots still resolve relative paths, but only the outermost root
+        # gets a recursive watch so no subtree reports the same event twice.
+        scheduled = set(collapse_nested(existing))
+        for path in existing:
+            self.event_handler.add_base_path(path)
+            self.watched_paths.add(path)
+            if path in scheduled:
+                self._schedule(path)
+                logging.info(f"Monitoring path: {path}")
+            else:
+                logging.info(f"Monitoring path: {path} (covered by an enclosing root)")
+
+        self.event_handler.start()
         self.observer.start()
         self.is_running = True
-        logging.info(f"File monitor started. Watching {len(self.watched_paths)} paths.")
+        logging.info(f"File monitor started in {(time.perf_counter() - self.started_at) * 1000:.0f} ms. "
+                     f"Watching {len(self.watched_paths)} paths.")
+
+        self._scan_cancelled.clear()
+        self._start_scan(sorted(scheduled), report_offline=True)
+
+    def _watch_budget(self) -> Optional[int]:
+        if self.inotify_limit is None:
+            return None
+        used = sum(cost for _, cost in self.watch_modes.values())
+        return max(0, int(self.inotify_limit * self.watch_budget_fraction) - used)
+
+    def _schedule(self, path: str):
+        """Watch ``path`` the cheapest way that fits in the inotify budget."""
+        handler = self.event_handler
+        budget = self._watch_budget()
+        flat: List[str] = []
+        recursive: List[str] = []
+        if budget is None:
+            mode, cost = MODE_NATIVE, 0
+        else:
+            started = time.perf_counter()
+            estimate = estimate_watches(path, handler.path_filter.is_ignored_dir, budget)
+            if estimate.total <= budget:
+                mode, cost = MODE_INOTIFY, estimate.total
+            elif not estimate.exceeded:
+                # Recursive inotify would also watch node_modules, .git and friends.
+                mode, cost = MODE_INOTIFY_PRUNED, estimate.pruned
+                flat, recursive = estimate.flat, estimate.recursive
+            else:
+                mode, cost = MODE_POLLING, 0
+            logging.debug(f"Estimated watches for {path} in {(time.perf_counter() - started) * 1000:.1f} ms: "
+                          f"{estimate.total} total, {estimate.pruned} pruned, budget {budget}")
+
+        handles: List['ObservedWatch'] = []
+        try:
+            if mode == MODE_INOTIFY_PRUNED:
+                for directory in flat:
+                    handles.append(self.observer.schedule(handler, directory, recursive=False))
+                for directory in recursive:
+                    handles.append(self.observer.schedule(handler, directory, recursive=True))
+                for directory in flat:
+                    self.flat_dirs[directory] = path
+            elif mode != MODE_POLLING:
+                handles.append(self.observer.schedule(handler, path, recursive=True))
+        except OSError as e:
+            # The estimate was off, or something else took the watches in the meantime.
+            logging.warning(f"Could not watch {path} with {mode} ({e}), falling back to polling")
+            for watch in handles:
+                self.observer.unschedule(watch)
+            handles, mode, cost = [], MODE_POLLING, 0
+        if mode == MODE_POLLING:
+            self.polling.add(PollingScanner(path, handler, handler.path_filter.is_ignored_dir))
+        self.watches[path] = handles
+        self.watch_modes[path] = (mode, cost)
+        logging.info(f"Watching {path} with {mode}" + (f" ({cost} watches)" if cost else ""))
+
+    def _unschedule(self, path: str):
+        handles = self.watches.pop(path, None)
+        mode, _ = self.watch_modes.pop(path, (None, 0))
+        if mode == MODE_POLLING:
+            self.polling.remove(path)
+        elif mode == MODE_INOTIFY_PRUNED:
+            for directory in [directory for directory, root in self.flat_dirs.items() if root == path]:
+                del self.flat_dirs[directory]
+        for watch in handles or []:
+            self.observer.unschedule(watch)
+
+    def _directory_created(self, path: str):
+        """Give a new directory in a flat-watched directory of a pruned root its own recursive watch."""
+        # Runs on the observer thread with the observer's (reentrant) lock held, so it
+        # must not wait on _roots_lock: add_root holds that while scheduling.
+        root = self.flat_dirs.get(os.path.dirname(path))
+        if root is None:
+            return
+        mode, cost = self.watch_modes.get(root, (None, 0))
+        handles = self.watches.get(root)
+        if mode != MODE_INOTIFY_PRUNED or handles is None or self.event_handler.path_filter.is_ignored_dir(path):
+            return
+        try:
+            handles.append(self.observer.schedule(self.event_handler, path, recursive=True))
+            self.watch_modes[root] = (mode, cost + 1)
+        except OSError as e:
+            logging.warning(f"Could not watch new directory {path}: {e}")
+
+    def watch_mode(self, path: str) -> Optional[str]:
+        """How the watched root ``path`` is being observed."""
+        path = os.path.normpath(path)
+        with self._roots_lock:
+            if path not in self.watched_paths:
+                return None
+            owner = PathTrie(self.watches).shortest_prefix(path)
+            return self.watch_modes[owner][0] if owner in self.watch_modes else None
+
+    def _start_scan(self, roots: List[str], report_offline: bool):
+        if self.file_index is None or not roots:
+            return
+        thread = threading.Thread(target=self._scan_roots, args=(roots, report_offline),
+                                  name='file-index-scan', daemon=True)
+        self._scan_threads = [t for t in self._scan_threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _scan_roots(self, roots: List[str], report_offline: bool):
+        """Bring the persistent index up to date and report what changed while we were down."""
+        try:
+            self.file_index.open()
+        except Exception as e:
+            logging.error(f"Could not open file index {self.file_index.index_path}: {e}")
+            return
+        handler = self.event_handler
+        for root in roots:
+            if self._scan_cancelled.is_set():
+                return
+            diff = self.file_index.scan(root, handler.should_ignore, handler.path_filter.is_ignored_dir,
+                                        handler.get_language, self._scan_cancelled)
+            if diff is None:
+                return
+            # On the very first scan of a root everything is "added"; that is not news.
+            if report_offline and not diff['first_scan'] and (diff['added'] or diff['modified'] or diff['deleted']):
+                self.callback({
+                    'type': 'offline_changes',
+                    'root': root,
+                    'added': diff['added'],
+                    'modified': diff['modified'],
+                    'deleted': diff['deleted'],
+                    'timestamp': time.time()
+                })
+            # Lets consumers that mirror the tree (the symbol and search indexes) reconcile against the fresh index.
+            self.callback({'type': 'root_scanned', 'root': root, 'files': diff['files'], 'timestamp': time.time()})
+
+    def _index_root(self, path: str) -> str:
+        # The index is keyed by the outermost (scheduled) root, matching the scan.
+        return self.event_handler.base_paths.shortest_prefix(path) or path
+
+    def _handle_change(self, change: Dict[str, Any]):
+        """Keep the persistent index current, then pass the change on."""
+        if self.time_to_first_event is None and self.started_at is not None:
+            self.time_to_first_event = time.perf_counter() - self.started_at
+            logging.info(f"First file event {self.time_to_first_event * 1000:.0f} ms after monitor start")
+        if self.file_index is not None:
+            try:
+                self._index_change(change)
+            except Exception as e:
+                logging.error(f"Error updating file index: {e}")
+        self.callback(change)
+
+    def _index_change(self, change: Dict[str, Any]):
+        if change['type'] == 'files_changed':
+            entries = change['changes']
+        elif change['type'] in (FILE_CREATED, FILE_MODIFIED, FILE_DELETED):
+            entries = [change]
+        else:
+            return
+        for entry in entries:
+            path = os.path.join(entry['root'], entry['path']) if entry.get('root') else entry['path']
+            if entry['type'] == FILE_DELETED:
+                self.file_index.remove(path)
+            else:
+                self.file_index.update(self._index_root(path), path, entry.get('language'), entry.get('hash'))
+
+    def snapshot(self, root: Optional[str] = None) -> Dict[str, List[List[Any]]]:
+        """Every indexed file, grouped by root; empty when the index is disabled."""
+        if self.file_index is None:
+            return {}
+        return self.file_index.snapshot(os.path.normpath(root) if root else None)
 
     def stop(self):
         """Stop the file monitoring."""
         if self.observer and self.is_running:
             self.observer.stop()
             self.observer.join()
+            self.polling.stop()
+            self.event_handler.stop()
+            self._scan_cancelled.set()
+            for thread in self._scan_threads:
+                thread.join()
+            self._scan_threads = []
+            if self.file_index is not None:
+                self.file_index.close()
             self.is_running = False
             self.watched_paths.clear()
+            self.watches.clear()
+            self.watch_modes.clear()
+            self.flat_dirs.clear()
             logging.info("File monitor stopped.")
 
-    def add_path(self, path: str):
-        """Add a new path to monitor."""
-        if self.observer and self.is_running and os.path.exists(path):
-            logging.info(f"Adding new path to monitor: {path}")
-            self.observer.schedule(self.event_handler, path, recursive=True)
+    def stats(self) -> Dict[str, Any]:
+        """Pipeline counters for the running monitor."""
+        stats = {'watched_paths': len(self.watched_paths), 'is_running': self.is_running,
+                 'time_to_first_event_ms': (round(self.time_to_first_event * 1000, 1)
+                                            if self.time_to_first_event is not None else None),
+                 'inotify_limit': self.inotify_limit,
+                 'watch_modes': {root: {'mode': mode, 'watches': cost}
+                                 for root, (mode, cost) in list(self.watch_modes.items())}}
+        if self.event_handler:
+            stats.update(self.event_handler.stats())
+        return stats
+
+    def add_root(self, path: str) -> bool:
+        """Start watching ``path`` without disturbing the watches that already exist."""
+        path = os.path.normpath(path)
+        if not (self.observer and self.is_running and os.path.isdir(path)):
+            return False
+        started = time.perf_counter()
+        with self._roots_lock:
+            if path in self.watched_paths:
+                return True
             self.event_handler.add_base_path(path)
             self.watched_paths.add(path)
+            enclosing = PathTrie(self.watches).shortest_prefix(path)
+            if enclosing is None:
+                # A new outer root takes over the watches of the roots it encloses.
+                nested = [root for root in self.watches if root.startswith(path + os.sep)]
+                for root in nested:
+                    # Released first so their watches count towards the new root's budget.
+                    self._unschedule(root)
+                    if self.file_index is not None:
+                        self.file_index.drop_root(root)
+                self._schedule(path)
+                self._start_scan([path], report_offline=False)
+        logging.info(f"Added root {path} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return True
+
+    def remove_root(self, path: str) -> bool:
+        """Stop watching ``path``, unscheduling only its own watch."""
+        path = os.path.normpath(path)
+        started = time.perf_counter()
+        with self._roots_lock:
+            if path not in self.watched_paths:
+                return False
+            self.watched_paths.discard(path)
+            self.event_handler.remove_base_path(path)
+            if path in self.watches:
+                self._unschedule(path)
+                if self.file_index is not None:
+                    self.file_index.drop_root(path)
+                # Roots that were covered by this one need their own watches now.
+                uncovered = collapse_nested(root for root in self.watched_paths if root.startswith(path + os.sep))
+                for root in uncovered:
+                    self._schedule(root)
+                self._start_scan(uncovered, report_offline=False)
+        logging.info(f"Removed root {path} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return True
+
+    def add_path(self, path: str):
+        """Add a new path to monitor."""
+        self.add_root(path)
 
     def remove_path(self, path: str):
         """Remove a path from monitoring."""
-        if path in self.watched_paths:
-            logging.info(f"Removing path from monitor: {path}")
-            self.stop()
-            self.watched_paths.remove(path)
-            if self.watched_paths:
-                self.start(list(self.watched_paths), self.event_handler.callback)
+        self.remove_root(path)
 
 def main():
     # Example usage
@@ -0,0 +1,236 @@
+import os
+import asyncio
+import logging
+from bisect import bisect_right, insort
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from event_coalescer import FILE_CREATED, FILE_DELETED
+from file_monitor import FileChangeHandler
+from instrumentation import TREE_LISTINGS
+
+# Columns of each entry in a dir_listing message.
+TREE_FIELDS = ['name', 'dir', 'language']
+
+class Listing:
+    """One directory's entries, directories first, then by case-folded name."""
+    __slots__ = ('keys', 'entries')
+
+    def __init__(self, entries: Dict[str, Tuple[bool, Optional[str]]]):
+        self.entries = entries
+        self.keys = sorted(sort_key(name, is_dir) for name, (is_dir, _) in entries.items())
+
+    def add(self, name: str, is_dir: bool, language: Optional[str]) -> bool:
+        if name in self.entries:
+            return False
+        self.entries[name] = (is_dir, language)
+        insort(self.keys, sort_key(name, is_dir))
+        return True
+
+    def remove(self, name: str) -> bool:
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return False
+        self.keys.remove(sort_key(name, entry[0]))
+        return True
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[List[Any]], Optional[str]]:
+        """Up to ``limit`` rows after ``cursor``, and the cursor of the page after them (None at the end).
+
+        The cursor is the last name served, so entries added or removed
+        between pages neither repeat nor shift the rest.
+        """
+        start = 0
+        if cursor:
+            kind, _, name = cursor.partition('/')
+            start = bisect_right(self.keys, sort_key(name, kind == 'd'))
+        keys = self.keys[start:start + limit]
+        rows = []
+        for _, _, name in keys:
+            is_dir, language = self.entries[name]
+            rows.append([name, is_dir, language])
+        if start + limit >= len(self.keys) or not keys:
+            return rows, None
+        last = keys[-1]
+        return rows, f"{'d' if last[0] == 0 else 'f'}/{last[2]}"
+
+def sort_key(name: str, is_dir: bool) -> Tuple[int, str, str]:
+    return (0 if is_dir else 1, name.casefold(), name)
+
+class FileTree:
+    """Cached directory listings of the watched roots, for clients browsing the tree.
+
+    Directories are read with ``os.scandir`` in the loop's executor, and
+    concurrent requests for the same directory share one read. Listings stay
+    cached (least recently used go first past ``max_entries`` entries) and
+    are kept current by the monitor's change events instead of expiring:
+    ``apply`` inserts created files, adds the directories that a file in a
+    new directory brings into view, and removes deleted files. A directory
+    whose file was deleted is checked and, once gone, dropped from its parent.
+
+    Only what the monitor reports is listed: ignored directories and files
+    its filter drops are left out, since no event would keep them current.
+    """
+
+    def __init__(self, max_entries: int = 500_000, prefetch: int = 8):
+        # Same ignore lists and rules as the monitor; only its filter and language lookup are used.
+        handler = FileChangeHandler(lambda change: None)
+        self.path_filter = handler.path_filter
+        self.language_resolver = handler.language_resolver
+        self.max_entries = max_entries
+        self.prefetch_count = prefetch
+        self.roots: Set[str] = set()
+        self.listings: 'OrderedDict[str, Listing]' = OrderedDict()
+        self.entries = 0
+        self.loading: Dict[str, asyncio.Future] = {}
+        # Directories changed while being read; their read is served once but not cached.
+        self.stale: Set[str] = set()
+        self.pruning: Set[str] = set()
+
+    def add_root(self, root: str):
+        root = os.path.normpath(root)
+        if root not in self.roots:
+            self.roots.add(root)
+            self.path_filter.add_root(root)
+
+    def remove_root(self, root: str):
+        root = os.path.normpath(root)
+        self.roots.discard(root)
+        self.path_filter.remove_root(root)
+        self.forget(root)
+
+    def forget(self, directory: str):
+        """Drop the cached listings of ``directory`` and everything under it."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        for cached in [d for d in self.listings if d == directory or d.startswith(prefix)]:
+            self.entries -= len(self.listings.pop(cached).entries)
+
+    async def listing(self, directory: str, root: str) -> Listing:
+        """The listing of ``directory`` under ``root``, from the cache or read off the loop.
+
+        Raises OSError if it cannot be read, and ValueError if it resolves
+        (through a symlink) outside ``root``.
+        """
+        listing = self.listings.get(directory)
+        if listing is not None:
+            self.listings.move_to_end(directory)
+            TREE_LISTINGS.labels('hit').inc()
+            return listing
+        TREE_LISTINGS.labels('miss').inc()
+        load = self.loading.get(directory)
+        if load is None:
+            load = self.loading[directory] = asyncio.ensure_future(self._load(directory, root))
+        # Shielded: a client going away must not cancel a read others are waiting on.
+        return await asyncio.shield(load)
+
+    async def _load(self, directory: str, root: str) -> Listing:
+        self.stale.discard(directory)
+        try:
+            listing = await asyncio.get_running_loop().run_in_executor(None, self._scan, directory, root)
+        finally:
+            del self.loading[directory]
+        if directory in self.stale:
+            self.stale.discard(directory)
+            return listing
+        self.listings[directory] = listing
+        self.entries += len(listing.entries)
+        while self.entries > self.max_entries and len(self.listings) > 1:
+            self.entries -= len(self.listings.popitem(last=False)[1].entries)
+        return listing
+
+    def _scan(self, directory: str, root: str) -> Listing:
+        real_root = os.path.realpath(root)
+        real = os.path.realpath(directory)
+        if real != real_root and not real.startswith(real_root.rstrip(os.sep) + os.sep):
+            raise ValueError(f"{directory} is outside {root}")
+        entries = {}
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self.path_filter.is_ignored_dir(entry.path):
+                            entries[entry.name] = (True, None)
+                    elif entry.is_file() and not self.path_filter.should_ignore(entry.path):
+                        entries[entry.name] = (False, self.language_resolver.resolve(entry.path))
+                except OSError:
+                    continue  # Removed while listing.
+        return Listing(entries)
+
+    def prefetch(self, directory: str, root: str, rows: List[List[Any]]):
+        """Read ahead the first uncached subdirectories of a page, the ones a client is likely to expand next."""
+        children = [os.path.join(directory, name) for name, is_dir, _ in rows if is_dir]
+        children = [child for child in children if child not in self.listings and child not in self.loading]
+        if children and self.prefetch_count:
+            asyncio.ensure_future(self._prefetch(children[:self.prefetch_count], root))
+
+    async def _prefetch(self, children: List[str], root: str):
+        # One at a time, so read-ahead never takes more than one executor thread per request.
+        for child in children:
+            try:
+                await self.listing(child, root)
+            except (OSError, ValueError):
+                continue
+
+    def apply(self, change: Dict[str, Any]):
+        """Update cached listings from a created or deleted file; called on the loop for every change."""
+        kind = change.get('type')
+        root = change.get('root')
+        if kind not in (FILE_CREATED, FILE_DELETED) or not root or 'path' not in change:
+            return
+        root = os.path.normpath(root)
+        directory, name = os.path.split(os.path.normpath(os.path.join(root, change['path'])))
+        if kind == FILE_DELETED:
+            self._touch(directory)
+            listing = self.listings.get(directory)
+            if listing is not None and listing.remove(name):
+                self.entries -= 1
+            # The directory may have gone too (rm -r); check once if a cached listing shows it.
+            if (listing is None or not listing.entries) and directory not in self.pruning and self._shown(directory, root):
+                self.pruning.add(directory)
+                asyncio.ensure_future(self._prune(directory, root))
+            return
+        language = change.get('language') or self.language_resolver.resolve(name)
+        is_dir = False
+        # A file in a new directory brings that directory (and any new parents) into view.
+        while True:
+            self._touch(directory)
+            listing = self.listings.get(directory)
+            if listing is not None:
+                if not listing.add(name, is_dir, None if is_dir else language):
+                    return
+                self.entries += 1
+            if directory == root or not directory.startswith(root + os.sep):
+                return
+            directory, name = os.path.split(directory)
+            is_dir = True
+
+    def _touch(self, directory: str):
+        if directory in self.loading:
+            self.stale.add(directory)
+
+    def _shown(self, directory: str, root: str) -> bool:
+        """Whether a cached listing of one of its parents leads to ``directory``."""
+        while directory != root and directory.startswith(root + os.sep):
+            directory = os.path.dirname(directory)
+            if directory in self.listings:
+                return True
+        return False
+
+    async def _prune(self, directory: str, root: str):
+        """Drop ``directory``, and parents it leaves empty, from the cache once they are gone from disk."""
+        first = directory
+        try:
+            while directory != root and directory.startswith(root + os.sep):
+                if await asyncio.get_running_loop().run_in_executor(None, os.path.isdir, directory):
+                    return
+                self.forget(directory)
+                logging.debug(f"Removed deleted directory {directory} from the file tree")
+                directory, name = os.path.split(directory)
+                self._touch(directory)
+                listing = self.listings.get(directory)
+                if listing is not None:
+                    if listing.remove(name):
+                        self.entries -= 1
+                    if listing.entries:
+                        return
+        finally:
+            self.pruning.discard(first)
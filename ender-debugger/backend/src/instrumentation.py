@@ -0,0 +1,243 @@
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds in seconds; stages range from sub-microsecond filter checks to
+# multi-millisecond reads and sends.
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> '_Timer':
+        return _Timer(self)
+
+class _Timer:
+    """Context manager observing the elapsed seconds of its block."""
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """The child for one combination of label values, created on first use.
+
+        Hot paths should look children up once and keep them, not call this per event.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: int = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, values)} {child.value}'
+                for values, child in list(self._children.items())]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, values, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class Gauge(_Metric):
+    """A value read from ``source`` at scrape time, so the hot path never updates it.
+
+    ``source`` returns either a number or a mapping of label-value tuples to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, source: Callable[[], object], labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self.source = source
+
+    def samples(self) -> List[str]:
+        value = self.source()
+        if isinstance(value, dict):
+            return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(number)}'
+                    for values, number in value.items()]
+        return [f'{self.name} {_format_value(value)}']
+
+class Registry:
+    """Named metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Gauge):
+                # Module-level metrics may be declared by several importers; share one.
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, source: Callable[[], object], labels: Iterable[str] = ()) -> Gauge:
+        """Register (or replace) a gauge computed by ``source`` on every scrape."""
+        return self._register(Gauge(name, help, source, labels))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                lines.append(f'# {metric.name} unavailable: {_escape(e)}')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# Pipeline stages, in the order an event passes through them.
+WATCHDOG_EVENTS = REGISTRY.counter('ender_watchdog_events_total', 'Raw filesystem events received from watchdog', ['event'])
+FILTER_SECONDS = REGISTRY.histogram('ender_filter_seconds', 'Time to decide whether a path is ignored')
+FILTERED_EVENTS = REGISTRY.counter('ender_filtered_events_total', 'Events after filtering', ['result'])
+READ_SECONDS = REGISTRY.histogram('ender_read_seconds', 'Time to read and hash a changed file')
+READ_BYTES = REGISTRY.counter('ender_read_bytes_total', 'Bytes of file content read')
+LANGUAGE_SECONDS = REGISTRY.histogram('ender_language_seconds', 'Time to detect the language of a file')
+EMITTED_CHANGES = REGISTRY.counter('ender_changes_emitted_total', 'Settled changes emitted by the monitor', ['type'])
+ENCODE_SECONDS = REGISTRY.histogram('ender_encode_seconds', 'Time to encode one message for one wire', ['format'])
+PUBLISHED_MESSAGES = REGISTRY.counter('ender_messages_published_total', 'Messages routed to clients', ['type'])
+SEND_SECONDS = REGISTRY.histogram('ender_send_seconds', 'Time for one client send to complete')
+SENT_BYTES = REGISTRY.counter('ender_sent_bytes_total', 'Size of frames sent to clients (characters for text frames)')
+
+# Analysis scheduler, between the change stream and the model backend.
+ANALYSIS_REQUESTS = REGISTRY.counter('ender_analysis_requests_total', 'Analysis requests by outcome', ['outcome'])
+ANALYSIS_SECONDS = REGISTRY.histogram('ender_analysis_seconds', 'Time from a change to its analysis result')
+ANALYSIS_BATCH_SIZE = REGISTRY.histogram('ender_analysis_batch_size', 'Requests sent to the model in one call',
+                                         buckets=(1, 2, 4, 8, 16, 32, 64))
+
+# File tree service.
+TREE_LISTINGS = REGISTRY.counter('ender_tree_listings_total', 'Directory listings requested, by cache result', ['result'])
+
+def metrics_response(body: str) -> bytes:
+    """A complete HTTP/1.0 response carrying a Prometheus text exposition."""
+    data = body.encode('utf-8')
+    headers = ('HTTP/1.0 200 OK\r\n'
+               'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+               f'Content-Length: {len(data)}\r\n\r\n')
+    return headers.encode('ascii') + data
+
+def not_found_response() -> bytes:
+    return b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n'
+
+def parse_request_path(request_line: bytes) -> Optional[str]:
+    parts = request_line.decode('latin-1').split()
+    if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+        return None
+    return parts[1].split('?', 1)[0]
@@ -0,0 +1,37 @@
+import os
+from functools import lru_cache
+from typing import Dict
+
+class LanguageResolver:
+    """Maps file paths to language names.
+
+    The static extension table answers almost every event. Anything it misses
+    falls through to Pygments, which is only imported on the first miss and
+    whose answers are memoized per suffix (or per file name for suffix-less
+    files such as ``Makefile``) in a bounded LRU cache.
+    """
+
+    def __init__(self, static_table: Dict[str, str], cache_size: int = 512):
+        self.static_table = dict(static_table)
+        self._lookup = lru_cache(maxsize=cache_size)(self._pygments_language)
+
+    def resolve(self, file_path: str) -> str:
+        name = os.path.basename(file_path)
+        suffix = os.path.splitext(name)[1].lower()
+        language = self.static_table.get(suffix)
+        if language is not None:
+            return language
+        # Pygments matches on patterns like "*.ext" or "Makefile", so only the
+        # suffix (or the bare name) matters for the answer.
+        return self._lookup(('x' + suffix) if suffix else name)
+
+    @staticmethod
+    def _pygments_language(name: str) -> str:
+        from pygments.lexers import find_lexer_class_for_filename
+        lexer_class = find_lexer_class_for_filename(name)
+        if lexer_class is None:
+            return "text"
+        return lexer_class.name.lower()
+
+    def cache_info(self):
+        return self._lookup.cache_info()
@@ -1,9 +1,13 @@
+import time
+LAUNCHED_AT = time.perf_counter()  # Before the heavy imports, so startup logs include them.
+
 import os
 import sys
 import asyncio
 import logging
 import argparse
 from file_monitor import FileMonitor
+from file_index import DEFAULT_INDEX_PATH
 
 # Configure logging
 logging.basicConfig(
@@ -22,6 +26,10 @@ def parse_args():
     parser.add_argument('--host', default='localhost', help='Host to bind the server to')
     parser.add_argument('--port', type=int, default=9230, help='Port for the file monitor server')
     parser.add_argument('--watch-paths', nargs='+', default=[], help='Paths to watch with the file monitor')
+    parser.add_argument('--index-path', default=DEFAULT_INDEX_PATH, help='Location of the persistent file index')
+    parser.add_argument('--no-index', action='store_true', help='Disable the persistent file index')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Number of worker processes to split watch roots across (1 = in-process)')
     return parser.parse_args()
 
 async def main():
@@ -29,11 +37,19 @@ async def main():
     
     try:
         # Start the file monitor
-        file_monitor = FileMonitor()
+        index_path = None if args.no_index else args.index_path
+        if args.shards > 1:
+            from sharded_monitor import ShardedFileMonitor
+            file_monitor = ShardedFileMonitor(args.shards, index_path=index_path)
+        else:
+            file_monitor = FileMonitor(index_path=index_path)
         
         # Start file monitor
-        file_monitor.start(args.watch_paths, lambda change: logger.info(f"File change: {change['type']} - {change['path']}"))
-        logger.info(f"File monitor started watching: {args.watch_paths}")
+        # root_scanned, files_changed and offline_changes name a root rather than a path.
+        file_monitor.start(args.watch_paths, lambda change: logger.debug(
+            f"File change: {change['type']} - {change.get('path', change.get('root'))}"))
+        logger.info(f"File monitor started watching: {args.watch_paths} "
+                    f"({(time.perf_counter() - LAUNCHED_AT) * 1000:.0f} ms after launch)")
         
         # Create a future that never completes
         # We'll cancel it when we want to stop the server
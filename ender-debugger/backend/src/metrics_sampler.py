@@ -0,0 +1,345 @@
+import os
+import time
+import logging
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Fixed-point scale per metric kind: values are stored as floats but sent as
+# integer deltas of ``round(value * scale)``, which keeps batches exact and small.
+SCALES = {'cpu_percent': 100, 'memory_percent': 100, 'rss': 1 / 1024, 'threads': 1}
+
+# (bucket seconds, buckets kept) for each downsampled tier.
+DEFAULT_TIERS = ((1.0, 600), (10.0, 360), (60.0, 1440))
+
+class RingBuffer:
+    """Preallocated ring of (timestamp, value) doubles.
+
+    ``total`` counts every append ever made, so readers can ask for
+    everything after a position they saw earlier without the ring growing.
+    """
+    __slots__ = ('capacity', 'times', 'values', 'total')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.total = 0
+
+    def append(self, timestamp: float, value: float):
+        slot = self.total % self.capacity
+        self.times[slot] = timestamp
+        self.values[slot] = value
+        self.total += 1
+
+    def since(self, position: int) -> Tuple[int, List[float], List[float]]:
+        """Entries appended after ``position``; the first return is where reading actually started."""
+        start = max(position, self.total - self.capacity, 0)
+        times, values = [], []
+        for index in range(start, self.total):
+            slot = index % self.capacity
+            times.append(self.times[slot])
+            values.append(self.values[slot])
+        return start, times, values
+
+class TierBuffer:
+    """Preallocated ring of (bucket start, min, max, avg) for one downsampling tier."""
+    __slots__ = ('bucket', 'capacity', 'starts', 'mins', 'maxs', 'avgs', 'total',
+                 '_current', '_min', '_max', '_sum', '_count')
+
+    def __init__(self, bucket: float, capacity: int):
+        self.bucket = bucket
+        self.capacity = capacity
+        self.starts = array('d', bytes(8 * capacity))
+        self.mins = array('d', bytes(8 * capacity))
+        self.maxs = array('d', bytes(8 * capacity))
+        self.avgs = array('d', bytes(8 * capacity))
+        self.total = 0
+        self._current: Optional[float] = None
+        self._min = self._max = self._sum = 0.0
+        self._count = 0
+
+    def add(self, timestamp: float, value: float):
+        start = timestamp - timestamp % self.bucket
+        if start != self._current:
+            self._close()
+            self._current = start
+            self._min = self._max = self._sum = value
+            self._count = 1
+            return
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+        self._sum += value
+        self._count += 1
+
+    def _close(self):
+        if self._current is None:
+            return
+        slot = self.total % self.capacity
+        self.starts[slot] = self._current
+        self.mins[slot] = self._min
+        self.maxs[slot] = self._max
+        self.avgs[slot] = self._sum / self._count
+        self.total += 1
+
+    def rows(self) -> Dict[str, List[float]]:
+        start = max(self.total - self.capacity, 0)
+        slots = [index % self.capacity for index in range(start, self.total)]
+        return {'t': [self.starts[slot] for slot in slots], 'min': [self.mins[slot] for slot in slots],
+                'max': [self.maxs[slot] for slot in slots], 'avg': [self.avgs[slot] for slot in slots]}
+
+class Series:
+    __slots__ = ('name', 'scale', 'raw', 'tiers')
+
+    def __init__(self, name: str, scale: float, raw_capacity: int, tiers: Iterable[Tuple[float, int]]):
+        self.name = name
+        self.scale = scale
+        self.raw = RingBuffer(raw_capacity)
+        self.tiers = [TierBuffer(bucket, capacity) for bucket, capacity in tiers]
+
+    def add(self, timestamp: float, value: float):
+        self.raw.append(timestamp, value)
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+
+class MetricsSampler:
+    """Samples system and per-process counters on a background thread.
+
+    System CPU and memory are read every ``interval``. Tracked processes
+    (this one, its children and any pids passed to ``track``) are sampled
+    round-robin, at most ``process_budget`` per tick, so the cost per tick
+    stays flat however many processes are tracked. The sampler measures its
+    own thread CPU time and, if it goes over ``cpu_budget`` (a fraction of
+    one core), stretches the process stride until it is back under.
+    """
+
+    def __init__(self, interval: float = 0.1, raw_seconds: float = 60.0, tiers=DEFAULT_TIERS,
+                 process_budget: int = 8, cpu_budget: float = 0.006, children_refresh: float = 5.0):
+        self.interval = interval
+        self.raw_capacity = max(1, int(raw_seconds / interval))
+        self.tiers = tiers
+        self.process_budget = process_budget
+        self.cpu_budget = cpu_budget
+        self.children_refresh = children_refresh
+        self.series: Dict[str, Series] = {}
+        self.lock = threading.Lock()
+        self.tracked: Set[int] = set()
+        # Changed from the event loop by track/untrack; guarded by ``lock``.
+        self.extra_pids: Set[int] = set()
+        self.stride = 1
+        self.cpu_used = 0.0
+        self._processes: Dict[int, Any] = {}
+        self._cursor = 0
+        self._tick = 0
+        self._adjusted = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._psutil = None
+
+    def start(self) -> bool:
+        """Start sampling; returns False when psutil is not installed."""
+        try:
+            import psutil  # Deferred so servers without metrics subscribers never pay for it.
+        except ImportError:
+            logging.warning("psutil is not installed, system metrics are disabled")
+            return False
+        self._psutil = psutil
+        psutil.cpu_percent(None)  # Prime the counter; the first call always reports 0.
+        self._refresh_children()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def track(self, pid: int):
+        with self.lock:
+            self.extra_pids.add(pid)
+
+    def untrack(self, pid: int):
+        with self.lock:
+            self.extra_pids.discard(pid)
+
+    def _series(self, name: str, kind: str) -> Series:
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = Series(name, SCALES[kind], self.raw_capacity, self.tiers)
+        return series
+
+    def _refresh_children(self):
+        own = os.getpid()
+        try:
+            children = {child.pid for child in self._psutil.Process(own).children(recursive=True)}
+        except self._psutil.Error:
+            children = set()
+        with self.lock:
+            extra_pids = set(self.extra_pids)
+        self.tracked = {own} | children | extra_pids
+        for pid in list(self._processes):
+            if pid not in self.tracked:
+                self._drop(pid)
+        for pid in self.tracked:
+            if pid not in self._processes:
+                try:
+                    process = self._psutil.Process(pid)
+                    process.cpu_percent(None)
+                    self._processes[pid] = process
+                except self._psutil.NoSuchProcess:
+                    with self.lock:
+                        self.extra_pids.discard(pid)  # A tracked pid that exited; never follow a reused one.
+                except self._psutil.Error:
+                    continue
+
+    def _drop(self, pid: int):
+        """Forget an exited process and its series; cursors tell their clients on the next batch."""
+        self._processes.pop(pid, None)
+        prefix = f'process.{pid}.'
+        with self.lock:
+            for name in [name for name in self.series if name.startswith(prefix)]:
+                del self.series[name]
+
+    def _run(self):
+        next_tick = time.monotonic()
+        last_refresh = next_tick
+        while not self._stop.is_set():
+            cpu_start = time.thread_time()
+            now = time.time()
+            if time.monotonic() - last_refresh >= self.children_refresh:
+                self._refresh_children()
+                last_refresh = time.monotonic()
+            try:
+                self._sample(now)
+            except Exception as e:
+                logging.error(f"Error sampling metrics: {e}")
+            self._tick += 1
+
+            # Exponentially smoothed share of one core spent sampling.
+            used = (time.thread_time() - cpu_start) / self.interval
+            self.cpu_used = used if self._tick == 1 else self.cpu_used * 0.9 + used * 0.1
+            # Only adjust once the average has had a few ticks to settle after the last change.
+            if self._tick - self._adjusted >= 20:
+                if self.cpu_used > self.cpu_budget and self.stride < 64:
+                    self.stride *= 2
+                    self._adjusted = self._tick
+                elif self.cpu_used < self.cpu_budget / 3 and self.stride > 1:
+                    self.stride //= 2
+                    self._adjusted = self._tick
+
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                next_tick = time.monotonic()  # We fell behind; skip the missed ticks.
+                delay = 0
+            self._stop.wait(delay)
+
+    def _sample(self, now: float):
+        psutil = self._psutil
+        cpu = psutil.cpu_percent(None)
+        memory = psutil.virtual_memory().percent
+        pids = sorted(self._processes)
+        batch = []
+        if pids and self._tick % self.stride == 0:
+            count = min(self.process_budget, len(pids))
+            for offset in range(count):
+                pid = pids[(self._cursor + offset) % len(pids)]
+                process = self._processes[pid]
+                try:
+                    with process.oneshot():
+                        batch.append((pid, process.cpu_percent(None), process.memory_info().rss,
+                                      process.num_threads()))
+                except psutil.NoSuchProcess:
+                    self._drop(pid)
+                    with self.lock:
+                        self.extra_pids.discard(pid)
+                except psutil.Error:
+                    self._processes.pop(pid, None)
+            self._cursor = (self._cursor + count) % len(pids)
+        with self.lock:
+            self._series('system.cpu_percent', 'cpu_percent').add(now, cpu)
+            self._series('system.memory_percent', 'memory_percent').add(now, memory)
+            for pid, process_cpu, rss, threads in batch:
+                self._series(f'process.{pid}.cpu_percent', 'cpu_percent').add(now, process_cpu)
+                self._series(f'process.{pid}.rss', 'rss').add(now, rss)
+                self._series(f'process.{pid}.threads', 'threads').add(now, threads)
+
+    def names(self, prefixes: Optional[List[str]] = None) -> List[str]:
+        with self.lock:
+            names = list(self.series)
+        if prefixes:
+            names = [name for name in names if any(name.startswith(prefix) for prefix in prefixes)]
+        return sorted(names)
+
+    def history(self, names: List[str], tier: int) -> Dict[str, Dict[str, List[float]]]:
+        """Downsampled min/max/avg rows for ``names`` from tier ``tier`` (0 is the finest)."""
+        with self.lock:
+            return {name: self.series[name].tiers[tier].rows() for name in names
+                    if name in self.series and tier < len(self.series[name].tiers)}
+
+    def read_since(self, name: str, position: int) -> Optional[Tuple[int, int, float, List[float], List[float]]]:
+        """(start, new position, scale, times, values) of raw samples after ``position``."""
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                return None
+            start, times, values = series.raw.since(position)
+            return start, series.raw.total, series.scale, times, values
+
+class MetricsCursor:
+    """One client's read position per series, turning new samples into delta-encoded batches.
+
+    Timestamps become millisecond deltas and values become integer deltas of
+    their fixed-point form, each relative to the previous sample the client
+    received, so a steady metric costs about one small integer per sample.
+    Series the client was following that have since been dropped (their
+    process exited) are listed once under ``removed``.
+    """
+
+    def __init__(self, prefixes: Optional[List[str]] = None):
+        self.prefixes = prefixes
+        self.positions: Dict[str, int] = {}
+        self.last: Dict[str, Tuple[int, int]] = {}
+
+    def batch(self, sampler: MetricsSampler) -> Optional[Dict[str, Any]]:
+        series = {}
+        names = sampler.names(self.prefixes)
+        removed = sorted(set(self.positions) - set(names))
+        for name in removed:
+            del self.positions[name]
+            self.last.pop(name, None)
+        for name in names:
+            previous = self.positions.get(name, 0)
+            result = sampler.read_since(name, previous)
+            if result is None:
+                continue
+            start, position, scale, times, values = result
+            self.positions[name] = position
+            if not times:
+                continue
+            entry: Dict[str, Any] = {}
+            if name not in self.last or start > previous:
+                entry['scale'] = scale  # Absolute base: first batch, or the ring overran this client.
+            last_time, last_value = self.last.get(name, (0, 0)) if 'scale' not in entry else (0, 0)
+            time_deltas, value_deltas = [], []
+            for timestamp, value in zip(times, values):
+                millis = int(round(timestamp * 1000))
+                quantized = int(round(value * scale))
+                time_deltas.append(millis - last_time)
+                value_deltas.append(quantized - last_value)
+                last_time, last_value = millis, quantized
+            self.last[name] = (last_time, last_value)
+            entry['t'] = time_deltas
+            entry['v'] = value_deltas
+            series[name] = entry
+        if not series and not removed:
+            return None
+        batch: Dict[str, Any] = {'type': 'metrics', 'series': series}
+        if removed:
+            batch['removed'] = removed
+        return batch
@@ -0,0 +1,229 @@
+import os
+import re
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from path_trie import PathTrie
+
+IGNORE_FILE_NAMES = ('.gitignore', '.ignore')
+
+def _translate_glob(pattern: str) -> str:
+    """Translate one gitignore glob into a regular expression over '/'-separated paths."""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                at_start = i == 0 or pattern[i - 1] == '/'
+                after = pattern[i + 2:i + 3]
+                if at_start and after == '/':
+                    out.append('(?:.*/)?')
+                    i += 3
+                    continue
+                if at_start and after == '':
+                    out.append('.*')
+                    i += 2
+                    continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+class IgnoreRule:
+    """One compiled line of a .gitignore/.ignore file."""
+    __slots__ = ('base', 'regex', 'negate', 'dir_only', 'anchored')
+
+    def __init__(self, base: str, regex, negate: bool, dir_only: bool, anchored: bool):
+        self.base = base
+        self.regex = regex
+        self.negate = negate
+        self.dir_only = dir_only
+        self.anchored = anchored
+
+    def matches(self, path: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            return self.regex.fullmatch(name) is not None
+        rel = path[len(self.base):].lstrip(os.sep)
+        if os.sep != '/':
+            rel = rel.replace(os.sep, '/')
+        return self.regex.fullmatch(rel) is not None
+
+def parse_ignore_lines(base: str, lines: Iterable[str]) -> List[IgnoreRule]:
+    """Compile gitignore-style lines whose patterns are relative to ``base``."""
+    rules = []
+    for raw in lines:
+        line = raw.rstrip('\n').rstrip('\r')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\#') or line.startswith('\\!'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        anchored = '/' in line
+        line = line.lstrip('/')
+        try:
+            regex = re.compile(_translate_glob(line))
+        except re.error:
+            logging.debug(f"Skipping invalid ignore pattern {raw!r} in {base}")
+            continue
+        rules.append(IgnoreRule(base, regex, negate, dir_only, anchored))
+    return rules
+
+def _last_match(rules: Tuple[IgnoreRule, ...], path: str, name: str, is_dir: bool) -> bool:
+    for rule in reversed(rules):
+        if rule.matches(path, name, is_dir):
+            return not rule.negate
+    return False
+
+class _DirState:
+    __slots__ = ('ignored', 'rules')
+
+    def __init__(self, ignored: bool, rules: Tuple[IgnoreRule, ...]):
+        self.ignored = ignored
+        self.rules = rules
+
+class PathFilter:
+    """Compiled replacement for the per-event checks in ``FileChangeHandler.should_ignore``.
+
+    A path is rejected by its suffix first (one dict lookup), then by a cached
+    per-directory decision that combines ``ignored_dirs`` with the .gitignore
+    and .ignore files found between a watched root and the directory. Only
+    files that survive both are matched against the ignore rules by name.
+
+    Extensions listed both as ignored and as supported are treated as
+    ignored: ``ignored_extensions`` always wins, so the outcome does not
+    depend on set iteration order.
+    """
+
+    def __init__(self, ignored_dirs: Set[str], ignored_extensions: Set[str],
+                 supported_extensions: Dict[str, str],
+                 ignore_file_names: Tuple[str, ...] = IGNORE_FILE_NAMES):
+        self.ignored_dirs = frozenset(ignored_dirs)
+        ignored = {ext.lower() for ext in ignored_extensions}
+        self.conflicting_extensions = frozenset(ext for ext in supported_extensions if ext.lower() in ignored)
+        self.suffix_language = {ext.lower(): language for ext, language in supported_extensions.items()
+                                if ext.lower() not in ignored}
+        self.ignore_file_names = ignore_file_names
+        self.roots: Set[str] = set()
+        self._root_trie = PathTrie()
+        self._dir_cache: Dict[str, _DirState] = {}
+        self._lock = threading.Lock()
+        if self.conflicting_extensions:
+            logging.debug(f"Extensions both supported and ignored, ignoring: {sorted(self.conflicting_extensions)}")
+
+    def add_root(self, root: str):
+        root = os.path.normpath(root)
+        with self._lock:
+            self.roots.add(root)
+            self._root_trie.insert(root)
+            self._dir_cache.clear()
+
+    def remove_root(self, root: str):
+        root = os.path.normpath(root)
+        with self._lock:
+            self.roots.discard(root)
+            self._root_trie.remove(root)
+            self._dir_cache.clear()
+
+    def is_ignore_file(self, path: str) -> bool:
+        return os.path.basename(path) in self.ignore_file_names
+
+    def invalidate(self, directory: str):
+        """Forget cached decisions at and below ``directory`` after one of its ignore files changed."""
+        directory = os.path.normpath(directory)
+        prefix = directory + os.sep
+        with self._lock:
+            for cached in [d for d in self._dir_cache if d == directory or d.startswith(prefix)]:
+                del self._dir_cache[cached]
+
+    def is_ignored_dir(self, directory: str) -> bool:
+        """Whether nothing under ``directory`` can pass the filter; used to prune walks."""
+        return self._dir_state(os.path.normpath(directory)).ignored
+
+    def should_ignore(self, path: str) -> bool:
+        cut = path.rfind(os.sep)
+        if os.altsep:
+            cut = max(cut, path.rfind(os.altsep))
+        name = path[cut + 1:]
+        dot = name.rfind('.')
+        if dot <= 0 or name[dot:].lower() not in self.suffix_language:
+            return True
+        directory = path[:cut] if cut > 0 else (os.sep if cut == 0 else '')
+        state = self._dir_state(directory)
+        if state.ignored:
+            return True
+        return bool(state.rules) and _last_match(state.rules, path, name, False)
+
+    def _dir_state(self, directory: str) -> _DirState:
+        state = self._dir_cache.get(directory)
+        if state is not None:
+            return state
+        with self._lock:
+            return self._compute_locked(directory)
+
+    def _compute_locked(self, directory: str) -> _DirState:
+        state = self._dir_cache.get(directory)
+        if state is not None:
+            return state
+        name = os.path.basename(directory)
+        parent = os.path.dirname(directory)
+        # Only the outermost root starts a rule chain; nested roots inherit.
+        is_outer_root = directory in self.roots and self._root_trie.shortest_prefix(directory) == directory
+        if is_outer_root or not name or parent == directory:
+            ignored = name in self.ignored_dirs
+            inherited: Tuple[IgnoreRule, ...] = ()
+            under_root = is_outer_root
+        else:
+            parent_state = self._compute_locked(parent)
+            ignored = (parent_state.ignored or name in self.ignored_dirs or
+                       (bool(parent_state.rules) and _last_match(parent_state.rules, directory, name, True)))
+            inherited = parent_state.rules
+            under_root = bool(inherited) or self._under_root(directory)
+        rules = inherited
+        if not ignored and under_root:
+            own = self._load_rules(directory)
+            if own:
+                rules = inherited + tuple(own)
+        state = _DirState(ignored, rules)
+        self._dir_cache[directory] = state
+        return state
+
+    def _under_root(self, directory: str) -> bool:
+        return self._root_trie.shortest_prefix(directory) is not None
+
+    def _load_rules(self, directory: str) -> Optional[List[IgnoreRule]]:
+        rules = []
+        for file_name in self.ignore_file_names:
+            ignore_path = os.path.join(directory, file_name)
+            try:
+                with open(ignore_path, 'r', encoding='utf-8', errors='replace') as file:
+                    rules.extend(parse_ignore_lines(directory, file))
+            except OSError:
+                continue
+        return rules
@@ -0,0 +1,102 @@
+import os
+from typing import Dict, Iterable, List, Optional
+
+class _Node:
+    __slots__ = ('children', 'root')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.root: Optional[str] = None
+
+def path_components(path: str) -> List[str]:
+    path = os.path.normpath(path)
+    if os.altsep:
+        path = path.replace(os.altsep, os.sep)
+    return [part for part in path.split(os.sep) if part]
+
+class PathTrie:
+    """Path-component trie for longest-prefix root lookups in O(depth).
+
+    Matching is per component, so ``~/code2/a`` never matches the root
+    ``~/code`` and a nested root such as ``~/code/x`` wins over ``~/code``.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()):
+        self._root = _Node()
+        self._count = 0
+        for path in paths:
+            self.insert(path)
+
+    def insert(self, path: str):
+        node = self._root
+        for part in path_components(path):
+            node = node.children.setdefault(part, _Node())
+        if node.root is None:
+            self._count += 1
+        node.root = path
+
+    def remove(self, path: str) -> bool:
+        trail = [self._root]
+        parts = path_components(path)
+        for part in parts:
+            child = trail[-1].children.get(part)
+            if child is None:
+                return False
+            trail.append(child)
+        if trail[-1].root is None:
+            return False
+        trail[-1].root = None
+        self._count -= 1
+        # Prune branches that no longer lead to a root.
+        for depth in range(len(parts), 0, -1):
+            node = trail[depth]
+            if node.root is not None or node.children:
+                break
+            del trail[depth - 1].children[parts[depth - 1]]
+        return True
+
+    def longest_prefix(self, path: str) -> Optional[str]:
+        """The deepest inserted root that contains ``path`` (or equals it)."""
+        node = self._root
+        best = node.root
+        for part in path_components(path):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.root is not None:
+                best = node.root
+        return best
+
+    def shortest_prefix(self, path: str) -> Optional[str]:
+        """The outermost inserted root that contains ``path`` (or equals it)."""
+        node = self._root
+        if node.root is not None:
+            return node.root
+        for part in path_components(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+            if node.root is not None:
+                return node.root
+        return None
+
+    def __contains__(self, path: str) -> bool:
+        node = self._root
+        for part in path_components(path):
+            node = node.children.get(part)
+            if node is None:
+                return False
+        return node.root is not None
+
+    def __len__(self):
+        return self._count
+
+def collapse_nested(paths: Iterable[str]) -> List[str]:
+    """Drop duplicate roots and roots nested inside another root, keeping the outermost."""
+    trie = PathTrie()
+    outermost = []
+    for path in sorted({os.path.normpath(p) for p in paths}, key=lambda p: (len(path_components(p)), p)):
+        if trie.shortest_prefix(path) is None:
+            trie.insert(path)
+            outermost.append(path)
+    return outermost
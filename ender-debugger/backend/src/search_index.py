@@ -0,0 +1,492 @@
+import os
+import re
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from content_reader import hash_bytes
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # Python 3.11+
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+DEFAULT_SEARCH_PATH = str(Path.home() / ".ender-debugger" / "search")
+
+# Segment layout, native byte order: header, uint32 postings, uint32 trigram keys
+# (padded to 8 bytes), then uint64 offsets into the postings, one per key plus an end.
+_MAGIC = b'ETRI'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIIQ')  # magic, version, key count, padding, postings count
+
+_EMPTY = array('I')
+
+def trigram_keys(data: bytes) -> Set[int]:
+    """The distinct 3-byte windows of ``data`` as 24-bit integers."""
+    return {int.from_bytes(gram, 'big') for gram in {data[i:i + 3] for i in range(len(data) - 2)}}
+
+def _normalize(text: str) -> bytes:
+    return text.lower().encode('utf-8', 'replace')
+
+def required_literals(pattern: str, flags: int = 0) -> List[str]:
+    """Literal runs every match of ``pattern`` must contain.
+
+    Walks the parsed regex and keeps runs of consecutive literal characters
+    in the mandatory parts. Alternations, character classes, optional
+    repeats and wildcards end a run and add nothing, so the result is
+    always safe to filter on; it may just be empty.
+    """
+    runs: List[str] = []
+
+    def walk(items):
+        run: List[str] = []
+        for op, av in items:
+            if op is sre_constants.LITERAL:
+                run.append(chr(av))
+                continue
+            if op is sre_constants.AT:
+                continue  # Anchors are zero-width; the characters around them are still adjacent.
+            runs.append(''.join(run))
+            run = []
+            if op is sre_constants.SUBPATTERN:
+                walk(av[-1])
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+                walk(av[2])
+        runs.append(''.join(run))
+
+    walk(sre_parse.parse(pattern, flags))
+    return [run for run in runs if len(run) >= 3]
+
+class _Segment:
+    """A read-only, memory-mapped postings file; nothing is loaded onto the heap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, _, total = _HEADER.unpack_from(self.map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Not a search segment: {path}")
+        view = memoryview(self.map)
+        offset = _HEADER.size
+        self.postings = view[offset:offset + 4 * total].cast('I')
+        offset += 4 * total
+        self.keys = view[offset:offset + 4 * count].cast('I')
+        offset += 4 * count + (4 * count) % 8
+        self.offsets = view[offset:offset + 8 * (count + 1)].cast('Q')
+        self.size = len(self.map)
+
+    def get(self, key: int) -> Sequence[int]:
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.postings[self.offsets[index]:self.offsets[index + 1]]
+        return _EMPTY
+
+def _write_segment(path: str, entries: Iterator[Tuple[int, Sequence[bytes]]]):
+    """Write (key, posting blocks) pairs, keys ascending, as a segment file."""
+    keys = array('I')
+    offsets = array('Q', [0])
+    total = 0
+    with open(path, 'wb') as file:
+        file.write(bytes(_HEADER.size))
+        for key, blocks in entries:
+            length = 0
+            for block in blocks:
+                file.write(block)
+                length += len(block) // 4
+            if length:
+                keys.append(key)
+                total += length
+                offsets.append(total)
+        keys.tofile(file)
+        file.write(bytes((4 * len(keys)) % 8))
+        offsets.tofile(file)
+        file.seek(0)
+        file.write(_HEADER.pack(_MAGIC, _VERSION, len(keys), 0, total))
+
+class SearchIndex:
+    """Trigram index over file contents for regex and literal code search.
+
+    Every lowercased 3-byte window of a file maps to a sorted list of
+    document ids. Lists for compacted documents live in a memory-mapped
+    segment of flat uint32 arrays. Documents indexed since then sit in an
+    in-memory delta of ``array('I')`` lists. Once the estimated heap use
+    passes ``memory_budget``, the delta is merged into a new segment.
+    A changed file gets a new id and its old one becomes a tombstone.
+    Tombstones are dropped, and ids renumbered, once they make up more than
+    ``max_dead_fraction`` of the documents.
+
+    Documents are only added, removed and compacted from one thread; queries
+    may run on any number of others.
+
+    A query intersects the lists of the trigrams its pattern requires. It
+    then reads only the surviving files and runs the regex over each line, so
+    results are always exact.
+    """
+
+    def __init__(self, directory: Optional[str] = DEFAULT_SEARCH_PATH, memory_budget: int = 64 * 1024 * 1024,
+                 max_file_bytes: int = 1024 * 1024, max_dead_fraction: float = 0.2):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.max_file_bytes = max_file_bytes
+        self.max_dead_fraction = max_dead_fraction
+        # Document id -> (absolute path, root, content hash), or None once superseded.
+        self.docs: List[Optional[Tuple[str, Optional[str], Optional[str]]]] = []
+        self.ids: Dict[str, int] = {}
+        self.segment: Optional[_Segment] = None
+        self.delta: Dict[int, array] = {}
+        self.delta_postings = 0
+        self.dead = 0
+        self.generation = 0
+        # Generation whose compaction last renumbered document ids; search cursors carry it.
+        self.numbering = 0
+        self.compactions = 0
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Map the last compacted segment and its document table, if there is one."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, 'CURRENT'), encoding='utf-8') as file:
+                generation = int(file.read().strip())
+            segment = _Segment(os.path.join(self.directory, f'postings-{generation}.idx'))
+            with open(os.path.join(self.directory, f'docs-{generation}.json'), encoding='utf-8') as file:
+                docs = [tuple(doc) if doc else None for doc in json.load(file)]
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"Discarding unreadable search index in {self.directory}: {e}")
+            return
+        with self._lock:
+            self.generation = generation
+            self.numbering = generation
+            self.segment = segment
+            self.docs = docs
+            self.ids = {doc[0]: index for index, doc in enumerate(docs) if doc is not None}
+            self.dead = len(docs) - len(self.ids)
+        logging.info(f"Opened search index with {len(self.ids)} files, {segment.size // 1024} KiB mapped")
+
+    def current_hash(self, key: str) -> Optional[str]:
+        with self._lock:
+            doc = self.ids.get(key)
+            return self.docs[doc][2] if doc is not None else None
+
+    def paths(self, root: str) -> List[str]:
+        with self._lock:
+            return [key for key, doc in self.ids.items() if self.docs[doc][1] == root]
+
+    def delta_bytes(self) -> int:
+        return self.delta_postings * 4 + len(self.delta) * 120
+
+    def heap_bytes(self) -> int:
+        """Rough heap use of the delta and document table; the mapped segment is not counted."""
+        return self.delta_bytes() + len(self.docs) * 200
+
+    def add(self, key: str, root: Optional[str], text: str, digest: Optional[str] = None):
+        """Index (or re-index) the file at absolute path ``key``."""
+        keys = trigram_keys(_normalize(text))
+        with self._lock:
+            self._tombstone_locked(key)
+            doc = len(self.docs)
+            self.docs.append((key, root, digest))
+            self.ids[key] = doc
+            delta = self.delta
+            for trigram in keys:
+                postings = delta.get(trigram)
+                if postings is None:
+                    postings = delta[trigram] = array('I')
+                postings.append(doc)
+            self.delta_postings += len(keys)
+        # Compaction can only shrink the delta; the document table stays on the heap either way.
+        table_bytes = len(self.docs) * 200
+        if self.delta_bytes() > max(self.memory_budget - table_bytes, self.memory_budget // 8):
+            self.compact()
+
+    def remove(self, key: str):
+        with self._lock:
+            self._tombstone_locked(key)
+
+    def _tombstone_locked(self, key: str):
+        doc = self.ids.pop(key, None)
+        if doc is not None:
+            self.docs[doc] = None
+            self.dead += 1
+
+    def compact(self):
+        """Merge the delta into a new on-disk segment and map it in place of the old one.
+
+        Runs on the thread that adds documents (``add`` calls it when over
+        budget), so nothing changes underneath it; queries keep using the
+        old segment and delta until the new ones are swapped in together.
+        """
+        if not self.directory:
+            return
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        docs = self.docs
+        renumber = self.dead > self.max_dead_fraction * max(1, len(docs))
+        remap: Optional[array] = None
+        table = docs
+        if renumber:
+            remap = array('i', [-1]) * len(docs)
+            table = []
+            for index, doc in enumerate(docs):
+                if doc is not None:
+                    remap[index] = len(table)
+                    table.append(doc)
+        generation = self.generation + 1
+        path = os.path.join(self.directory, f'postings-{generation}.idx')
+        _write_segment(path, self._merged(self.segment, self.delta, remap))
+        with open(os.path.join(self.directory, f'docs-{generation}.json'), 'w', encoding='utf-8') as file:
+            json.dump(table, file, separators=(',', ':'))
+        segment = _Segment(path)
+        with open(os.path.join(self.directory, 'CURRENT.tmp'), 'w', encoding='utf-8') as file:
+            file.write(str(generation))
+        os.replace(os.path.join(self.directory, 'CURRENT.tmp'), os.path.join(self.directory, 'CURRENT'))
+        postings = self.delta_postings
+        with self._lock:
+            if renumber:
+                self.docs = list(table)
+                self.ids = {doc[0]: index for index, doc in enumerate(self.docs)}
+                self.dead = 0
+                self.numbering = generation
+            self.segment = segment
+            self.delta = {}
+            self.delta_postings = 0
+            self.generation = generation
+            self.compactions += 1
+        # The old mapping is released once the last query holding it finishes.
+        self._remove_generation(generation - 1)
+        logging.info(f"Compacted search index: {postings} new postings, {segment.size // 1024} KiB segment "
+                     f"{'(renumbered) ' if renumber else ''}in {time.perf_counter() - started:.2f}s")
+
+    def _merged(self, segment: Optional[_Segment], delta: Dict[int, array],
+                remap: Optional[array]) -> Iterator[Tuple[int, List[bytes]]]:
+        """(key, posting blocks) for the union of the segment and the delta, keys ascending."""
+        delta_keys = sorted(delta)
+        base_keys = segment.keys if segment is not None else _EMPTY
+        i = j = 0
+        while i < len(base_keys) or j < len(delta_keys):
+            if j >= len(delta_keys) or (i < len(base_keys) and base_keys[i] < delta_keys[j]):
+                key = base_keys[i]
+                blocks = [segment.postings[segment.offsets[i]:segment.offsets[i + 1]]]
+                i += 1
+            elif i >= len(base_keys) or delta_keys[j] < base_keys[i]:
+                key = delta_keys[j]
+                blocks = [delta[key]]
+                j += 1
+            else:
+                key = delta_keys[j]
+                blocks = [segment.postings[segment.offsets[i]:segment.offsets[i + 1]], delta[key]]
+                i += 1
+                j += 1
+            if remap is not None:
+                blocks = [array('I', (remap[doc] for block in blocks for doc in block if remap[doc] >= 0))]
+            # Delta ids are always above segment ids, so concatenating keeps each list sorted.
+            yield key, [block.tobytes() if isinstance(block, array) else block.cast('B') for block in blocks]
+
+    def _remove_generation(self, generation: int):
+        for name in (f'postings-{generation}.idx', f'docs-{generation}.json'):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass  # Still mapped on platforms that refuse to delete open files; retried next time.
+
+    def candidates(self, literals: List[str], root: Optional[str] = None,
+                   cursor: int = 0) -> Tuple[int, List[Tuple[int, Tuple[str, Optional[str], Optional[str]]]]]:
+        """The id numbering, and (id, document) for live documents from ``cursor`` on with every trigram of ``literals``.
+
+        Documents come from the same snapshot as the postings, so a
+        renumbering compaction meanwhile cannot point an id at another file.
+        """
+        keys = set()
+        for literal in literals:
+            keys |= trigram_keys(_normalize(literal))
+        with self._lock:
+            segment = self.segment
+            lists = []
+            for key in keys:
+                base = segment.get(key) if segment is not None else _EMPTY
+                recent = array('I', self.delta.get(key, _EMPTY))
+                if not len(base) and not len(recent):
+                    return self.numbering, []
+                lists.append((len(base) + len(recent), base, recent))
+            docs = self.docs
+            count = len(docs)
+            numbering = self.numbering
+        if not lists:
+            result = range(cursor, count)
+        else:
+            lists.sort(key=lambda entry: entry[0])
+            _, base, recent = lists[0]
+            result = [doc for doc in list(base) + list(recent) if doc >= cursor]
+            for length, base, recent in lists[1:]:
+                if not result:
+                    break
+                if len(result) * 16 < length:
+                    # Few candidates against a long list: binary search instead of building a set.
+                    result = [doc for doc in result if _contains(base, doc) or _contains(recent, doc)]
+                else:
+                    present = set(base)
+                    present.update(recent)
+                    result = [doc for doc in result if doc in present]
+        return numbering, [(doc, docs[doc]) for doc in result if doc < count and docs[doc] is not None
+                           and (root is None or docs[doc][1] == root)]
+
+    def read_bytes(self, key: str) -> Optional[bytes]:
+        """The file's bytes, or None if it is missing, binary or over ``max_file_bytes``."""
+        try:
+            with open(key, 'rb') as file:
+                data = file.read(self.max_file_bytes + 1)
+        except OSError:
+            return None
+        if len(data) > self.max_file_bytes or b'\0' in data[:8192]:
+            return None
+        return data
+
+    def read(self, key: str) -> Optional[str]:
+        data = self.read_bytes(key)
+        return data.decode('utf-8', 'replace') if data is not None else None
+
+    def search(self, pattern: str, literal: bool = False, ignore_case: bool = False, root: Optional[str] = None,
+               cursor: Optional[str] = None, max_per_file: int = 20) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (position, match) for each matching line, in document id order.
+
+        A position is an opaque cursor for the match's file. Resume a stopped
+        search by passing the position of the first file not consumed as
+        ``cursor``. Raises ValueError for an invalid regex or cursor, and for
+        a cursor from before a compaction renumbered the documents.
+        """
+        flags = re.IGNORECASE if ignore_case else 0
+        source = re.escape(pattern) if literal else pattern
+        try:
+            regex = re.compile(source, flags)
+            literals = [pattern] if literal else required_literals(source, flags)
+        except re.error as e:
+            raise ValueError(f"Invalid pattern: {e}")
+        start, expected = 0, None
+        if cursor:
+            numbering, _, doc = cursor.partition('/')
+            try:
+                expected, start = int(numbering), int(doc)
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+        numbering, candidates = self.candidates(literals, root, start)
+        if expected is not None and expected != numbering:
+            raise ValueError("Stale cursor: the search index was renumbered; restart the search")
+        for doc, (key, doc_root, _) in candidates:
+            text = self.read(key)
+            if text is None:
+                continue
+            found = 0
+            for number, line in enumerate(text.splitlines(), 1):
+                match = regex.search(line)
+                if match is None:
+                    continue
+                relative = key[len(doc_root):].lstrip(os.sep) if doc_root and key.startswith(doc_root) else key
+                yield f"{numbering}/{doc}", {'root': doc_root, 'path': relative, 'line': number, 'text': line[:500],
+                            'start': match.start(), 'end': match.end()}
+                found += 1
+                if found >= max_per_file:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'files': len(self.ids), 'dead': self.dead, 'delta_trigrams': len(self.delta),
+                    'delta_postings': self.delta_postings, 'heap_bytes': self.heap_bytes(),
+                    'segment_bytes': self.segment.size if self.segment is not None else 0,
+                    'compactions': self.compactions}
+
+def _contains(postings: Sequence[int], doc: int) -> bool:
+    index = bisect_left(postings, doc)
+    return index < len(postings) and postings[index] == doc
+
+class SearchIndexer:
+    """Background thread feeding a ``SearchIndex`` from change events and root scans.
+
+    Submissions are coalesced per path, latest wins. Files whose hash
+    matches what is already indexed are skipped, so reconciling a root
+    against the file index after a scan only reads what changed.
+    """
+
+    def __init__(self, index: SearchIndex, compact_when_idle: int = 1_000_000):
+        self.index = index
+        # Idle compaction only once enough has accumulated to be worth rewriting the segment.
+        self.compact_when_idle = compact_when_idle
+        self.pending: Dict[str, Tuple[Optional[str], Optional[str], Optional[str], bool]] = {}
+        self.indexed = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='search-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, key: str, root: Optional[str], content: Optional[str] = None, digest: Optional[str] = None,
+               deleted: bool = False):
+        if digest is not None and not deleted and self.index.current_hash(key) == digest:
+            return
+        with self._condition:
+            self.pending[key] = (root, content, digest, deleted)
+            self._condition.notify()
+
+    def reconcile(self, root: str, rows: List[List[Any]], fields: List[str]):
+        """Queue every file of a scanned root whose hash differs from the index; drop vanished ones."""
+        path_field, hash_field = fields.index('path'), fields.index('hash')
+        seen = set()
+        for row in rows:
+            key = os.path.join(root, row[path_field])
+            seen.add(key)
+            self.submit(key, root, digest=row[hash_field])
+        for key in self.index.paths(root):
+            if key not in seen:
+                self.submit(key, root, deleted=True)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self.pending and not self._stopped:
+                    self._condition.wait(5.0)
+                if self._stopped:
+                    return
+                idle = not self.pending
+                if not idle:
+                    key = next(iter(self.pending))
+                    root, content, digest, deleted = self.pending.pop(key)
+            try:
+                if idle:
+                    if self.index.delta_postings >= self.compact_when_idle:
+                        self.index.compact()
+                elif deleted:
+                    self.index.remove(key)
+                else:
+                    if content is None:
+                        data = self.index.read_bytes(key)
+                        if data is None:
+                            self.index.remove(key)
+                            continue
+                        content = data.decode('utf-8', 'replace')
+                        # Hash the bytes, as the file index does, so the next reconcile matches.
+                        digest = hash_bytes(data)
+                    self.index.add(key, root, content, digest)
+                    self.indexed += 1
+            except Exception as e:
+                logging.error(f"Error updating search index: {e}")
@@ -0,0 +1,394 @@
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+import zlib
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Set
+from file_monitor import FileMonitor, get_common_dev_directories
+from path_trie import PathTrie, collapse_nested
+from event_coalescer import FILE_CREATED, FILE_MODIFIED
+from instrumentation import REGISTRY
+
+# Methods of the worker's FileMonitor that the parent may call over the pipe.
+_REMOTE_METHODS = ('add_root', 'remove_root', 'snapshot', 'watch_mode', 'stats')
+
+def shard_index_path(index_path: Optional[str], shard: int) -> Optional[str]:
+    """Each shard keeps its own index file so processes never contend for one database."""
+    if not index_path:
+        return None
+    base, ext = os.path.splitext(index_path)
+    return f"{base}-shard{shard}{ext}"
+
+def _shard_main(conn: Connection, shard: int, roots: List[str], index_path: Optional[str],
+                batch_size: int, log_level: int, watch_budget_fraction: float):
+    """Worker process: watch, filter, read and hash ``roots``, shipping events in batches."""
+    logging.basicConfig(level=log_level, format=f'%(asctime)s - shard{shard} - %(levelname)s - %(message)s',
+                        force=True)
+    send_lock = threading.Lock()
+    outbox: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def sender():
+        # One pickled list per burst instead of one pipe write per event.
+        while True:
+            change = outbox.get()
+            if change is None:
+                return
+            batch = [change]
+            while len(batch) < batch_size:
+                try:
+                    change = outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if change is None:
+                    send(('events', batch))
+                    return
+                batch.append(change)
+            send(('events', batch))
+
+    def start():
+        try:
+            monitor.start(roots, outbox.put, watch_common_dirs=False)
+        except Exception as e:
+            logging.error(f"Shard {shard} could not start: {e}")
+            os._exit(1)  # The parent sees the exit and restarts us with backoff.
+        finally:
+            started.set()
+        send(('ready',))
+
+    def call(request_id: int, method: str, args: tuple):
+        started.wait()
+        try:
+            result = getattr(monitor, method)(*args)
+            send(('reply', request_id, True, result))
+        except Exception as e:
+            send(('reply', request_id, False, str(e)))
+
+    monitor = FileMonitor(index_path=index_path, watch_budget_fraction=watch_budget_fraction)
+    started = threading.Event()
+    sender_thread = threading.Thread(target=sender, name='shard-sender', daemon=True)
+    sender_thread.start()
+    # Scheduling watches on a large tree can outlast the health timeout, so pings are answered meanwhile.
+    threading.Thread(target=start, name='shard-start', daemon=True).start()
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == 'ping':
+                send(('pong', message[1]))
+            elif message[0] == 'call' and message[2] in _REMOTE_METHODS:
+                # Off the receive loop so a slow root walk never delays a health check.
+                threading.Thread(target=call, args=message[1:], daemon=True).start()
+            elif message[0] == 'stop':
+                break
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass  # The parent went away, or Ctrl+C reached the whole process group.
+    finally:
+        started.wait()
+        monitor.stop()
+        outbox.put(None)
+        sender_thread.join(timeout=5)
+        conn.close()
+
+class _Shard:
+    __slots__ = ('index', 'roots', 'process', 'conn', 'send_lock', 'pending', 'last_pong',
+                 'started_at', 'restarts', 'failures', 'next_start', 'events', 'reader')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.roots: Set[str] = set()
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, list] = {}
+        self.last_pong = 0.0
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.next_start = 0.0
+        self.events = 0
+        self.reader: Optional[threading.Thread] = None
+
+class ShardedFileMonitor:
+    """Runs ``FileMonitor`` in ``shards`` worker processes, splitting the watch roots between them.
+
+    Outermost roots are assigned by crc32 of the path so a root lands on the
+    same shard (and index file) across restarts; nested roots follow their
+    enclosing root. Workers are pinged every ``health_interval`` seconds and
+    restarted with exponential backoff when they die or stop answering; a
+    worker answers from the moment it starts, while its watches are still
+    being set up. A restarted worker rescans its roots against its index and
+    reports what it missed as ``offline_changes``.
+    """
+
+    def __init__(self, shards: int, index_path: Optional[str] = None, health_interval: float = 2.0,
+                 health_timeout: float = 10.0, call_timeout: float = 30.0, batch_size: int = 256,
+                 watch_budget_fraction: float = 0.5):
+        self.shards = [_Shard(index) for index in range(max(1, shards))]
+        # inotify watches are a per-user limit, so the shards split one budget between them.
+        self.shard_watch_budget = watch_budget_fraction / len(self.shards)
+        self.index_path = index_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.call_timeout = call_timeout
+        self.batch_size = batch_size
+        self.callback: Optional[Callable[[Dict[str, Any]], None]] = None
+        self.content_predicate: Optional[Callable[[str, str], bool]] = None
+        self.watched_paths: Set[str] = set()
+        self.is_running = False
+        self._context = multiprocessing.get_context('spawn')
+        self._request_ids = itertools.count()
+        self._roots_lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        # Stage metrics are recorded inside the workers; the parent exports what it sees of each shard.
+        REGISTRY.gauge('ender_shard_events', 'Changes delivered by each shard',
+                       lambda: {(str(shard.index),): shard.events for shard in self.shards}, ['shard'])
+        REGISTRY.gauge('ender_shard_restarts', 'Worker restarts of each shard',
+                       lambda: {(str(shard.index),): shard.restarts for shard in self.shards}, ['shard'])
+
+    def start(self, paths: List[str], callback: Callable[[Dict[str, Any]], None],
+              content_predicate: Optional[Callable[[str, str], bool]] = None):
+        """Start the worker processes and hand each its share of the roots."""
+        if self.is_running:
+            self.stop()
+        self.callback = callback
+        self.content_predicate = content_predicate
+        all_paths = sorted({os.path.normpath(p) for p in paths + get_common_dev_directories()})
+        existing = [path for path in all_paths if os.path.exists(path)]
+        outer = collapse_nested(existing)
+        trie = PathTrie(outer)
+        for path in existing:
+            self.watched_paths.add(path)
+            self._shard_for(trie.shortest_prefix(path) or path).roots.add(path)
+
+        self._stopping.clear()
+        for shard in self.shards:
+            self._spawn(shard)
+        self.is_running = True
+        self._supervisor = threading.Thread(target=self._supervise, name='shard-supervisor', daemon=True)
+        self._supervisor.start()
+        logging.info(f"Sharded file monitor started: {len(self.watched_paths)} paths over {len(self.shards)} shards")
+
+    def _shard_for(self, root: str) -> _Shard:
+        return self.shards[zlib.crc32(root.encode('utf-8', 'surrogatepass')) % len(self.shards)]
+
+    def _owner(self, path: str) -> _Shard:
+        """The shard whose roots cover ``path``, else the one it hashes to."""
+        for shard in self.shards:
+            if PathTrie(shard.roots).shortest_prefix(path) is not None:
+                return shard
+        return self._shard_for(path)
+
+    def _spawn(self, shard: _Shard):
+        parent_conn, child_conn = self._context.Pipe(duplex=True)
+        process = self._context.Process(
+            target=_shard_main, name=f'file-monitor-shard{shard.index}', daemon=True,
+            args=(child_conn, shard.index, sorted(shard.roots), shard_index_path(self.index_path, shard.index),
+                  self.batch_size, logging.getLogger().getEffectiveLevel(), self.shard_watch_budget))
+        process.start()
+        child_conn.close()
+        shard.process = process
+        shard.conn = parent_conn
+        shard.started_at = shard.last_pong = time.monotonic()
+        shard.reader = threading.Thread(target=self._read, args=(shard, parent_conn),
+                                        name=f'shard{shard.index}-reader', daemon=True)
+        shard.reader.start()
+
+    def _read(self, shard: _Shard, conn: Connection):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == 'events':
+                shard.events += len(message[1])
+                for change in message[1]:
+                    self._deliver(change)
+            elif kind == 'pong' or kind == 'ready':
+                shard.last_pong = time.monotonic()
+                if kind == 'ready':
+                    shard.failures = 0
+            elif kind == 'reply':
+                waiter = shard.pending.pop(message[1], None)
+                if waiter is not None:
+                    waiter[1:] = [message[2], message[3]]
+                    waiter[0].set()
+        # Fail any calls still waiting on this process.
+        for waiter in list(shard.pending.values()):
+            waiter[0].set()
+        shard.pending.clear()
+
+    def _deliver(self, change: Dict[str, Any]):
+        # The worker cannot ask the server's subscriptions before reading, so unwanted
+        # content is dropped here before it is encoded for any client.
+        if self.content_predicate is not None and change.get('type') in (FILE_CREATED, FILE_MODIFIED, 'file_chunk'):
+            root = change.get('root')
+            path = os.path.join(root, change['path']) if root else change['path']
+            if not self.content_predicate(path, change.get('language')):
+                if change['type'] == 'file_chunk':
+                    return
+                change = {key: value for key, value in change.items()
+                          if key not in ('content', 'hash', 'chunks', 'truncated', 'binary', 'size')}
+                change['metadata_only'] = True
+        try:
+            self.callback(change)
+        except Exception as e:
+            logging.error(f"Error delivering change from shard: {e}")
+
+    def _send(self, shard: _Shard, message: tuple) -> bool:
+        try:
+            with shard.send_lock:
+                shard.conn.send(message)
+            return True
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    def _call(self, shard: _Shard, method: str, *args) -> Any:
+        """Run a FileMonitor method in a worker; returns None if it fails or times out."""
+        request_id = next(self._request_ids)
+        waiter = [threading.Event(), False, None]
+        shard.pending[request_id] = waiter
+        if not self._send(shard, ('call', request_id, method, args)) or not waiter[0].wait(self.call_timeout):
+            shard.pending.pop(request_id, None)
+            logging.warning(f"Shard {shard.index} did not answer {method}")
+            return None
+        ok, result = waiter[1], waiter[2]
+        if not ok:
+            logging.error(f"Shard {shard.index} failed {method}: {result}")
+            return None
+        return result
+
+    def _supervise(self):
+        while not self._stopping.wait(self.health_interval):
+            now = time.monotonic()
+            for shard in self.shards:
+                alive = shard.process is not None and shard.process.is_alive()
+                if alive and now - shard.last_pong <= self.health_timeout:
+                    self._send(shard, ('ping', now))
+                    continue
+                if now < shard.next_start:
+                    continue
+                reason = 'stopped answering' if alive else f'exited with code {shard.process.exitcode}'
+                logging.warning(f"Shard {shard.index} {reason}, restarting")
+                self._terminate(shard)
+                shard.restarts += 1
+                shard.failures += 1
+                # Back off while a shard keeps crashing right after start.
+                shard.next_start = now + min(60.0, self.health_interval * 2 ** shard.failures)
+                with self._roots_lock:
+                    self._spawn(shard)
+
+    def _terminate(self, shard: _Shard):
+        if shard.process is not None and shard.process.is_alive():
+            shard.process.terminate()
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.kill()
+                shard.process.join()
+        if shard.conn is not None:
+            shard.conn.close()
+        shard.conn = None
+
+    def stop(self):
+        """Stop every worker, letting each flush its pending events and index."""
+        if not self.is_running:
+            return
+        self._stopping.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+        for shard in self.shards:
+            self._send(shard, ('stop',))
+        for shard in self.shards:
+            if shard.process is not None:
+                shard.process.join(timeout=10)
+            if shard.reader is not None:
+                shard.reader.join(timeout=5)
+            self._terminate(shard)
+            shard.roots.clear()
+        self.watched_paths.clear()
+        self.is_running = False
+        logging.info("Sharded file monitor stopped.")
+
+    def add_root(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        if not (self.is_running and os.path.isdir(path)):
+            return False
+        with self._roots_lock:
+            if path in self.watched_paths:
+                return True
+            shard = self._owner(path)
+            # Roots nested under the new one move to its shard so no subtree is watched twice.
+            for other in self.shards:
+                if other is shard:
+                    continue
+                for root in [root for root in other.roots if root.startswith(path + os.sep)]:
+                    self._call(other, 'remove_root', root)
+                    other.roots.discard(root)
+                    self._call(shard, 'add_root', root)
+                    shard.roots.add(root)
+            if not self._call(shard, 'add_root', path):
+                return False
+            shard.roots.add(path)
+            self.watched_paths.add(path)
+        return True
+
+    def remove_root(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        with self._roots_lock:
+            if path not in self.watched_paths:
+                return False
+            shard = self._owner(path)
+            if not self._call(shard, 'remove_root', path):
+                return False
+            shard.roots.discard(path)
+            self.watched_paths.discard(path)
+        return True
+
+    def add_path(self, path: str):
+        self.add_root(path)
+
+    def remove_path(self, path: str):
+        self.remove_root(path)
+
+    def watch_mode(self, path: str) -> Optional[str]:
+        path = os.path.normpath(path)
+        if path not in self.watched_paths:
+            return None
+        return self._call(self._owner(path), 'watch_mode', path)
+
+    def snapshot(self, root: Optional[str] = None) -> Dict[str, List[List[Any]]]:
+        shards = [self._owner(os.path.normpath(root))] if root else self.shards
+        roots: Dict[str, List[List[Any]]] = {}
+        for shard in shards:
+            roots.update(self._call(shard, 'snapshot', root) or {})
+        return roots
+
+    def stats(self) -> Dict[str, Any]:
+        """Merged per-root watch modes plus per-shard health."""
+        now = time.monotonic()
+        stats: Dict[str, Any] = {'watched_paths': len(self.watched_paths), 'is_running': self.is_running,
+                                 'inotify_limit': None, 'watch_modes': {}, 'shards': []}
+        for shard in self.shards:
+            shard_stats = self._call(shard, 'stats') if self.is_running else None
+            if shard_stats:
+                stats['inotify_limit'] = shard_stats.get('inotify_limit')
+                stats['watch_modes'].update(shard_stats.get('watch_modes', {}))
+            stats['shards'].append({
+                'shard': shard.index,
+                'pid': shard.process.pid if shard.process else None,
+                'alive': bool(shard.process and shard.process.is_alive()),
+                'roots': len(shard.roots),
+                'events': shard.events,
+                'restarts': shard.restarts,
+                'last_pong_age': round(now - shard.last_pong, 2),
+                'monitor': shard_stats
+            })
+        return stats
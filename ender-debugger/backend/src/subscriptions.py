@@ -0,0 +1,148 @@
+import os
+import re
+import fnmatch
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+from path_trie import path_components
+
+class Subscription:
+    """A client's interest in part of the watched trees."""
+    __slots__ = ('client', 'id', 'root', 'globs', 'languages', 'metadata_only')
+
+    def __init__(self, client: Hashable, subscription_id: str, root: Optional[str] = None,
+                 globs: Iterable[str] = (), languages: Iterable[str] = (), metadata_only: bool = False):
+        self.client = client
+        self.id = subscription_id
+        self.root = os.path.normpath(root) if root else None
+        self.globs = [re.compile(fnmatch.translate(glob)) for glob in globs]
+        self.languages = frozenset(language.lower() for language in languages)
+        self.metadata_only = metadata_only
+
+    def matches_glob(self, path: str) -> bool:
+        if not self.globs:
+            return True
+        relative = path[len(self.root):].lstrip(os.sep) if self.root else path
+        if os.sep != '/':
+            relative = relative.replace(os.sep, '/')
+        return any(glob.match(relative) for glob in self.globs)
+
+class _Node:
+    __slots__ = ('children', 'any_language', 'by_language')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.any_language: List[Subscription] = []
+        self.by_language: Dict[str, List[Subscription]] = {}
+
+class SubscriptionIndex:
+    """Maps a change to the clients that want it.
+
+    Subscriptions hang off a path-component trie at their root and are
+    bucketed by language, so matching an event walks O(depth) nodes and only
+    looks at subscriptions whose root and language already fit; glob
+    filters are evaluated on those candidates alone. Clients that never
+    subscribe keep receiving every change, as before subscriptions existed.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._by_client: Dict[Hashable, Dict[str, Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, subscription: Subscription):
+        with self._lock:
+            self._remove_locked(subscription.client, subscription.id)
+            node = self._root
+            for part in path_components(subscription.root) if subscription.root else ():
+                node = node.children.setdefault(part, _Node())
+            if subscription.languages:
+                for language in subscription.languages:
+                    node.by_language.setdefault(language, []).append(subscription)
+            else:
+                node.any_language.append(subscription)
+            self._by_client.setdefault(subscription.client, {})[subscription.id] = subscription
+
+    def remove(self, client: Hashable, subscription_id: str) -> bool:
+        with self._lock:
+            return self._remove_locked(client, subscription_id)
+
+    def remove_client(self, client: Hashable):
+        with self._lock:
+            for subscription_id in list(self._by_client.get(client, {})):
+                self._remove_locked(client, subscription_id)
+            self._by_client.pop(client, None)
+
+    def has_any(self) -> bool:
+        return bool(self._by_client)
+
+    def has_subscriptions(self, client: Hashable) -> bool:
+        return bool(self._by_client.get(client))
+
+    def subscriptions(self, client: Hashable) -> List[Subscription]:
+        return list(self._by_client.get(client, {}).values())
+
+    def _remove_locked(self, client: Hashable, subscription_id: str) -> bool:
+        subscription = self._by_client.get(client, {}).pop(subscription_id, None)
+        if subscription is None:
+            return False
+        node = self._root
+        for part in path_components(subscription.root) if subscription.root else ():
+            node = node.children[part]
+        if subscription.languages:
+            for language in subscription.languages:
+                bucket = node.by_language[language]
+                bucket.remove(subscription)
+                if not bucket:
+                    del node.by_language[language]
+        else:
+            node.any_language.remove(subscription)
+        return True
+
+    def match(self, path: str, language: Optional[str]) -> Dict[Hashable, bool]:
+        """Subscribed clients interested in ``path``, mapped to whether they want its content."""
+        language = language.lower() if language else None
+        interested: Dict[Hashable, bool] = {}
+        with self._lock:
+            node: Optional[_Node] = self._root
+            parts = path_components(path)
+            depth = 0
+            while node is not None:
+                self._collect(node.any_language, path, interested)
+                if language is not None and node.by_language:
+                    self._collect(node.by_language.get(language, ()), path, interested)
+                if depth == len(parts):
+                    break
+                node = node.children.get(parts[depth])
+                depth += 1
+        return interested
+
+    @staticmethod
+    def _collect(candidates: Iterable[Subscription], path: str, interested: Dict[Hashable, bool]):
+        for subscription in candidates:
+            if subscription.matches_glob(path):
+                interested[subscription.client] = interested.get(subscription.client, False) or not subscription.metadata_only
+
+    def wants_content(self, path: str, language: Optional[str], unsubscribed_clients: int) -> bool:
+        """Whether any client needs the content of ``path``, so it is only read when someone does."""
+        if unsubscribed_clients:
+            return True
+        return any(self.match(path, language).values())
+
+def subscription_from_message(client: Hashable, message: Dict[str, Any]) -> Subscription:
+    """Build a subscription from a ``subscribe`` message.
+
+    Raises TypeError unless ``globs`` and ``languages`` are lists of
+    strings; a bare string would otherwise become one glob per character.
+    """
+    for field in ('globs', 'languages'):
+        value = message.get(field)
+        if value is not None and (not isinstance(value, list) or not all(isinstance(item, str) for item in value)):
+            raise TypeError(f"{field} must be a list of strings")
+    return Subscription(
+        client,
+        str(message.get('id', 'default')),
+        root=message.get('root'),
+        globs=message.get('globs') or (),
+        languages=message.get('languages') or (),
+        metadata_only=bool(message.get('metadata_only', False))
+    )
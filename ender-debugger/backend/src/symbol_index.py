@@ -0,0 +1,529 @@
+import os
+import ast
+import json
+import time
+import logging
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
+from content_reader import ContentReader
+
+if TYPE_CHECKING:
+    import sqlite3
+
+DEFAULT_SYMBOL_INDEX_PATH = str(Path.home() / ".ender-debugger" / "symbols.sqlite3")
+
+# Languages outlined from Pygments tokens; everything else (markup, data, prose) has no symbols worth indexing.
+TOKEN_LANGUAGES = {'java', 'javascript', 'typescript', 'cpp', 'c', 'csharp', 'go', 'ruby', 'php', 'swift',
+                   'kotlin', 'rust', 'scala', 'shell', 'powershell', 'sql'}
+
+# Keywords that introduce a definition, mapped to the kind of symbol they define.
+DEFINITION_KEYWORDS = {
+    'class': 'class', 'interface': 'interface', 'struct': 'struct', 'enum': 'enum', 'trait': 'trait',
+    'object': 'class', 'module': 'module', 'namespace': 'module', 'type': 'type', 'typedef': 'type',
+    'function': 'function', 'def': 'function', 'fun': 'function', 'fn': 'function', 'func': 'function',
+    'sub': 'function', 'procedure': 'function', 'impl': 'impl',
+}
+# Suffixes of the indexed languages, for changes reported without one (offline rescans).
+EXTENSION_LANGUAGES = {
+    '.py': 'python', '.java': 'java', '.js': 'javascript', '.jsx': 'javascript', '.ts': 'typescript',
+    '.tsx': 'typescript', '.cpp': 'cpp', '.c': 'c', '.h': 'cpp', '.hpp': 'cpp', '.cs': 'csharp', '.go': 'go',
+    '.rb': 'ruby', '.php': 'php', '.swift': 'swift', '.kt': 'kotlin', '.rs': 'rust', '.scala': 'scala',
+    '.sh': 'shell', '.ps1': 'powershell', '.sql': 'sql',
+}
+CONTAINER_KINDS = {'class', 'interface', 'struct', 'enum', 'trait', 'module', 'impl'}
+
+# A definition: (name, kind, line, container); container is the dotted enclosing scope or ''.
+Definition = Tuple[str, str, int, str]
+
+# Lines kept per referenced name and file; enough to jump to, bounded for minified files.
+MAX_REFERENCE_LINES = 32
+
+class FileSymbols:
+    __slots__ = ('root', 'language', 'hash', 'definitions', 'imports', 'references')
+
+    def __init__(self, root: Optional[str], language: str, hash: Optional[str], definitions: List[Definition],
+                 imports: List[str], references: Dict[str, List[int]]):
+        self.root = root
+        self.language = language
+        self.hash = hash
+        self.definitions = definitions
+        self.imports = imports
+        self.references = references
+
+    def to_json(self) -> str:
+        return json.dumps({'d': self.definitions, 'i': self.imports, 'r': self.references}, separators=(',', ':'))
+
+    @classmethod
+    def from_row(cls, root: Optional[str], language: str, hash: Optional[str], data: str) -> 'FileSymbols':
+        decoded = json.loads(data)
+        return cls(root, language, hash, [tuple(entry) for entry in decoded['d']], decoded['i'], decoded['r'])
+
+def _add_reference(references: Dict[str, List[int]], name: str, line: int):
+    lines = references.setdefault(name, [])
+    if len(lines) < MAX_REFERENCE_LINES and (not lines or lines[-1] != line):
+        lines.append(line)
+
+class _PythonVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.definitions: List[Definition] = []
+        self.imports: List[str] = []
+        self.references: Dict[str, List[int]] = {}
+        # (name, kind) of each enclosing definition.
+        self.scope: List[Tuple[str, str]] = []
+
+    def _define(self, node, kind: str):
+        self.definitions.append((node.name, kind, node.lineno, '.'.join(name for name, _ in self.scope)))
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.scope.append((node.name, kind))
+        for child in node.body:
+            self.visit(child)
+        self.scope.pop()
+        # Defaults, annotations and bases are references from the enclosing scope.
+        for field in ('args', 'returns', 'bases', 'keywords'):
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    self.visit(item)
+            elif value is not None:
+                self.visit(value)
+
+    def visit_FunctionDef(self, node):
+        self._define(node, 'method' if self.scope and self.scope[-1][1] == 'class' else 'function')
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._define(node, 'class')
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append(alias.name)
+
+    def visit_ImportFrom(self, node):
+        module = '.' * node.level + (node.module or '')
+        for alias in node.names:
+            self.imports.append(f'{module}.{alias.name}' if module else alias.name)
+
+    def visit_Assign(self, node):
+        if not self.scope:
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    self.definitions.append((target.id, 'variable', node.lineno, ''))
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            _add_reference(self.references, node.id, node.lineno)
+
+    def visit_Attribute(self, node):
+        if isinstance(node.ctx, ast.Load):
+            _add_reference(self.references, node.attr, node.lineno)
+        self.visit(node.value)
+
+def parse_python(text: str) -> Optional[Tuple[List[Definition], List[str], Dict[str, List[int]]]]:
+    """Definitions, imports and references of Python source; None if it does not parse."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    visitor = _PythonVisitor()
+    visitor.visit(tree)
+    return visitor.definitions, visitor.imports, visitor.references
+
+@lru_cache(maxsize=None)
+def _lexer(language: str):
+    from pygments.lexers import get_lexer_by_name  # Deferred like the language fallback.
+    from pygments.util import ClassNotFound
+    try:
+        return get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return None
+
+def parse_tokens(text: str, language: str) -> Tuple[List[Definition], List[str], Dict[str, List[int]]]:
+    """A best-effort outline from Pygments tokens.
+
+    Names the lexer marks as functions, and the first name after
+    a definition keyword (``class``, ``fn``, ``func``...), are definitions.
+    Braces track nesting, so members of a class-like block get it as their
+    container. Namespaces after import-like keywords and C includes are
+    imports; every other name is a reference.
+    """
+    from pygments.token import Comment, Keyword, Name, Punctuation, Operator, Text
+    lexer = _lexer(language)
+    definitions: List[Definition] = []
+    imports: List[str] = []
+    references: Dict[str, List[int]] = {}
+    if lexer is None:
+        return definitions, imports, references
+    line = 1
+    pending_kind: Optional[str] = None
+    importing = False
+    depth = 0
+    # (depth the block opened at, name) for each enclosing class-like block.
+    containers: List[Tuple[int, str]] = []
+    open_container: Optional[str] = None
+    for token, value in lexer.get_tokens(text):
+        if token in Text or token in Comment.Single or token in Comment.Multiline:
+            if '\n' in value:
+                line += value.count('\n')
+                importing = False
+            continue
+        if token in Comment.PreprocFile:
+            imports.append(value.strip('<>"'))
+        elif token in Keyword:
+            word = value.strip()
+            if word in DEFINITION_KEYWORDS:
+                pending_kind = DEFINITION_KEYWORDS[word]
+            importing = word in ('import', 'using', 'use', 'require', 'include')
+        elif token in Name:
+            container = '.'.join(name for _, name in containers)
+            if importing:
+                imports.append(value)
+            elif pending_kind in CONTAINER_KINDS:
+                if pending_kind != 'impl':  # An impl block only scopes methods of a type defined elsewhere.
+                    definitions.append((value, pending_kind, line, container))
+                open_container = value
+                pending_kind = None
+            elif token in Name.Function or pending_kind is not None:
+                definitions.append((value, pending_kind or 'function', line, container))
+                pending_kind = None
+            else:
+                _add_reference(references, value, line)
+        elif token in Punctuation or token in Operator:
+            for char in value:
+                if char == '{':
+                    depth += 1
+                    if open_container is not None:
+                        containers.append((depth, open_container))
+                        open_container = None
+                elif char == '}':
+                    if containers and containers[-1][0] == depth:
+                        containers.pop()
+                    depth = max(0, depth - 1)
+                elif char == ';':
+                    open_container = None
+                    importing = False
+                if char in '(={;':
+                    pending_kind = None  # An anonymous function or a keyword used as a value.
+        line += value.count('\n')
+    return definitions, imports, references
+
+def parse_symbols(text: str, language: str) -> Optional[Tuple[List[Definition], List[str], Dict[str, List[int]]]]:
+    """Parse one file's symbols; None for languages that are not indexed."""
+    if language == 'python':
+        parsed = parse_python(text)
+        # Mid-edit saves often do not parse; a token outline keeps the index close to current.
+        return parsed if parsed is not None else parse_tokens(text, 'python')
+    if language in TOKEN_LANGUAGES:
+        return parse_tokens(text, language)
+    return None
+
+def _definition_key(definition: Definition) -> Tuple[str, str, str]:
+    name, kind, _, container = definition
+    return name, kind, container
+
+def diff_definitions(old: List[Definition], new: List[Definition]) -> Dict[str, List[Any]]:
+    """Added, removed and moved definitions; identity is (name, kind, container), not the line."""
+    old_lines = {_definition_key(entry): entry[2] for entry in old}
+    new_lines = {_definition_key(entry): entry[2] for entry in new}
+    added = [list(entry) for entry in new if _definition_key(entry) not in old_lines]
+    removed = [list(key) for key in old_lines if key not in new_lines]
+    moved = [[name, kind, line, container] for (name, kind, container), line in new_lines.items()
+             if (name, kind, container) in old_lines and old_lines[(name, kind, container)] != line]
+    return {'added': added, 'removed': removed, 'moved': moved}
+
+class SymbolIndex:
+    """Definitions, imports and references of every indexed file, with name lookups.
+
+    Files are keyed by absolute path. Inverted maps from a name (and from a
+    dotted ``Container.name``) to the files defining or referencing it make
+    a "where is X defined/used" query a couple of dict lookups. The index is
+    kept in memory and written to SQLite in batches, so a restart starts
+    warm and files whose hash has not changed are never parsed again.
+    """
+
+    def __init__(self, index_path: Optional[str] = DEFAULT_SYMBOL_INDEX_PATH, flush_threshold: int = 200):
+        self.index_path = index_path
+        self.flush_threshold = flush_threshold
+        self.files: Dict[str, FileSymbols] = {}
+        self.defined_in: Dict[str, Set[str]] = {}
+        self.referenced_in: Dict[str, Set[str]] = {}
+        self._dirty: Set[str] = set()
+        self._removed: Set[str] = set()
+        self._lock = threading.RLock()
+        self._db: Optional['sqlite3.Connection'] = None
+
+    def open(self):
+        with self._lock:
+            if self._db is not None or not self.index_path:
+                return
+            import sqlite3  # Deferred like the file index.
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS symbols (
+                path TEXT PRIMARY KEY, root TEXT, language TEXT, hash TEXT, data TEXT NOT NULL)''')
+            self._db.commit()
+            for path, root, language, digest, data in self._db.execute(
+                    'SELECT path, root, language, hash, data FROM symbols'):
+                try:
+                    self._put_locked(path, FileSymbols.from_row(root, language, digest, data), dirty=False)
+                except (ValueError, KeyError, TypeError):
+                    continue
+            logging.info(f"Loaded symbol index with {len(self.files)} files from {self.index_path}")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def flush(self):
+        with self._lock:
+            if self._db is None or (not self._dirty and not self._removed):
+                return
+            rows = [(path, symbols.root, symbols.language, symbols.hash, symbols.to_json())
+                    for path, symbols in ((path, self.files.get(path)) for path in self._dirty) if symbols]
+            removed = [(path,) for path in self._removed]
+            self._dirty.clear()
+            self._removed.clear()
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?, ?)', rows)
+                self._db.executemany('DELETE FROM symbols WHERE path = ?', removed)
+
+    @staticmethod
+    def _names(symbols: FileSymbols) -> Set[str]:
+        names = set()
+        for name, _, _, container in symbols.definitions:
+            names.add(name)
+            if container:
+                names.add(f'{container}.{name}')
+        return names
+
+    def _put_locked(self, path: str, symbols: FileSymbols, dirty: bool = True):
+        self._unlink_locked(path)
+        self.files[path] = symbols
+        for name in self._names(symbols):
+            self.defined_in.setdefault(name, set()).add(path)
+        for name in symbols.references:
+            self.referenced_in.setdefault(name, set()).add(path)
+        if dirty:
+            self._dirty.add(path)
+            self._removed.discard(path)
+
+    def _unlink_locked(self, path: str) -> Optional[FileSymbols]:
+        previous = self.files.pop(path, None)
+        if previous is None:
+            return None
+        for table, names in ((self.defined_in, self._names(previous)), (self.referenced_in, previous.references)):
+            for name in names:
+                paths = table.get(name)
+                if paths is not None:
+                    paths.discard(path)
+                    if not paths:
+                        del table[name]
+        return previous
+
+    def current_hash(self, path: str) -> Optional[str]:
+        symbols = self.files.get(path)
+        return symbols.hash if symbols is not None else None
+
+    def paths(self, root: str) -> List[str]:
+        with self._lock:
+            return [path for path, symbols in self.files.items() if symbols.root == root]
+
+    def update(self, path: str, root: Optional[str], language: str, text: str,
+               digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Re-index one file from its text; returns the symbols delta, or None if nothing changed."""
+        with self._lock:
+            previous = self.files.get(path)
+        if digest is not None and previous is not None and previous.hash == digest:
+            return None
+        parsed = parse_symbols(text, language)
+        if parsed is None:
+            return self.remove(path)
+        definitions, imports, references = parsed
+        symbols = FileSymbols(root, language, digest, definitions, imports, references)
+        with self._lock:
+            previous = self.files.get(path)
+            self._put_locked(path, symbols)
+            if len(self._dirty) + len(self._removed) >= self.flush_threshold:
+                self.flush()
+        delta = diff_definitions(previous.definitions if previous else [], definitions)
+        old_imports = previous.imports if previous else []
+        if not any(delta.values()) and imports == old_imports:
+            return None
+        if imports != old_imports:
+            delta['imports'] = imports
+        return delta
+
+    def remove(self, path: str) -> Optional[Dict[str, Any]]:
+        """Drop a deleted file; returns the delta removing its definitions, if it had any."""
+        with self._lock:
+            previous = self._unlink_locked(path)
+            if previous is None:
+                return None
+            self._dirty.discard(path)
+            self._removed.add(path)
+        if not previous.definitions and not previous.imports:
+            return None
+        return {'added': [], 'removed': [list(_definition_key(entry)) for entry in previous.definitions],
+                'moved': [], 'imports': []}
+
+    def _relative(self, path: str, symbols: FileSymbols) -> Tuple[Optional[str], str]:
+        root = symbols.root
+        return root, path[len(root):].lstrip(os.sep) if root and path.startswith(root) else path
+
+    def definitions(self, name: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Where ``name`` (or a dotted ``Container.name``) is defined."""
+        simple = name.rsplit('.', 1)[-1]
+        container = name.rsplit('.', 1)[0] if '.' in name else None
+        results = []
+        with self._lock:
+            for path in sorted(self.defined_in.get(name, ())):
+                symbols = self.files[path]
+                root, relative = self._relative(path, symbols)
+                for entry_name, kind, line, entry_container in symbols.definitions:
+                    if entry_name == simple and (container is None or entry_container.endswith(container)):
+                        results.append({'root': root, 'path': relative, 'line': line, 'kind': kind,
+                                        'container': entry_container, 'language': symbols.language})
+                if len(results) >= limit:
+                    break
+        return results[:limit]
+
+    def references(self, name: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Files that use ``name``, with the lines it appears on."""
+        simple = name.rsplit('.', 1)[-1]
+        results = []
+        with self._lock:
+            for path in sorted(self.referenced_in.get(simple, ())):
+                symbols = self.files[path]
+                root, relative = self._relative(path, symbols)
+                results.append({'root': root, 'path': relative, 'lines': symbols.references[simple],
+                                'language': symbols.language})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def outline(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            symbols = self.files.get(path)
+            if symbols is None:
+                return None
+            return {'language': symbols.language, 'definitions': [list(entry) for entry in symbols.definitions],
+                    'imports': list(symbols.imports)}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'files': len(self.files), 'defined_names': len(self.defined_in),
+                    'referenced_names': len(self.referenced_in)}
+
+class SymbolIndexer:
+    """Background thread that keeps a ``SymbolIndex`` current from change events.
+
+    Submissions are coalesced per path, latest wins, so a burst of saves to
+    one file is parsed once. Only the changed file is parsed. When a change
+    arrives without content (metadata-only or batched events), the file is
+    read here, off the event loop. Each non-empty delta is handed to
+    ``on_delta``. Pending writes go to disk whenever the queue has been idle
+    for ``flush_interval`` seconds.
+    """
+
+    def __init__(self, index: SymbolIndex, on_delta: Callable[[Dict[str, Any]], None], flush_interval: float = 2.0):
+        self.index = index
+        self.on_delta = on_delta
+        self.flush_interval = flush_interval
+        self.content_reader = ContentReader()
+        self.pending: Dict[str, Tuple[Optional[str], str, Optional[str], Optional[str], Optional[str], bool]] = {}
+        self.parsed = 0
+        self.parse_seconds = 0.0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='symbol-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.index.flush()
+
+    def submit(self, root: Optional[str], path: str, language: Optional[str], content: Optional[str] = None,
+               digest: Optional[str] = None, deleted: bool = False):
+        """Queue a change to ``path`` (relative to ``root``); cheap enough to call from the event loop."""
+        if language is None:
+            language = EXTENSION_LANGUAGES.get(os.path.splitext(path)[1].lower())
+        if not deleted and language != 'python' and language not in TOKEN_LANGUAGES:
+            return
+        key = os.path.join(root, path) if root else path
+        if digest is not None and not deleted and self.index.current_hash(key) == digest:
+            return
+        with self._condition:
+            self.pending[key] = (root, path, language, content, digest, deleted)
+            self._condition.notify()
+
+    def reconcile(self, root: str, rows: List[List[Any]], fields: List[str]):
+        """Queue every file of a scanned root whose hash differs from the index; drop vanished ones."""
+        path_field, language_field, hash_field = fields.index('path'), fields.index('language'), fields.index('hash')
+        seen = set()
+        for row in rows:
+            key = os.path.join(root, row[path_field])
+            seen.add(key)
+            if row[hash_field] is None and key in self.index.files:
+                continue  # Not hashed by the file index (too large); keep what was parsed before.
+            self.submit(root, row[path_field], row[language_field], digest=row[hash_field])
+        for key in self.index.paths(root):
+            if key not in seen:
+                self.submit(root, os.path.relpath(key, root), None, deleted=True)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self.pending and not self._stopped:
+                    self._condition.wait(self.flush_interval)
+                if self._stopped:
+                    return
+                idle = not self.pending
+                if not idle:
+                    key = next(iter(self.pending))
+                    root, path, language, content, digest, deleted = self.pending.pop(key)
+            if idle:
+                try:
+                    self.index.flush()
+                except Exception as e:
+                    logging.error(f"Error writing symbol index: {e}")
+                continue
+            try:
+                self._index(key, root, path, language, content, digest, deleted)
+            except Exception as e:
+                logging.error(f"Error indexing symbols of {key}: {e}")
+
+    def _index(self, key: str, root: Optional[str], path: str, language: Optional[str],
+               content: Optional[str], digest: Optional[str], deleted: bool):
+        if deleted:
+            delta = self.index.remove(key)
+        else:
+            if content is None:
+                result = self.content_reader.read(key)
+                if result.error is not None:
+                    return  # Gone or unreadable; its delete, if any, arrives separately.
+                if result.binary or result.streamed or result.truncated or result.text is None:
+                    return  # Too large or not text; leave whatever was indexed before.
+                content, digest = result.text, result.digest
+            started = time.perf_counter()
+            delta = self.index.update(key, root, language, content, digest)
+            self.parsed += 1
+            self.parse_seconds += time.perf_counter() - started
+        if delta is not None:
+            delta.update({'type': 'symbols_changed', 'root': root, 'path': path, 'language': language})
+            self.on_delta(delta)
@@ -0,0 +1,553 @@
+import os
+import sys
+import dis
+import json
+import time
+import runpy
+import struct
+import logging
+import argparse
+import threading
+import traceback
+from itertools import count
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# One fixed-size record per observation: sequence (low 32 bits), site index
+# (a watched store, or a function's enter/exit/return), invocation token,
+# value tag, aux (string length or type name index) and the value itself.
+RECORD = struct.Struct('<IIIBxHq')
+FLOAT_RECORD = struct.Struct('<IIIBxHd')
+CHUNK_HEADER = struct.Struct('<II')
+
+TAG_INT = 1
+TAG_FLOAT = 2
+TAG_BOOL = 3
+TAG_NONE = 4
+TAG_STR = 5
+TAG_OBJECT = 6
+TAG_NAMES = {TAG_INT: 'int', TAG_FLOAT: 'float', TAG_BOOL: 'bool', TAG_NONE: 'none', TAG_STR: 'str',
+             TAG_OBJECT: 'object'}
+
+# Pseudo-variables every traced function has: its return value, and the
+# nanoseconds since the recorder started at which it was entered and exited.
+RETURN_VALUE = '<return>'
+ENTER_TIME = '<enter>'
+EXIT_TIME = '<exit>'
+
+# Instructions that bind a watched local; the value is read just after they run.
+STORE_OPS = ('STORE_FAST', 'STORE_DEREF', 'STORE_FAST_STORE_FAST', 'STORE_FAST_LOAD_FAST', 'STORE_FAST_MAYBE_NULL')
+# Captured by reference. Anything else is replaced at the store by a
+# ``(type, size)`` tuple, sized only for builtin containers so no user
+# ``__len__`` runs on the traced thread; slot values are never real tuples.
+SCALARS = frozenset((int, float, str, bool, type(None)))
+SIZED_TYPES = frozenset((list, tuple, dict, set, frozenset, bytes, bytearray))
+ALL_VARIABLES = '*'
+MAX_STRING = 80
+MAX_STRINGS = 50_000
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+_UNBOUND = object()
+
+class WatchSpec:
+    """A function to trace, as ``[file.py:]qualname=var,var``; no variables (or ``*``) means every local."""
+    __slots__ = ('file', 'name', 'variables')
+
+    def __init__(self, name: str, variables: Iterable[str] = (), file: Optional[str] = None):
+        self.name = name
+        self.variables = tuple(variables) or (ALL_VARIABLES,)
+        self.file = file
+
+    @classmethod
+    def parse(cls, text: str) -> 'WatchSpec':
+        target, _, variables = text.partition('=')
+        file, _, name = target.rpartition(':')
+        return cls(name, [v.strip() for v in variables.split(',') if v.strip()], file or None)
+
+    def matches(self, code) -> bool:
+        if self.name not in (getattr(code, 'co_qualname', code.co_name), code.co_name):
+            return False
+        return self.file is None or code.co_filename.replace(os.sep, '/').endswith(self.file.replace(os.sep, '/'))
+
+    def __str__(self) -> str:
+        target = f'{self.file}:{self.name}' if self.file else self.name
+        return f"{target}={','.join(self.variables)}"
+
+class _Watched:
+    """A traced code object: its call sites, and its watched stores by line and by following offset."""
+    __slots__ = ('enter', 'exit', 'result', 'lines', 'offsets')
+
+    def __init__(self, enter: int, exit: int, result: int, lines: Dict[int, Tuple[Tuple[int, str], ...]],
+                 offsets: Dict[int, Tuple[Tuple[int, str], ...]]):
+        self.enter = enter
+        self.exit = exit
+        self.result = result
+        self.lines = lines
+        self.offsets = offsets
+
+def store_sites(code, variables: Tuple[str, ...], site_index) -> Tuple[Dict, Dict]:
+    """Map the stores of watched variables in ``code`` to ``(site, name)`` pairs.
+
+    Returns them by line (for line tracing) and by the offset of the
+    instruction after the store (for instruction events, which then see the
+    value just bound). When that instruction is also a jump target, arriving
+    by the jump records the current value again; it is still the variable's
+    state at that point.
+    """
+    watch_all = ALL_VARIABLES in variables
+    instructions = list(dis.get_instructions(code))
+    lines: Dict[int, List[Tuple[int, str]]] = {}
+    offsets: Dict[int, Tuple[Tuple[int, str], ...]] = {}
+    line = code.co_firstlineno
+    for position, instruction in enumerate(instructions):
+        positions = getattr(instruction, 'positions', None)
+        if positions is not None and positions.lineno is not None:
+            line = positions.lineno
+        elif isinstance(instruction.starts_line, int) and not isinstance(instruction.starts_line, bool):
+            line = instruction.starts_line
+        if instruction.opname not in STORE_OPS or position + 1 >= len(instructions):
+            continue
+        stored = instruction.argval if isinstance(instruction.argval, tuple) else (instruction.argval,)
+        if instruction.opname == 'STORE_FAST_LOAD_FAST':
+            stored = stored[:1]
+        stores = tuple((site_index(line, name), name) for name in stored if watch_all or name in variables)
+        if not stores:
+            continue
+        on_line = lines.setdefault(line, [])
+        on_line.extend(store for store in stores if store not in on_line)
+        following = instructions[position + 1].offset
+        offsets[following] = offsets.get(following, ()) + stores
+    return {line: tuple(stores) for line, stores in lines.items()}, offsets
+
+class TraceRing:
+    """Preallocated ring of ``(sequence, site, frame id, value)`` slots shared by every tracing thread.
+
+    Writers take a sequence number from an ``itertools.count`` (atomic under
+    the GIL) and store one tuple, so the hot path takes no lock and does no
+    packing; the streamer turns slots into binary records off the traced
+    threads. A reader stops at a slot that was claimed but not written yet,
+    and recognizes slots a writer lapped by their newer sequence.
+    """
+
+    def __init__(self, capacity: int = 65536):
+        capacity = 1 << max(capacity - 1, 1).bit_length()
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.slots: List[Optional[tuple]] = [None] * capacity
+        self.sequence = count()
+
+    def read_since(self, position: int) -> Tuple[int, List[tuple], int]:
+        """Consecutive slots from ``position`` on: (start, slots, lost)."""
+        slots, mask = self.slots, self.mask
+        found: List[tuple] = []
+        lost = 0
+        start = position
+        while len(found) < self.capacity:
+            slot = slots[position & mask]
+            if slot is None or slot[0] < position:
+                break  # Not written yet.
+            if slot[0] > position:
+                if found:
+                    break  # Lapped mid-read; the next read counts what was lost.
+                oldest = slot[0] - self.capacity + 1
+                lost += oldest - position
+                position = start = oldest
+                continue
+            found.append(slot)
+            position += 1
+        return start, found, lost
+
+class TraceRecorder:
+    """Records calls, returns and stores of watched variables in watched functions.
+
+    On Python 3.12+ it uses ``sys.monitoring``: unwatched functions disable
+    their start event after the first call, and in watched ones only the
+    instructions right after a watched store raise an event, so untraced
+    code runs at full speed. Older versions fall back to ``sys.settrace``
+    with line events limited to the watched functions.
+    """
+
+    def __init__(self, specs: Iterable[WatchSpec], capacity: int = 65536):
+        self.specs = list(specs)
+        self.ring = TraceRing(capacity)
+        # Append-only tables that records refer to by index; the streamer sends new entries.
+        self.codes: List[str] = []
+        self.names: List[str] = [RETURN_VALUE, ENTER_TIME, EXIT_TIME]
+        self.sites: List[Tuple[int, int, int]] = []
+        self._name_ids: Dict[str, int] = {name: index for index, name in enumerate(self.names)}
+        self._watched: Dict[Any, Optional[_Watched]] = {}
+        self._lock = threading.RLock()
+        self._tool: Optional[int] = None
+        self.started = 0
+        self.backend: Optional[str] = None
+        self.running = False
+
+    def start(self, backend: Optional[str] = None):
+        """Begin tracing; ``backend`` forces 'monitoring' or 'settrace'."""
+        if self.running:
+            return
+        backend = backend or ('monitoring' if hasattr(sys, 'monitoring') else 'settrace')
+        self.started = time.perf_counter_ns()
+        if backend == 'monitoring':
+            self._start_monitoring()
+        else:
+            trace_call = self._trace_callback()
+            threading.settrace(trace_call)
+            sys.settrace(trace_call)
+        self.backend = backend
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        if self.backend == 'monitoring':
+            monitoring = sys.monitoring
+            monitoring.set_events(self._tool, 0)
+            for code, watched in list(self._watched.items()):
+                if watched is not None:
+                    monitoring.set_local_events(self._tool, code, 0)
+            for event in (monitoring.events.PY_START, monitoring.events.PY_RETURN, monitoring.events.INSTRUCTION):
+                monitoring.register_callback(self._tool, event, None)
+            monitoring.free_tool_id(self._tool)
+            self._tool = None
+        else:
+            sys.settrace(None)
+            threading.settrace(None)
+        self.running = False
+
+    def elapsed_ns(self) -> int:
+        return time.perf_counter_ns() - self.started
+
+    def name_index(self, name: str) -> int:
+        index = self._name_ids.get(name)
+        if index is None:
+            with self._lock:
+                index = self._name_ids.get(name)
+                if index is None:
+                    index = self._name_ids[name] = len(self.names)
+                    self.names.append(name)
+        return index
+
+    def _site(self, code_index: int, line: int, name: str) -> int:
+        self.sites.append((code_index, line, self.name_index(name)))
+        return len(self.sites) - 1
+
+    def _lookup(self, code) -> Optional[_Watched]:
+        """The watch entry of ``code``, analysed on its first call; None when it is not watched."""
+        try:
+            return self._watched[code]
+        except KeyError:
+            pass
+        with self._lock:
+            if code in self._watched:
+                return self._watched[code]
+            watched = None
+            for spec in self.specs:
+                if not spec.matches(code):
+                    continue
+                index = len(self.codes)
+                self.codes.append(f"{code.co_filename}:{getattr(code, 'co_qualname', code.co_name)}:{code.co_firstlineno}")
+                first = code.co_firstlineno
+                enter, exit, result = (self._site(index, first, name) for name in (ENTER_TIME, EXIT_TIME, RETURN_VALUE))
+                lines, offsets = store_sites(code, spec.variables, lambda line, name: self._site(index, line, name))
+                watched = _Watched(enter, exit, result, lines, offsets)
+                break
+            self._watched[code] = watched
+            return watched
+
+    def _start_monitoring(self):
+        monitoring = sys.monitoring
+        for tool in (3, 4, monitoring.OPTIMIZER_ID, monitoring.PROFILER_ID, monitoring.DEBUGGER_ID):
+            try:
+                monitoring.use_tool_id(tool, 'ender-trace')
+                break
+            except ValueError:
+                continue
+        else:
+            raise RuntimeError("No free sys.monitoring tool id")
+        self._tool = tool
+        events = monitoring.events
+        on_start, on_return, on_instruction = self._monitoring_callbacks()
+        monitoring.register_callback(tool, events.PY_START, on_start)
+        monitoring.register_callback(tool, events.PY_RETURN, on_return)
+        monitoring.register_callback(tool, events.INSTRUCTION, on_instruction)
+        # Locations disabled by an earlier session would otherwise stay silent.
+        monitoring.restart_events()
+        monitoring.set_events(tool, events.PY_START)
+
+    def _monitoring_callbacks(self):
+        # Closures over locals: attribute lookups on self would dominate the per-store cost.
+        slots, mask, sequence = self.ring.slots, self.ring.mask, self.ring.sequence
+        watched_codes, lookup, clock, started = self._watched, self._lookup, time.perf_counter_ns, self.started
+        monitoring, getframe, tool = sys.monitoring, sys._getframe, self._tool
+        disable, local_events = monitoring.DISABLE, monitoring.events.INSTRUCTION | monitoring.events.PY_RETURN
+
+        def on_start(code, offset):
+            watched = lookup(code)
+            if watched is None:
+                return disable
+            if monitoring.get_local_events(tool, code) == 0:
+                monitoring.set_local_events(tool, code, local_events)
+            number = next(sequence)
+            slots[number & mask] = (number, watched.enter, id(getframe(1)), clock() - started)
+
+        def on_return(code, offset, value):
+            watched = watched_codes[code]
+            token = id(getframe(1))
+            kind = type(value)
+            if kind not in SCALARS:
+                value = (kind, len(value) if kind in SIZED_TYPES else -1)
+            number = next(sequence)
+            slots[number & mask] = (number, watched.result, token, value)
+            number = next(sequence)
+            slots[number & mask] = (number, watched.exit, token, clock() - started)
+
+        def on_instruction(code, offset):
+            stores = watched_codes[code].offsets.get(offset)
+            if stores is None:
+                return disable
+            frame = getframe(1)
+            values = frame.f_locals
+            token = id(frame)
+            for site, name in stores:
+                value = values.get(name, _UNBOUND)
+                if value is _UNBOUND:
+                    continue
+                kind = type(value)
+                if kind not in SCALARS:
+                    value = (kind, len(value) if kind in SIZED_TYPES else -1)
+                number = next(sequence)
+                slots[number & mask] = (number, site, token, value)
+
+        return on_start, on_return, on_instruction
+
+    def _trace_callback(self):
+        slots, mask, sequence = self.ring.slots, self.ring.mask, self.ring.sequence
+        lookup, clock, started = self._lookup, time.perf_counter_ns, self.started
+
+        def trace_call(frame, event, arg):
+            if event != 'call':
+                return None
+            watched = lookup(frame.f_code)
+            if watched is None:
+                return None
+            token = id(frame)
+            store_lines = watched.lines
+            number = next(sequence)
+            slots[number & mask] = (number, watched.enter, token, clock() - started)
+            previous = -1
+
+            def trace_line(frame, event, arg):
+                # A line event means the previous line has run, so its stores are visible now.
+                nonlocal previous
+                stores = store_lines.get(previous)
+                if stores is not None:
+                    values = frame.f_locals
+                    for site, name in stores:
+                        value = values.get(name, _UNBOUND)
+                        if value is _UNBOUND:
+                            continue
+                        kind = type(value)
+                        if kind not in SCALARS:
+                            value = (kind, len(value) if kind in SIZED_TYPES else -1)
+                        number = next(sequence)
+                        slots[number & mask] = (number, site, token, value)
+                if event == 'line':
+                    previous = frame.f_lineno
+                elif event == 'return':
+                    previous = -1
+                    kind = type(arg)
+                    value = arg if kind in SCALARS else (kind, len(arg) if kind in SIZED_TYPES else -1)
+                    number = next(sequence)
+                    slots[number & mask] = (number, watched.result, token, value)
+                    number = next(sequence)
+                    slots[number & mask] = (number, watched.exit, token, clock() - started)
+                return trace_line
+            return trace_line
+        return trace_call
+
+class TraceEncoder:
+    """Packs ring slots into binary records, interning strings into its own table.
+
+    Runs on one thread (the streamer's), so the string table needs no lock.
+    """
+
+    def __init__(self, recorder: TraceRecorder):
+        self.recorder = recorder
+        self.strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+
+    def encode(self, slots: List[tuple]) -> bytes:
+        size = RECORD.size
+        data = bytearray(size * len(slots))
+        pack, pack_float = RECORD.pack_into, FLOAT_RECORD.pack_into
+        for position, (sequence, site, frame, value) in enumerate(slots):
+            offset = position * size
+            sequence &= 0xFFFFFFFF
+            token = (frame >> 4) & 0xFFFFFFFF
+            kind = type(value)
+            if kind is int and INT_MIN <= value <= INT_MAX:
+                pack(data, offset, sequence, site, token, TAG_INT, 0, value)
+            elif kind is float:
+                pack_float(data, offset, sequence, site, token, TAG_FLOAT, 0, value)
+            elif kind is bool:
+                pack(data, offset, sequence, site, token, TAG_BOOL, 0, int(value))
+            elif value is None:
+                pack(data, offset, sequence, site, token, TAG_NONE, 0, 0)
+            elif kind is tuple:
+                pack(data, offset, sequence, site, token, TAG_OBJECT, self.recorder.name_index(value[0].__name__), value[1])
+            elif kind is str and self._string(value) is not None:
+                pack(data, offset, sequence, site, token, TAG_STR, min(len(value), 0xFFFF), self._string(value))
+            else:
+                # Integers beyond 64 bits, and strings once the table is full.
+                length = len(value) if kind is str else -1
+                pack(data, offset, sequence, site, token, TAG_OBJECT, self.recorder.name_index(kind.__name__), length)
+        return bytes(data)
+
+    def _string(self, value: str) -> Optional[int]:
+        text = value[:MAX_STRING]
+        index = self._string_ids.get(text)
+        if index is None and len(self.strings) < MAX_STRINGS:
+            index = self._string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+class TraceStreamer:
+    """Writes new records and table entries to a pipe as length-prefixed chunks.
+
+    Each chunk is a ``CHUNK_HEADER`` (JSON length, record bytes length), a
+    JSON header and the raw records. The header carries the ``first``
+    sequence, records ``lost`` to the ring wrapping, the recorder clock
+    (``time_ns``) and whatever was added to the ``codes``, ``names``,
+    ``sites`` and ``strings`` tables. Chunks are flushed every ``interval``
+    seconds from the streamer's own thread, so traced threads never block on
+    the pipe or pay for packing.
+    """
+
+    def __init__(self, recorder: TraceRecorder, fd: int, interval: float = 0.05):
+        self.recorder = recorder
+        self.encoder = TraceEncoder(recorder)
+        self.fd = fd
+        self.interval = interval
+        self.position = 0
+        self.sent = (0, 0, 0, 0)
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        # Started before the recorder, so the settrace fallback never traces this thread.
+        self.thread = threading.Thread(target=self._run, name='trace-streamer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error(f"Trace pipe closed: {e}")
+                return
+
+    def chunk(self) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """The header and records gathered since the previous chunk, or None when nothing is new."""
+        start, slots, lost = self.recorder.ring.read_since(self.position)
+        data = self.encoder.encode(slots)
+        # Tables after records: any index a record uses was added before the record was written.
+        recorder = self.recorder
+        tables = (recorder.codes, recorder.names, recorder.sites, self.encoder.strings)
+        header: Dict[str, Any] = {'first': start, 'lost': lost}
+        for key, table, sent in zip(('codes', 'names', 'sites', 'strings'), tables, self.sent):
+            if len(table) > sent:
+                header[key] = table[sent:]
+        if not data and not lost and len(header) == 2:
+            return None
+        if self.sent == (0, 0, 0, 0):
+            header['backend'] = recorder.backend
+        header['time_ns'] = recorder.elapsed_ns()
+        self.position = start + len(slots)
+        self.sent = tuple(len(table) for table in tables)
+        return header, data
+
+    def flush(self):
+        chunk = self.chunk()
+        if chunk is None:
+            return
+        header, data = chunk
+        encoded = json.dumps(header).encode('utf-8')
+        view = memoryview(CHUNK_HEADER.pack(len(encoded), len(data)) + encoded + data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+class TraceDecoder:
+    """Turns one trace's chunks into columnar ``trace`` messages for clients.
+
+    Tables arrive as additions, in order, so a client appends them to what
+    it already has; ``frame``, ``site``, ``tag``, ``aux`` and ``value`` are
+    columns with one entry per record, numbered from ``first``.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.lost = 0
+        self.backend: Optional[str] = None
+
+    def batch(self, header: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+        columns: Dict[str, List[Any]] = {key: [] for key in ('frame', 'site', 'tag', 'aux', 'value')}
+        for offset in range(0, len(data), RECORD.size):
+            _, site, frame, tag, aux, value = RECORD.unpack_from(data, offset)
+            if tag == TAG_FLOAT:
+                value = FLOAT_RECORD.unpack_from(data, offset)[-1]
+            columns['frame'].append(frame)
+            columns['site'].append(site)
+            columns['tag'].append(tag)
+            columns['aux'].append(aux)
+            columns['value'].append(value)
+        self.records += len(columns['site'])
+        self.lost += header.get('lost', 0)
+        self.backend = header.get('backend', self.backend)
+        message: Dict[str, Any] = {'type': 'trace', 'first': header.get('first', 0), 'lost': header.get('lost', 0),
+                                   'time_ns': header.get('time_ns')}
+        for key in ('codes', 'names', 'sites', 'strings'):
+            if header.get(key):
+                message[key] = header[key]
+        message.update(columns)
+        return message
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a Python script under the variable-state trace recorder')
+    parser.add_argument('--watch', action='append', required=True, metavar='[FILE:]QUALNAME[=VAR,VAR]',
+                        help='Function to trace and the locals to record (all locals if none are given)')
+    parser.add_argument('--pipe-fd', type=int, required=True, help='Inherited file descriptor to stream chunks to')
+    parser.add_argument('--capacity', type=int, default=65536, help='Slots in the ring buffer')
+    parser.add_argument('--flush-interval', type=float, default=0.05)
+    parser.add_argument('--backend', choices=('monitoring', 'settrace'), default=None)
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    recorder = TraceRecorder([WatchSpec.parse(spec) for spec in args.watch], args.capacity)
+    streamer = TraceStreamer(recorder, args.pipe_fd, args.flush_interval)
+    sys.argv = [args.script] + args.args
+    sys.path[0] = os.path.dirname(os.path.abspath(args.script))
+    streamer.start()
+    recorder.start(args.backend)
+    status = 0
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        recorder.stop()
+        streamer.stop()
+        os.close(args.pipe_fd)
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+import sys
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from watchdog.events import (DirCreatedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent,
+                             FileSystemEventHandler)
+
+MODE_NATIVE = 'native'                  # Recursive watch on a backend without per-directory limits.
+MODE_INOTIFY = 'inotify'                # One recursive inotify watch on the root.
+MODE_INOTIFY_PRUNED = 'inotify-pruned'  # Only directories outside ignored subtrees, at any depth.
+MODE_POLLING = 'polling'                # Adaptive stat polling over a cached directory tree.
+
+INOTIFY_LIMIT_PATH = '/proc/sys/fs/inotify/max_user_watches'
+
+def read_inotify_limit() -> Optional[int]:
+    """The per-user inotify watch limit, or None where inotify is not the backend."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        with open(INOTIFY_LIMIT_PATH) as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+class WatchEstimate:
+    """Directory counts for one root; ``exceeded`` means the walk stopped early."""
+    __slots__ = ('total', 'pruned', 'flat', 'recursive', 'exceeded')
+
+    def __init__(self):
+        self.total = 1   # Every directory: what one recursive inotify watch costs.
+        self.pruned = 1  # Every directory outside ignored subtrees, at any depth.
+        # How to watch exactly those: directories with an ignored subtree somewhere below
+        # (the root among them) get a flat watch, and each clean subtree a recursive one.
+        self.flat: List[str] = []
+        self.recursive: List[str] = []
+        self.exceeded = False
+
+def estimate_watches(root: str, is_ignored_dir: Callable[[str], bool], limit: int) -> WatchEstimate:
+    """Count the directories under ``root`` that each watch strategy would need.
+
+    Every directory is checked against ``is_ignored_dir``, so an ignored
+    directory deep in the tree (``packages/app/node_modules``) is pruned as
+    well as one under the root. The walk stops as soon as even the pruned
+    count passes ``limit``, and stops descending into ignored subtrees once
+    the full count has.
+    """
+    estimate = WatchEstimate()
+    children: Dict[str, List[str]] = {root: []}
+    parents: Dict[str, str] = {}
+    # Directories with an ignored directory somewhere below them.
+    dirty: Set[str] = set()
+    stack: List[Tuple[str, bool]] = [(root, False)]
+    while stack:
+        directory, in_ignored = stack.pop()
+        if in_ignored and estimate.total > limit:
+            continue  # Only the full recursive watch counts these, and it is already over.
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                    except OSError:
+                        continue
+                    ignored = in_ignored or is_ignored_dir(entry.path)
+                    estimate.total += 1
+                    if not ignored:
+                        estimate.pruned += 1
+                        if estimate.pruned > limit:
+                            estimate.exceeded = True
+                            return estimate
+                        children[directory].append(entry.path)
+                        children[entry.path] = []
+                        parents[entry.path] = directory
+                    elif not in_ignored:
+                        node: Optional[str] = directory
+                        while node is not None and node not in dirty:
+                            dirty.add(node)
+                            node = parents.get(node)
+                    stack.append((entry.path, ignored))
+        except OSError:
+            continue
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        if directory in dirty:
+            estimate.flat.append(directory)
+            pending.extend(children[directory])
+        else:
+            estimate.recursive.append(directory)
+    return estimate
+
+class _DirRecord:
+    __slots__ = ('mtime_ns', 'files', 'subdirs')
+
+    def __init__(self, mtime_ns: int):
+        self.mtime_ns = mtime_ns
+        self.files: Dict[str, Tuple[int, int]] = {}
+        self.subdirs: List[str] = []
+
+class PollingScanner:
+    """Stat-polling replacement for a recursive watch on one root.
+
+    Keeps a tree of directory mtimes and only re-lists directories whose
+    mtime moved (which catches creates, deletes and renames). In-place
+    modifications do not touch the directory, so file stats are refreshed
+    in bounded slices per tick, with recently changed files checked every
+    tick. Events are fed through ``handler.dispatch`` exactly like watchdog's.
+
+    The initial tree is built by ``build``, which ``PollingBackend`` runs on
+    its own thread, so scheduling a large root does not walk it on the
+    caller's.
+    """
+
+    def __init__(self, root: str, handler: FileSystemEventHandler, is_ignored_dir: Callable[[str], bool],
+                 stat_budget: int = 2000, hot_ttl: float = 30.0):
+        self.root = root
+        self.handler = handler
+        self.is_ignored_dir = is_ignored_dir
+        self.stat_budget = stat_budget
+        self.hot_ttl = hot_ttl
+        self.dirs: Dict[str, _DirRecord] = {}
+        self.hot: Dict[str, float] = {}
+        self._cursor = 0
+        self._file_list: List[str] = []
+        self.ready = False
+
+    def build(self):
+        self._build(self.root, emit=False)
+        self.ready = True
+
+    def _list(self, directory: str, record: _DirRecord):
+        record.files.clear()
+        record.subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.is_ignored_dir(entry.path):
+                                record.subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            record.files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+
+    def _build(self, directory: str, emit: bool):
+        pending = [directory]
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            record = _DirRecord(mtime_ns)
+            self._list(directory, record)  # Filters every subdirectory, so ignored ones are never entered.
+            self.dirs[directory] = record
+            if emit:
+                self.handler.dispatch(DirCreatedEvent(directory))
+                for name in record.files:
+                    self._emit(FileCreatedEvent(os.path.join(directory, name)))
+            pending.extend(record.subdirs)
+        self._file_list = []
+
+    def _drop(self, directory: str):
+        record = self.dirs.pop(directory, None)
+        if record is None:
+            return
+        for name in record.files:
+            self._emit(FileDeletedEvent(os.path.join(directory, name)))
+        for subdir in record.subdirs:
+            self._drop(subdir)
+        self._file_list = []
+
+    def _emit(self, event):
+        self.hot[event.src_path] = time.monotonic()
+        self.handler.dispatch(event)
+
+    def poll(self) -> int:
+        """Run one scan tick; returns the number of changes seen."""
+        changes = 0
+        for directory in list(self.dirs):
+            record = self.dirs.get(directory)
+            if record is None:
+                continue
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                if directory != self.root:
+                    continue  # Its parent's rescan will drop it.
+                self._drop(directory)
+                return changes + 1
+            if mtime_ns != record.mtime_ns:
+                changes += self._rescan(directory, record, mtime_ns)
+        changes += self._check_files()
+        return changes
+
+    def _rescan(self, directory: str, record: _DirRecord, mtime_ns: int) -> int:
+        old_files = dict(record.files)
+        old_subdirs = set(record.subdirs)
+        record.mtime_ns = mtime_ns
+        self._list(directory, record)
+        changes = 0
+        for name, stat in record.files.items():
+            previous = old_files.pop(name, None)
+            if previous is None:
+                self._emit(FileCreatedEvent(os.path.join(directory, name)))
+                changes += 1
+            elif previous != stat:
+                self._emit(FileModifiedEvent(os.path.join(directory, name)))
+                changes += 1
+        for name in old_files:
+            self._emit(FileDeletedEvent(os.path.join(directory, name)))
+            changes += 1
+        new_subdirs = set(record.subdirs)
+        for subdir in new_subdirs - old_subdirs:
+            self._build(subdir, emit=True)
+            changes += 1
+        for subdir in old_subdirs - new_subdirs:
+            self._drop(subdir)
+            changes += 1
+        if changes:
+            self._file_list = []
+        return changes
+
+    def _check_files(self) -> int:
+        now = time.monotonic()
+        for path, seen in list(self.hot.items()):
+            if now - seen > self.hot_ttl:
+                del self.hot[path]
+        if not self._file_list:
+            self._file_list = [os.path.join(directory, name)
+                               for directory, record in self.dirs.items() for name in record.files]
+            self._cursor = 0
+        batch = set(self.hot)
+        end = min(self._cursor + self.stat_budget, len(self._file_list))
+        batch.update(self._file_list[self._cursor:end])
+        self._cursor = 0 if end >= len(self._file_list) else end
+
+        changes = 0
+        for path in batch:
+            directory, name = os.path.split(path)
+            record = self.dirs.get(directory)
+            if record is None or name not in record.files:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # The directory rescan reports the delete.
+            current = (stat.st_size, stat.st_mtime_ns)
+            if record.files[name] != current:
+                record.files[name] = current
+                self._emit(FileModifiedEvent(path))
+                changes += 1
+        return changes
+
+class PollingBackend:
+    """One thread that ticks every polling root, backing off while the trees are idle."""
+
+    def __init__(self, min_interval: float = 0.5, max_interval: float = 5.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.scanners: Dict[str, PollingScanner] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, scanner: PollingScanner):
+        """Start polling ``scanner``; its tree is built on the polling thread, not here."""
+        with self._lock:
+            self.scanners[scanner.root] = scanner
+        self.interval = self.min_interval
+        self._wake.set()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='polling-watcher', daemon=True)
+            self._thread.start()
+
+    def remove(self, root: str):
+        with self._lock:
+            self.scanners.pop(root, None)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self.scanners.clear()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            with self._lock:
+                scanners = list(self.scanners.values())
+            changes = 0
+            for scanner in scanners:
+                try:
+                    if not scanner.ready:
+                        started = time.perf_counter()
+                        scanner.build()
+                        logging.info(f"Polling {scanner.root}: {len(scanner.dirs)} directories listed in "
+                                     f"{(time.perf_counter() - started) * 1000:.0f} ms")
+                        continue
+                    changes += scanner.poll()
+                except Exception as e:
+                    logging.error(f"Error polling {scanner.root}: {e}")
+            # Speed up while things are changing, back off while idle.
+            if changes:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * 1.5)
@@ -1,15 +1,114 @@
+import time
+LAUNCHED_AT = time.perf_counter()  # Before the heavy imports, so startup logs include them.
+
 import asyncio
 import websockets
 import json
 import logging
 import os
-from typing import Set, Dict, Any
+import sys
+import hmac
+import argparse
+import signal
+import threading
+from urllib.parse import parse_qs, urlsplit
+from typing import Set, Dict, Any, List, Optional
 from file_monitor import FileMonitor
+from file_index import DEFAULT_INDEX_PATH, SNAPSHOT_FIELDS
+from file_delta import DeltaEncoder, change_key
+from client_session import ClientSession, OVERFLOW_COALESCE
+from blob_store import BlobStore
+from subscriptions import SubscriptionIndex, subscription_from_message
+from wire_format import WireMessage, available_compressions, available_formats, negotiate
+from event_journal import DEFAULT_JOURNAL_PATH, EventJournal
+from content_reader import ContentReader
+from metrics_sampler import MetricsCursor, MetricsSampler
+from symbol_index import DEFAULT_SYMBOL_INDEX_PATH, SymbolIndex, SymbolIndexer
+from search_index import DEFAULT_SEARCH_PATH, SearchIndex, SearchIndexer
+from analysis_scheduler import BACKENDS as ANALYSIS_BACKENDS, AnalysisScheduler, create_backend
+from file_tree import TREE_FIELDS, FileTree
+from instrumentation import (REGISTRY, PUBLISHED_MESSAGES, metrics_response, not_found_response,
+                             parse_request_path)
+
+# The Vite dev server and the packaged Electron app.
+DEFAULT_ALLOWED_ORIGINS = ('http://localhost:5173', 'http://127.0.0.1:5173', 'file://')
+
+# Run as a script in the traced process; the server itself only imports it when a trace starts.
+TRACE_RECORDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trace_recorder.py')
+# Ring buffer slots a client may ask a trace for.
+TRACE_CAPACITY_RANGE = (1 << 10, 1 << 22)
 
 class WebSocketServer:
-    def __init__(self):
+    def __init__(self, client_queue_size: int = 1024, overflow_policy: str = OVERFLOW_COALESCE,
+                 index_path: Optional[str] = DEFAULT_INDEX_PATH, shards: int = 1,
+                 journal_path: Optional[str] = DEFAULT_JOURNAL_PATH, metrics_interval: float = 0.1,
+                 metrics_push_interval: float = 0.5,
+                 symbol_index_path: Optional[str] = DEFAULT_SYMBOL_INDEX_PATH, symbols: bool = True,
+                 search_path: Optional[str] = DEFAULT_SEARCH_PATH, search: bool = True,
+                 search_memory_budget: int = 64 * 1024 * 1024, analysis_backend: Optional[str] = None,
+                 tree_cache_entries: int = 500_000, allowed_origins: Optional[List[str]] = None,
+                 token: Optional[str] = None, allowed_roots: Optional[List[str]] = None,
+                 allow_trace: bool = False):
         self.clients: Set[websockets.WebSocketServerProtocol] = set()
-        self.file_monitor = FileMonitor()
+        if shards > 1:
+            # Only sharded runs pay for multiprocessing.
+            from sharded_monitor import ShardedFileMonitor
+            self.file_monitor = ShardedFileMonitor(shards, index_path=index_path)
+        else:
+            self.file_monitor = FileMonitor(index_path=index_path)
+        self.delta_encoder = DeltaEncoder()
+        self.sessions: Dict[websockets.WebSocketServerProtocol, ClientSession] = {}
+        self.subscriptions = SubscriptionIndex()
+        self.blobs = BlobStore(on_evict=self.forget_hashes)
+        self.journal = EventJournal(journal_path) if journal_path else None
+        self.content_reader = ContentReader()
+        self.symbols = SymbolIndex(symbol_index_path) if symbols else None
+        self.symbol_indexer = SymbolIndexer(self.symbols, self.symbols_changed) if symbols else None
+        self.search = SearchIndex(search_path, search_memory_budget) if search else None
+        self.search_indexer = SearchIndexer(self.search) if search else None
+        self.analysis = (AnalysisScheduler(create_backend(analysis_backend), self.analysis_ready)
+                         if analysis_backend else None)
+        self.tree = FileTree(tree_cache_entries)
+        # Browsers always send Origin, so this keeps other web pages out; native clients send none.
+        self.allowed_origins = set(DEFAULT_ALLOWED_ORIGINS if allowed_origins is None else allowed_origins)
+        self.token = token
+        # add_root only accepts paths under these, plus whatever is watched at startup.
+        self.allowed_roots = [os.path.realpath(os.path.expanduser(root)) for root in allowed_roots or []]
+        # Tracing runs client-chosen scripts, so it stays off unless the server is started with --allow-trace.
+        self.allow_trace = allow_trace
+        # (websocket, query_id) -> cancel flag of each running search.
+        self.searches: Dict[tuple, threading.Event] = {}
+        # (websocket, trace_id) -> traced process.
+        self.traces: Dict[tuple, asyncio.subprocess.Process] = {}
+        # Sampling only starts once a client subscribes to metrics.
+        self.metrics = MetricsSampler(metrics_interval)
+        self.metrics_started = False
+        self.metrics_cursors: Dict[websockets.WebSocketServerProtocol, MetricsCursor] = {}
+        self.metrics_push_interval = metrics_push_interval
+        REGISTRY.gauge('ender_clients', 'Connected WebSocket clients', lambda: len(self.sessions))
+        REGISTRY.gauge('ender_client_queue_depth', 'Messages queued for each client send',
+                       self.client_queue_depths, ['client'])
+        REGISTRY.gauge('ender_client_dropped_messages', 'Messages dropped on client queue overflow',
+                       lambda: sum(session.dropped for session in list(self.sessions.values())))
+        REGISTRY.gauge('ender_symbol_files', 'Files in the symbol index',
+                       lambda: len(self.symbols.files) if self.symbols is not None else 0)
+        REGISTRY.gauge('ender_search_files', 'Files in the search index',
+                       lambda: len(self.search.ids) if self.search is not None else 0)
+        REGISTRY.gauge('ender_search_heap_bytes', 'Estimated heap used by the search index delta and file table',
+                       lambda: self.search.heap_bytes() if self.search is not None else 0)
+        REGISTRY.gauge('ender_traces', 'Running traced processes', lambda: len(self.traces))
+        REGISTRY.gauge('ender_analysis_pending', 'Files waiting for analysis',
+                       lambda: self.analysis.pending() if self.analysis is not None else 0)
+        REGISTRY.gauge('ender_analysis_open_files', 'Files open in at least one client',
+                       lambda: len(self.analysis.open_counts) if self.analysis is not None else 0)
+        REGISTRY.gauge('ender_tree_directories', 'Directory listings in the file tree cache',
+                       lambda: len(self.tree.listings))
+        REGISTRY.gauge('ender_tree_entries', 'Entries in the file tree cache', lambda: self.tree.entries)
+        REGISTRY.gauge('ender_journal_head', 'Last journal sequence number',
+                       lambda: self.journal.head if self.journal is not None else 0)
+        self.unsubscribed: Set[websockets.WebSocketServerProtocol] = set()
+        self.client_queue_size = client_queue_size
+        self.overflow_policy = overflow_policy
         self.loop = None
 
     async def handle_message(self, message: Dict[str, Any], websocket: websockets.WebSocketServerProtocol):
@@ -46,69 +145,1095 @@ class WebSocketServer:
                         'message': f"Failed to create project: {str(e)}"
                     }))
 
-    async def notify_clients(self, change: Dict[str, Any]):
-        """Notify all connected clients about a file change."""
-        if not self.clients:
+        elif message.get('type') == 'ack':
+            key = self.message_key(message)
+            seq = message.get('seq')
+            if key is None or not isinstance(seq, int):
+                self.sessions[websocket].enqueue(WireMessage({'type': 'error', 'message': 'Invalid ack'}))
+                return
+            self.sessions[websocket].sync.ack(key, seq)
+
+        elif message.get('type') == 'resync':
+            # The client saw a sequence gap or failed to apply a patch.
+            path = message.get('path')
+            key = self.message_key(message)
+            session = self.sessions[websocket]
+            if key is None:
+                session.enqueue(WireMessage({'type': 'error', 'message': 'Invalid resync'}))
+                return
+            session.sync.reset(key)
+            current = self.delta_encoder.current(key)
+            if current is None:
+                session.enqueue(WireMessage({
+                    'type': 'error',
+                    'message': f"No content available to resync {path}"
+                }))
+                return
+            seq, content = current
+            session.enqueue(WireMessage({
+                'type': 'file_modified',
+                'root': message.get('root'),
+                'path': path,
+                'seq': seq,
+                'content': content
+            }), path=key, seq=seq)
+
+        elif message.get('type') == 'subscribe':
+            try:
+                subscription = subscription_from_message(websocket, message)
+            except (TypeError, ValueError) as e:
+                self.sessions[websocket].enqueue(WireMessage({
+                    'type': 'error',
+                    'message': f"Invalid subscription: {str(e)}"
+                }))
+                return
+            self.subscriptions.add(subscription)
+            self.unsubscribed.discard(websocket)
+            self.sessions[websocket].enqueue(WireMessage({'type': 'subscribed', 'id': subscription.id}))
+
+        elif message.get('type') == 'unsubscribe':
+            subscription_id = str(message.get('id', 'default'))
+            self.subscriptions.remove(websocket, subscription_id)
+            if not self.subscriptions.has_subscriptions(websocket):
+                # With no filters left the client is back to receiving everything.
+                self.unsubscribed.add(websocket)
+            self.sessions[websocket].enqueue(WireMessage({'type': 'unsubscribed', 'id': subscription_id}))
+
+        elif message.get('type') == 'capabilities':
+            session = self.sessions[websocket]
+            session.blob_refs = bool(message.get('blob_refs', False))
+            if 'formats' in message or 'compression' in message:
+                formats = message.get('formats')
+                compressions = message.get('compression')
+                threshold = message.get('compress_threshold', 4096)
+                if not (isinstance(formats, (list, type(None))) and isinstance(compressions, (list, type(None)))
+                        and isinstance(threshold, int)):
+                    session.enqueue(WireMessage({'type': 'error', 'message': "Invalid capabilities"}))
+                    return
+                # The reply is the last frame in the old wire; everything after it uses the new one.
+                wire = negotiate(formats, compressions, threshold)
+                session.enqueue(WireMessage(dict(wire.describe(), type='capabilities',
+                                                 formats=available_formats(),
+                                                 compressions=available_compressions())))
+                session.wire = wire
+
+        elif message.get('type') == 'get_blob':
+            digest = message.get('hash')
+            content = self.blobs.get(digest) if digest else None
+            session = self.sessions[websocket]
+            if content is None:
+                session.enqueue(WireMessage({
+                    'type': 'error',
+                    'message': f"Blob not available: {digest}"
+                }))
+                return
+            session.enqueue(WireMessage({'type': 'blob', 'hash': digest, 'content': content}))
+            session.held_blobs.add(digest)
+
+        elif message.get('type') in ('add_root', 'remove_root'):
+            path = message.get('path')
+            session = self.sessions[websocket]
+            if not path:
+                session.enqueue(WireMessage({'type': 'error', 'message': "Missing root path"}))
+                return
+            adding = message['type'] == 'add_root'
+            if adding and not self.root_allowed(path):
+                session.enqueue(WireMessage({'type': 'error', 'message': f"Root not allowed: {path}"}))
+                return
+            started = self.loop.time()
+            # Scheduling an inotify watch can touch the filesystem, so keep it off the loop.
+            operation = self.file_monitor.add_root if adding else self.file_monitor.remove_root
+            ok = await self.loop.run_in_executor(None, operation, path)
+            if not ok:
+                session.enqueue(WireMessage({
+                    'type': 'error',
+                    'message': f"Failed to {'add' if adding else 'remove'} root: {path}"
+                }))
+                return
+            reply = {
+                'type': 'root_added' if adding else 'root_removed',
+                'path': path,
+                'latency_ms': round((self.loop.time() - started) * 1000, 2)
+            }
+            if adding:
+                reply['mode'] = self.file_monitor.watch_mode(path)
+            else:
+                self.tree.remove_root(path)
+            session.enqueue(WireMessage(reply))
+
+        elif message.get('type') == 'watch_status':
+            stats = self.file_monitor.stats()
+            self.sessions[websocket].enqueue(WireMessage({
+                'type': 'watch_status',
+                'inotify_limit': stats['inotify_limit'],
+                'roots': stats['watch_modes']
+            }))
+
+        elif message.get('type') == 'resume':
+            await self.resume(websocket, message.get('seq'))
+
+        elif message.get('type') == 'symbol_query':
+            # Answered from the in-memory inverted maps; no file is read or parsed.
+            name = message.get('name')
+            session = self.sessions[websocket]
+            if self.symbols is None or not isinstance(name, str) or not name:
+                session.enqueue(WireMessage({'type': 'error', 'message': 'Invalid symbol query'}))
+                return
+            which = message.get('which', 'all')
+            limit = message.get('limit') if isinstance(message.get('limit'), int) else 100
+            reply = {'type': 'symbol_results', 'name': name}
+            if which in ('all', 'definitions'):
+                reply['definitions'] = self.symbols.definitions(name, limit)
+            if which in ('all', 'references'):
+                reply['references'] = self.symbols.references(name, limit)
+            session.enqueue(WireMessage(reply))
+
+        elif message.get('type') == 'search':
+            # Not awaited, so this client's search_cancel is read while the search runs.
+            asyncio.ensure_future(self.run_search(websocket, message))
+
+        elif message.get('type') == 'search_cancel':
+            cancelled = self.searches.get((websocket, message.get('query_id')))
+            if cancelled is not None:
+                cancelled.set()
+
+        elif message.get('type') == 'trace_start':
+            # Not awaited: the trace streams until its process exits.
+            asyncio.ensure_future(self.run_trace(websocket, message))
+
+        elif message.get('type') == 'trace_stop':
+            process = self.traces.get((websocket, message.get('trace_id')))
+            if process is not None and process.returncode is None:
+                process.terminate()
+
+        elif message.get('type') == 'open_files':
+            # Replaces this client's open files; their analysis jumps the queue.
+            if self.analysis is None:
+                return
+            files = [entry for entry in message.get('files') or [] if isinstance(entry, dict)]
+            locations = await self.loop.run_in_executor(None, self.open_locations, files)
+            for key in self.analysis.set_open(websocket, locations):
+                entry = locations[key]
+                self.analysis.submit(key, entry.get('root'), entry['path'], entry.get('language'))
+
+        elif message.get('type') == 'list_dir':
+            await self.list_dir(websocket, message)
+
+        elif message.get('type') == 'read_file':
+            await self.read_file(websocket, message)
+
+        elif message.get('type') == 'outline':
+            root, path = message.get('root'), message.get('path')
+            outline = self.symbols.outline(change_key(root, path)) if self.symbols is not None and path else None
+            self.sessions[websocket].enqueue(WireMessage({'type': 'outline', 'root': root, 'path': path,
+                                                          'outline': outline}))
+
+        elif message.get('type') == 'metrics_subscribe':
+            session = self.sessions[websocket]
+            if not self.metrics_started:
+                self.metrics_started = self.metrics.start()
+            if not self.metrics_started:
+                session.enqueue(WireMessage({'type': 'error', 'message': 'System metrics are unavailable'}))
+                return
+            for pid in message.get('pids') or []:
+                if isinstance(pid, int):
+                    self.metrics.track(pid)
+            prefixes = message.get('series') or None
+            self.metrics_cursors[websocket] = MetricsCursor(prefixes)
+            reply = {
+                'type': 'metrics_subscribed',
+                'interval': self.metrics.interval,
+                'push_interval': self.metrics_push_interval,
+                'tiers': [bucket for bucket, _ in self.metrics.tiers]
+            }
+            tier = message.get('history_tier')
+            if isinstance(tier, int):
+                reply['history'] = self.metrics.history(self.metrics.names(prefixes), tier)
+            session.enqueue(WireMessage(reply))
+
+        elif message.get('type') == 'metrics_unsubscribe':
+            self.metrics_cursors.pop(websocket, None)
+
+        elif message.get('type') == 'snapshot':
+            # The whole indexed tree in one message, so new clients need not walk directories.
+            roots = self.file_monitor.snapshot(message.get('root'))
+            self.sessions[websocket].enqueue(WireMessage({
+                'type': 'snapshot',
+                'fields': SNAPSHOT_FIELDS,
+                'roots': roots
+            }))
+
+    async def resume(self, websocket: websockets.WebSocketServerProtocol, since: Any):
+        """Send a reconnecting client what changed after journal sequence ``since``, one message per path."""
+        session = self.sessions[websocket]
+        if self.journal is None or not isinstance(since, int):
+            session.enqueue(WireMessage({
+                'type': 'error',
+                'message': "Resume is not available" if self.journal is None else "Invalid resume sequence"
+            }))
+            return
+        records = await self.loop.run_in_executor(None, self.journal.read_since, since)
+        if records is None:
+            # The gap was evicted: send the whole indexed tree and let the client compare hashes.
+            head = self.journal.head
+            roots = await self.loop.run_in_executor(None, self.file_monitor.snapshot, None)
+            session.enqueue(WireMessage({'type': 'snapshot', 'fields': SNAPSHOT_FIELDS, 'roots': roots,
+                                         'journal_seq': head}))
+            session.enqueue(WireMessage({'type': 'resumed', 'mode': 'snapshot', 'journal_seq': head}))
+            return
+
+        # Compact to the latest record per path, in the order those records were written.
+        latest: Dict[str, List[Any]] = {}
+        for record in records:
+            key = change_key(record[2], record[3])
+            latest.pop(key, None)
+            latest[key] = record
+        pending = []
+        unread = []
+        for key, (journal_seq, kind, root, path, language, digest) in latest.items():
+            targets = self.route(root, path, language)
+            if session not in targets:
+                continue
+            message = {'type': kind, 'root': root, 'path': path, 'journal_seq': journal_seq}
+            if kind != 'file_deleted':
+                message['language'] = language
+                if not targets[session]:
+                    message['metadata_only'] = True
+                else:
+                    # Newest content we hold, else the blob for the journalled hash, else the disk.
+                    current = self.delta_encoder.current(key)
+                    content = current[1] if current is not None else (self.blobs.get(digest) if digest else None)
+                    if content is not None:
+                        message['content'] = content
+                    else:
+                        unread.append((key, message))
+            pending.append((key, message))
+        if unread:
+            await self.loop.run_in_executor(None, self.read_current, unread)
+        for key, message in pending:
+            seq = self.delta_encoder.sequences.get(key, 0)
+            message['seq'] = seq
+            session.sync.reset(key)
+            if 'content' in message:
+                session.enqueue(WireMessage(message), path=key, seq=seq)
+            else:
+                session.enqueue(WireMessage(message))
+        session.enqueue(WireMessage({
+            'type': 'resumed',
+            'mode': 'tail',
+            'journal_seq': records[-1][0] if records else since,
+            'changes': len(pending)
+        }))
+
+    def read_current(self, entries: List[Any]):
+        """Fill in current file content for catch-up messages; runs in the executor."""
+        for key, message in entries:
+            if not os.path.isfile(key):
+                # Gone since it was journalled; the client should drop it too.
+                message['type'] = 'file_deleted'
+                message.pop('language', None)
+                continue
+            result = self.content_reader.read(key)
+            if result.error is not None:
+                # Unreadable right now; the client keeps what it had until the next change.
+                message.update(metadata_only=True)
+            elif result.binary or result.streamed:
+                # Large files are only ever streamed live; the client can wait for the next change.
+                message.update(metadata_only=True, size=result.size, binary=result.binary)
+            else:
+                message['content'] = result.text
+                if result.digest is not None:
+                    message['hash'] = result.digest
+                if result.truncated:
+                    message.update(truncated=True, size=result.size)
+
+    def record(self, message: Dict[str, Any]) -> Optional[int]:
+        """Journal a change and stamp it with its journal sequence number."""
+        if self.journal is None:
+            return None
+        try:
+            journal_seq = self.journal.append(message['type'], message.get('root'), message['path'],
+                                              message.get('language'), message.get('hash'))
+        except OSError as e:
+            logging.error(f"Error writing event journal: {e}")
+            return None
+        message['journal_seq'] = journal_seq
+        return journal_seq
+
+    def record_offline(self, change: Dict[str, Any]):
+        if self.journal is None:
+            return
+        root = change.get('root')
+        for kind, key in (('file_created', 'added'), ('file_modified', 'modified'), ('file_deleted', 'deleted')):
+            for path in change.get(key, []):
+                self.record({'type': kind, 'root': root, 'path': path})
+        change['journal_seq'] = self.journal.head
+
+    def route(self, root: Optional[str], path: str, language: Optional[str]) -> Dict[ClientSession, bool]:
+        """Sessions interested in a path, mapped to whether they want its content."""
+        targets = {self.sessions[websocket]: True for websocket in self.unsubscribed}
+        for websocket, wants_content in self.subscriptions.match(change_key(root, path), language).items():
+            session = self.sessions.get(websocket)
+            if session is not None:
+                targets[session] = wants_content
+        return targets
+
+    def content_wanted(self, path: str, language: str) -> bool:
+        """Called from the monitor's read workers before a file is read."""
+        return self.subscriptions.wants_content(path, language, len(self.unsubscribed))
+
+    def index_symbols(self, change: Dict[str, Any]):
+        """Hand a change to the symbol indexer, with its content when the event carried all of it."""
+        if self.symbol_indexer is None:
+            return
+        kind = change.get('type')
+        if kind == 'file_deleted':
+            self.symbol_indexer.submit(change.get('root'), change['path'], change.get('language'), deleted=True)
+        elif kind in ('file_created', 'file_modified'):
+            complete = 'content' in change and not change.get('truncated')
+            self.symbol_indexer.submit(change.get('root'), change['path'], change.get('language'),
+                                       change['content'] if complete else None, change.get('hash'))
+
+    def index_search(self, change: Dict[str, Any]):
+        """Hand a change to the search indexer; like the symbol index, it reads the file itself when needed."""
+        if self.search_indexer is None or change.get('type') not in ('file_created', 'file_modified', 'file_deleted'):
+            return
+        key = change_key(change.get('root'), change['path'])
+        if change['type'] == 'file_deleted':
+            self.search_indexer.submit(key, change.get('root'), deleted=True)
+        elif not change.get('binary'):
+            complete = 'content' in change and not change.get('truncated')
+            self.search_indexer.submit(key, change.get('root'), change['content'] if complete else None,
+                                       change.get('hash') if complete else None)
+
+    def analyze(self, change: Dict[str, Any]):
+        """Hand a change to the analysis scheduler; a newer change to the same file supersedes it."""
+        if self.analysis is None or change.get('type') not in ('file_created', 'file_modified', 'file_deleted'):
+            return
+        key = change_key(change.get('root'), change['path'])
+        if change['type'] == 'file_deleted':
+            self.analysis.cancel(key)
+        elif not change.get('binary'):
+            complete = 'content' in change and not change.get('truncated')
+            self.analysis.submit(key, change.get('root'), change['path'], change.get('language'),
+                                 change['content'] if complete else None, change.get('hash') if complete else None)
+
+    def forget_hashes(self, digests: List[str]):
+        """Evicted blobs take the monitor's matching unchanged-save hashes with them (in-process monitor only)."""
+        handler = getattr(self.file_monitor, 'event_handler', None)
+        if handler is not None:
+            handler.content_hashes.forget(digests)
+
+    def message_key(self, message: Dict[str, Any]) -> Optional[str]:
+        """The change key a client message names, or None unless it is a relative path under a watched root."""
+        root, path = message.get('root'), message.get('path')
+        if not isinstance(path, str) or not path or os.path.isabs(path) or '\0' in path:
+            return None
+        if root is not None and (not isinstance(root, str)
+                                 or os.path.normpath(root) not in self.file_monitor.watched_paths):
+            return None
+        key = change_key(root, path)
+        if root is not None and not os.path.normpath(key).startswith(os.path.normpath(root) + os.sep):
+            return None  # ../ out of the root
+        return key
+
+    def open_locations(self, files: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Change key -> entry for the open_files entries the analysis may read; runs in the executor.
+
+        Entries need a watched root and a relative path in it that the
+        monitor's filter lets through; the rest are dropped.
+        """
+        locations = {}
+        for entry in files:
+            key = self.message_key(entry) if entry.get('root') is not None else None
+            if key is not None and self.readable_path(entry['root'], key) is not None:
+                locations[key] = entry
+        return locations
+
+    def root_allowed(self, path: Any) -> bool:
+        """Whether a client may add ``path`` as a root: it must be under a configured or startup root."""
+        if not isinstance(path, str):
+            return False
+        real = os.path.realpath(path)
+        return any(real == root or real.startswith(root.rstrip(os.sep) + os.sep) for root in self.allowed_roots)
+
+    def authorized(self, websocket) -> bool:
+        """Check the handshake's Origin against the allowlist and, with a token configured, its ?token=."""
+        request = getattr(websocket, 'request', None)
+        if request is not None:
+            headers, path = request.headers, request.path
+        else:  # websockets < 14
+            headers, path = websocket.request_headers, websocket.path
+        origin = headers.get('Origin')
+        if origin is not None and origin not in self.allowed_origins:
+            logging.warning(f"Rejected connection from origin {origin}")
+            return False
+        if self.token is not None:
+            supplied = parse_qs(urlsplit(path).query).get('token', [''])[0]
+            if not hmac.compare_digest(supplied.encode(), self.token.encode()):
+                logging.warning("Rejected connection without a valid token")
+                return False
+        return True
+
+    def tree_path(self, root: Any, path: Any) -> Optional[str]:
+        """``path`` joined onto the watched ``root``; None if either is invalid or the result leaves the root."""
+        if not isinstance(root, str) or not isinstance(path, str):
+            return None
+        root = os.path.normpath(root)
+        if root not in {os.path.normpath(watched) for watched in list(self.file_monitor.watched_paths)}:
+            return None
+        full = os.path.normpath(os.path.join(root, path))
+        if full != root and not full.startswith(root.rstrip(os.sep) + os.sep):
+            return None
+        return full
+
+    async def list_dir(self, websocket: websockets.WebSocketServerProtocol, message: Dict[str, Any]):
+        """Send one page of a directory listing, then read ahead the subdirectories on it."""
+        session = self.sessions[websocket]
+        request_id = message.get('request_id')
+        root, path = message.get('root'), message.get('path') or ''
+        directory = self.tree_path(root, path)
+        if directory is None:
+            session.enqueue(WireMessage({'type': 'error', 'request_id': request_id,
+                                         'message': 'Invalid directory: needs a watched root and a path inside it'}))
+            return
+        root = os.path.normpath(root)
+        self.tree.add_root(root)
+        try:
+            listing = await self.tree.listing(directory, root)
+        except (OSError, ValueError) as e:
+            session.enqueue(WireMessage({'type': 'error', 'request_id': request_id,
+                                         'message': f"Failed to list {path or root}: {e}"}))
+            return
+        limit = message.get('limit')
+        limit = min(limit, 5000) if isinstance(limit, int) and limit > 0 else 500
+        cursor = message.get('cursor') if isinstance(message.get('cursor'), str) else None
+        rows, cursor = listing.page(cursor, limit)
+        session.enqueue(WireMessage({'type': 'dir_listing', 'request_id': request_id, 'root': root, 'path': path,
+                                     'fields': TREE_FIELDS, 'entries': rows, 'total': len(listing.entries),
+                                     'cursor': cursor}))
+        if message.get('prefetch', True):
+            self.tree.prefetch(directory, root, rows)
+
+    def readable_path(self, root: str, path: str) -> Optional[str]:
+        """The real path of ``path``; None unless it is really under ``root`` and not ignored by the filter.
+
+        Keeps ignored files (``.env``, ``.git``) and symlinks out of the root
+        from ever being read on a client's behalf.
+        """
+        real_root = os.path.realpath(root)
+        real = os.path.realpath(path)
+        if (not real.startswith(real_root.rstrip(os.sep) + os.sep) or self.tree.path_filter.should_ignore(path)
+                or self.tree.path_filter.should_ignore(real)):
+            return None
+        return real
+
+    def read_tree_file(self, root: str, path: str) -> Optional[Dict[str, Any]]:
+        """Read a file for read_file, off the loop; None unless ``readable_path`` allows it and it is a regular file."""
+        real = self.readable_path(root, path)
+        if real is None or not os.path.isfile(real):
+            return None
+        result = self.content_reader.read(real)
+        if result.error is not None:
+            return None
+        reply: Dict[str, Any] = {'size': result.size}
+        if result.binary:
+            reply['binary'] = True
+        elif result.streamed:
+            reply['chunks'] = self.content_reader.chunk_count(result.size)
+        else:
+            reply['content'] = result.text
+            if result.digest is not None:
+                reply['hash'] = result.digest
+            if result.truncated:
+                reply['truncated'] = True
+        return reply
+
+    async def read_file(self, websocket: websockets.WebSocketServerProtocol, message: Dict[str, Any]):
+        """Send one file's content; files over the stream threshold follow as file_chunk messages."""
+        session = self.sessions[websocket]
+        request_id = message.get('request_id')
+        root, path = message.get('root'), message.get('path')
+        full = self.tree_path(root, path) if path else None
+        reply = None
+        if full is not None:
+            root = os.path.normpath(root)
+            self.tree.add_root(root)
+            reply = await self.loop.run_in_executor(None, self.read_tree_file, root, full)
+        if reply is None:
+            session.enqueue(WireMessage({'type': 'error', 'request_id': request_id,
+                                         'message': f"Failed to read file: {path}"}))
+            return
+        language = self.tree.language_resolver.resolve(full)
+        reply.update({'type': 'file_content', 'request_id': request_id, 'root': root, 'path': path,
+                      'language': language})
+        session.enqueue(WireMessage(reply))
+        if 'chunks' in reply:
+            await self.stream_file(session, request_id, root, path, full, language, reply['chunks'])
+
+    async def stream_file(self, session: ClientSession, request_id: Any, root: str, path: str, full: str,
+                          language: str, count: int):
+        """Send a large file as file_chunk messages, one chunk read at a time, pausing while the client's queue is full."""
+        chunks = self.content_reader.iter_chunks(full)
+        sent = 0
+        try:
+            while sent < count:
+                await session.wait_for_room()
+                data = await self.loop.run_in_executor(None, next, chunks, None)
+                if data is None or session.closed:
+                    break
+                session.enqueue(WireMessage({'type': 'file_chunk', 'request_id': request_id, 'root': root,
+                                             'path': path, 'language': language, 'index': sent, 'count': count,
+                                             'data': data, 'final': sent + 1 >= count}))
+                sent += 1
+        except Exception as e:
+            logging.error(f"Error streaming file {full}: {e}")
+        finally:
+            chunks.close()
+        if sent < count and not session.closed:
+            # The file shrank or vanished mid-stream; close the sequence explicitly.
+            session.enqueue(WireMessage({'type': 'file_chunk', 'request_id': request_id, 'root': root, 'path': path,
+                                         'language': language, 'index': sent, 'count': sent,
+                                         'data': '', 'final': True}))
+
+    async def reconcile_indexes(self, root: str):
+        """After a root's initial scan, bring the symbol and search indexes in line with the file index."""
+        snapshot = await self.loop.run_in_executor(None, self.file_monitor.snapshot, root)
+        rows = snapshot.get(root, [])
+        for name, indexer in (('Symbol', self.symbol_indexer), ('Search', self.search_indexer)):
+            if indexer is not None:
+                await self.loop.run_in_executor(None, indexer.reconcile, root, rows, SNAPSHOT_FIELDS)
+                logging.info(f"{name} index reconciling {len(rows)} files under {root}")
+
+    async def run_search(self, websocket: websockets.WebSocketServerProtocol, message: Dict[str, Any]):
+        """Stream a search as search_results pages, then search_done with the cursor for the next page."""
+        session = self.sessions[websocket]
+        query_id = message.get('query_id')
+        pattern = message.get('pattern')
+        if self.search is None or not isinstance(pattern, str) or not pattern:
+            session.enqueue(WireMessage({'type': 'error', 'query_id': query_id, 'message': 'Invalid search'}))
             return
+        limit = message.get('limit') if isinstance(message.get('limit'), int) else 200
+        page_size = message.get('page_size') if isinstance(message.get('page_size'), int) else 50
+        cursor = message.get('cursor') if isinstance(message.get('cursor'), str) else None
+        cancelled = self.searches[(websocket, query_id)] = threading.Event()
+        loop = self.loop
 
-        message = json.dumps(change)
-        disconnected = set()
-        for client in self.clients:
+        def send(reply: Dict[str, Any]):
+            loop.call_soon_threadsafe(session.enqueue, WireMessage(reply))
+
+        def run():
+            # Runs in the executor: candidate lookup is in memory, but the post-filter reads files.
+            started = time.perf_counter()
+            page: List[Dict[str, Any]] = []
+            pages = total = 0
+            next_cursor = None
             try:
-                await client.send(message)
-            except websockets.exceptions.ConnectionClosed:
-                disconnected.add(client)
+                current = None
+                for position, match in self.search.search(pattern, bool(message.get('literal')),
+                                                          bool(message.get('ignore_case')), message.get('root'), cursor):
+                    if cancelled.is_set():
+                        break
+                    if position != current:
+                        if total >= limit:
+                            next_cursor = position  # Stop on a file boundary so the cursor resumes cleanly.
+                            break
+                        current = position
+                    page.append(match)
+                    total += 1
+                    if len(page) >= page_size:
+                        send({'type': 'search_results', 'query_id': query_id, 'page': pages, 'matches': page})
+                        pages += 1
+                        page = []
+            except ValueError as e:
+                send({'type': 'error', 'query_id': query_id, 'message': str(e)})
+                return
             except Exception as e:
-                logging.error(f"Error sending message to client: {e}")
-                disconnected.add(client)
+                logging.error(f"Search for {pattern!r} failed: {e}")
+                send({'type': 'error', 'query_id': query_id, 'message': f'Search failed: {e}'})
+                return
+            if page:
+                send({'type': 'search_results', 'query_id': query_id, 'page': pages, 'matches': page})
+            send({'type': 'search_done', 'query_id': query_id, 'matches': total, 'cursor': next_cursor,
+                  'cancelled': cancelled.is_set(),
+                  'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+        try:
+            await loop.run_in_executor(None, run)
+        finally:
+            if self.searches.get((websocket, query_id)) is cancelled:
+                del self.searches[(websocket, query_id)]
+
+    def trace_script(self, script: Any) -> Optional[str]:
+        """The real path of ``script`` if it is a Python file under a watched root, else None."""
+        if not isinstance(script, str) or not script.endswith('.py'):
+            return None
+        script = os.path.realpath(script)
+        roots = [os.path.realpath(root) for root in list(self.file_monitor.watched_paths)]
+        if not os.path.isfile(script) or not any(script.startswith(root.rstrip(os.sep) + os.sep) for root in roots):
+            return None
+        return script
+
+    async def run_trace(self, websocket: websockets.WebSocketServerProtocol, message: Dict[str, Any]):
+        """Run a script under the trace recorder and stream its records to the client that started it."""
+        session = self.sessions[websocket]
+        trace_id = message.get('trace_id')
+        if not self.allow_trace:
+            session.enqueue(WireMessage({'type': 'error', 'trace_id': trace_id,
+                                         'message': 'Tracing is disabled; start the server with --allow-trace'}))
+            return
+        script = self.trace_script(message.get('script'))
+        watch = message.get('watch')
+        args = message.get('args') or []
+        if (script is None or not isinstance(watch, list) or not watch or not isinstance(args, list)
+                or not all(isinstance(spec, str) for spec in watch)):
+            session.enqueue(WireMessage({'type': 'error', 'trace_id': trace_id,
+                                         'message': 'Invalid trace: needs watch specs and a .py script under a watched path'}))
+            return
+        if (websocket, trace_id) in self.traces:
+            session.enqueue(WireMessage({'type': 'error', 'trace_id': trace_id, 'message': 'Trace already running'}))
+            return
+        from trace_recorder import CHUNK_HEADER, TraceDecoder
+
+        command = [sys.executable, TRACE_RECORDER]
+        for spec in watch:
+            command += ['--watch', spec]
+        capacity = message.get('capacity')
+        if isinstance(capacity, int) and not isinstance(capacity, bool):
+            low, high = TRACE_CAPACITY_RANGE
+            command += ['--capacity', str(max(low, min(high, capacity)))]
+        read_fd, write_fd = os.pipe()
+        command += ['--pipe-fd', str(write_fd), script] + [str(arg) for arg in args]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, cwd=os.path.dirname(script), pass_fds=(write_fd,), stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        except (OSError, ValueError) as e:
+            os.close(read_fd)
+            session.enqueue(WireMessage({'type': 'error', 'trace_id': trace_id, 'message': f'Could not start trace: {e}'}))
+            return
+        finally:
+            os.close(write_fd)
+        self.traces[(websocket, trace_id)] = process
+        logging.info(f"Tracing {script} (pid {process.pid}) for {', '.join(watch)}")
+        session.enqueue(WireMessage({'type': 'trace_started', 'trace_id': trace_id, 'pid': process.pid}))
+
+        reader = asyncio.StreamReader()
+        transport, _ = await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                         os.fdopen(read_fd, 'rb', 0))
+        output = asyncio.ensure_future(self.forward_trace_output(session, trace_id, process.stdout))
+        decoder = TraceDecoder()
+        try:
+            while True:
+                try:
+                    sizes = await reader.readexactly(CHUNK_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break  # The traced process closed its end.
+                header_size, data_size = CHUNK_HEADER.unpack(sizes)
+                header = json.loads(await reader.readexactly(header_size))
+                data = await reader.readexactly(data_size)
+                # Decoding a full ring takes a while; keep it off the event loop.
+                batch = await self.loop.run_in_executor(None, decoder.batch, header, data)
+                batch['trace_id'] = trace_id
+                session.enqueue(WireMessage(batch))
+        except (asyncio.IncompleteReadError, ValueError) as e:
+            logging.error(f"Invalid trace stream from pid {process.pid}: {e}")
+            if process.returncode is None:
+                process.terminate()
+        finally:
+            transport.close()
+        returncode = await process.wait()
+        await output
+        del self.traces[(websocket, trace_id)]
+        session.enqueue(WireMessage({'type': 'trace_finished', 'trace_id': trace_id, 'returncode': returncode,
+                                     'records': decoder.records, 'lost': decoder.lost, 'backend': decoder.backend}))
+
+    async def forward_trace_output(self, session: ClientSession, trace_id: Any, stream: asyncio.StreamReader):
+        """Send the traced program's stdout and stderr to the client as it arrives."""
+        while True:
+            data = await stream.read(65536)
+            if not data:
+                return
+            session.enqueue(WireMessage({'type': 'trace_output', 'trace_id': trace_id,
+                                         'text': data.decode('utf-8', 'replace')}))
+
+    def symbols_changed(self, delta: Dict[str, Any]):
+        """Called from the indexer thread with each file's symbols delta."""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.publish_derived, delta)
+
+    def analysis_ready(self, result: Dict[str, Any]):
+        """Called from the analysis scheduler thread (or the loop, for cache hits) with each result."""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.publish_derived, result)
+
+    def publish_derived(self, derived: Dict[str, Any]):
+        """Route a message computed from a file (symbols, analysis) like a change to that file."""
+        targets = self.route(derived.get('root'), derived['path'], derived.get('language'))
+        if targets:
+            message = WireMessage(derived)
+            for session in targets:
+                session.enqueue(message)
+
+    def publish(self, change: Dict[str, Any]):
+        """Encode a change once and queue it on every interested client session."""
+        PUBLISHED_MESSAGES.labels(change.get('type', 'unknown')).inc()
+        if change.get('type') == 'files_changed':
+            batch = self.delta_encoder.encode_batch(change)
+            for entry in batch['changes']:
+                self.record(entry)
+                self.index_symbols(entry)
+                self.index_search(entry)
+                self.analyze(entry)
+                self.tree.apply(entry)
+            self.publish_batch(batch)
+            return
+        if change.get('type') == 'offline_changes':
+            self.record_offline(change)
+            for kind, key in (('file_created', 'added'), ('file_deleted', 'deleted')):
+                for path in change.get(key, []):
+                    self.tree.apply({'type': kind, 'root': change.get('root'), 'path': path})
+            if self.symbol_indexer is not None:
+                root = change.get('root')
+                for key in ('added', 'modified', 'deleted'):
+                    for path in change.get(key, []):
+                        self.symbol_indexer.submit(root, path, None, deleted=key == 'deleted')
+            if self.search_indexer is not None:
+                root = change.get('root')
+                for key in ('added', 'modified', 'deleted'):
+                    for path in change.get(key, []):
+                        self.search_indexer.submit(change_key(root, path), root, deleted=key == 'deleted')
+            if self.analysis is not None:
+                root = change.get('root')
+                for key in ('added', 'modified', 'deleted'):
+                    for path in change.get(key, []):
+                        if key == 'deleted':
+                            self.analysis.cancel(change_key(root, path))
+                        else:
+                            self.analysis.submit(change_key(root, path), root, path, None)
+            self.publish_offline(change)
+            return
+        if change.get('type') == 'root_scanned':
+            if self.symbol_indexer is not None or self.search_indexer is not None:
+                asyncio.ensure_future(self.reconcile_indexes(change['root']))
+            return
+        self.index_symbols(change)
+        self.index_search(change)
+        self.analyze(change)
+        self.tree.apply(change)
+        update = self.delta_encoder.encode(change)
+        if update is not None:
+            # Journalled before the client check: changes with nobody connected are what resume is for.
+            journal_seq = self.record(update.full)
+            if update.patch is not None and journal_seq is not None:
+                update.patch['journal_seq'] = journal_seq
+        if not self.sessions or 'path' not in change:
+            return
+        targets = self.route(change.get('root'), change['path'], change.get('language'))
+        if not targets:
+            return
 
-        # Remove disconnected clients
-        self.clients -= disconnected
+        if update is None:
+            # Chunks and other content-bearing messages only go to clients that want content.
+            content_only = change.get('type') == 'file_chunk'
+            message = WireMessage(change)
+            for session, wants_content in targets.items():
+                if wants_content or not content_only:
+                    session.enqueue(message)
+            return
+
+        digest = update.full.get('hash')
+        if digest is not None and 'content' in update.full and not update.full.get('truncated'):
+            self.blobs.put(digest, update.full['content'])
+        full_message = WireMessage(update.full)
+        patch_message = WireMessage(update.patch) if update.patch is not None else None
+        metadata_message = None
+        reference_message = None
+        for session, wants_content in targets.items():
+            if not wants_content:
+                if metadata_message is None:
+                    metadata = {key: value for key, value in update.full.items() if key != 'content'}
+                    metadata['metadata_only'] = True
+                    metadata_message = WireMessage(metadata)
+                session.sync.reset(update.path)
+                session.enqueue(metadata_message, path=update.path)
+                continue
+            if patch_message is not None and session.sync.can_patch(update.path, update.base_seq):
+                message = patch_message
+            elif digest is not None and session.blob_refs and digest in session.held_blobs:
+                # The client already holds this content (a revert, or a copy of another file).
+                if reference_message is None:
+                    reference = {key: value for key, value in update.full.items() if key != 'content'}
+                    reference['content_hash'] = digest
+                    reference_message = WireMessage(reference)
+                message = reference_message
+            else:
+                message = full_message
+            if digest is not None and session.blob_refs:
+                session.held_blobs.add(digest)
+            session.enqueue(message, path=update.path, seq=update.seq, full_message=full_message)
+
+    def publish_batch(self, change: Dict[str, Any]):
+        """Queue a files_changed batch, filtered down to the entries each client subscribed to."""
+        if not self.sessions:
+            return
+        if not self.subscriptions.has_any():
+            message = WireMessage(change)
+            for session in self.sessions.values():
+                session.enqueue(message)
+            return
+        per_session: Dict[ClientSession, List[Dict[str, Any]]] = {}
+        for entry in change['changes']:
+            for session in self.route(entry.get('root'), entry['path'], entry.get('language')):
+                per_session.setdefault(session, []).append(entry)
+        for session, entries in per_session.items():
+            session.enqueue(WireMessage(dict(change, changes=entries)))
+
+    def publish_offline(self, change: Dict[str, Any]):
+        """Queue an offline_changes report, filtered down to the paths each client subscribed to."""
+        if not self.sessions:
+            return
+        if not self.subscriptions.has_any():
+            message = WireMessage(change)
+            for session in self.sessions.values():
+                session.enqueue(message)
+            return
+        root = change.get('root')
+        per_session: Dict[ClientSession, Dict[str, List[str]]] = {}
+        for key in ('added', 'modified', 'deleted'):
+            for path in change.get(key, []):
+                # The report carries no languages, so only root and glob filters apply.
+                for session in self.route(root, path, None):
+                    per_session.setdefault(session, {'added': [], 'modified': [], 'deleted': []})[key].append(path)
+        for session, paths in per_session.items():
+            session.enqueue(WireMessage(dict(change, **paths)))
+
+    async def push_metrics(self):
+        """Send each metrics subscriber the samples it has not seen yet, once per push interval."""
+        while True:
+            await asyncio.sleep(self.metrics_push_interval)
+            for websocket, cursor in list(self.metrics_cursors.items()):
+                session = self.sessions.get(websocket)
+                if session is None:
+                    continue
+                batch = cursor.batch(self.metrics)
+                if batch is not None:
+                    session.enqueue(WireMessage(batch))
+
+    def client_queue_depths(self) -> Dict[tuple, int]:
+        return {(f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
+                 if getattr(websocket, 'remote_address', None) else str(id(websocket)),): len(session.queue)
+                for websocket, session in list(self.sessions.items())}
+
+    async def serve_metrics(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer one HTTP request: GET /metrics returns the Prometheus text exposition."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; nothing in them changes the response.
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            if parse_request_path(request_line) == '/metrics':
+                writer.write(metrics_response(REGISTRY.render()))
+            else:
+                writer.write(not_found_response())
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def notify_clients(self, change: Dict[str, Any]):
+        """Notify all connected clients about a file change."""
+        self.publish(change)
 
     def file_change_callback(self, change: Dict[str, Any]):
         """Callback for file changes that runs in the event loop."""
         if self.loop and self.loop.is_running():
-            asyncio.run_coroutine_threadsafe(self.notify_clients(change), self.loop)
+            # call_soon_threadsafe keeps changes in order without a coroutine per event.
+            self.loop.call_soon_threadsafe(self.publish, change)
 
     async def register(self, websocket: websockets.WebSocketServerProtocol):
         """Register a new client connection."""
         self.clients.add(websocket)
+        session = ClientSession(websocket, self.client_queue_size, self.overflow_policy)
+        self.sessions[websocket] = session
+        self.unsubscribed.add(websocket)
+        session.start()
         logging.info(f"New client connected. Total clients: {len(self.clients)}")
 
     async def unregister(self, websocket: websockets.WebSocketServerProtocol):
         """Unregister a client connection."""
         self.clients.discard(websocket)
+        self.unsubscribed.discard(websocket)
+        self.subscriptions.remove_client(websocket)
+        self.metrics_cursors.pop(websocket, None)
+        if self.analysis is not None:
+            self.analysis.set_open(websocket, ())
+        for key, cancelled in list(self.searches.items()):
+            if key[0] is websocket:
+                cancelled.set()
+        for key, process in list(self.traces.items()):
+            if key[0] is websocket and process.returncode is None:
+                process.terminate()
+        session = self.sessions.pop(websocket, None)
+        if session:
+            await session.stop()
         logging.info(f"Client disconnected. Total clients: {len(self.clients)}")
 
     async def handler(self, websocket):
         """Handle a WebSocket connection."""
+        if not self.authorized(websocket):
+            await websocket.close(code=1008, reason='Origin not allowed or missing token')
+            return
         await self.register(websocket)
         try:
             async for message in websocket:
+                session = self.sessions[websocket]
                 try:
-                    data = json.loads(message)
+                    data = session.wire.decode(message)
+                except ValueError as e:
+                    logging.error(f"Invalid message received: {e}")
+                    session.enqueue(WireMessage({'type': 'error', 'message': f'Invalid message: {e}'}))
+                    continue
+                if isinstance(data, dict):
                     await self.handle_message(data, websocket)
-                except json.JSONDecodeError:
-                    logging.error("Invalid JSON message received")
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
             await self.unregister(websocket)
 
-    async def start(self):
-        """Start the WebSocket server and file monitor."""
+    async def start(self, host: str = "localhost", port: int = 8765, paths: Optional[List[str]] = None,
+                    metrics_port: Optional[int] = None):
+        """Start the WebSocket server, the file monitor and, with ``metrics_port``, the /metrics endpoint."""
         self.loop = asyncio.get_running_loop()
-        self.file_monitor.start([], self.file_change_callback)
+        if metrics_port:
+            try:
+                await asyncio.start_server(self.serve_metrics, host, metrics_port)
+                logging.info(f"Metrics endpoint at http://{host}:{metrics_port}/metrics")
+            except OSError as e:
+                logging.error(f"Could not serve metrics on port {metrics_port}: {e}")
+        if self.journal is not None:
+            try:
+                self.journal.open()
+            except OSError as e:
+                logging.error(f"Could not open event journal {self.journal.directory}: {e}")
+                self.journal = None
+        if self.symbols is not None:
+            try:
+                await self.loop.run_in_executor(None, self.symbols.open)
+            except Exception as e:
+                logging.error(f"Could not open symbol index {self.symbols.index_path}: {e}")
+            self.symbol_indexer.start()
+        if self.search is not None:
+            try:
+                await self.loop.run_in_executor(None, self.search.open)
+            except Exception as e:
+                logging.error(f"Could not open search index {self.search.directory}: {e}")
+            self.search_indexer.start()
+        if self.analysis is not None:
+            self.analysis.start()
+        self.file_monitor.start(paths or [], self.file_change_callback, self.content_wanted)
+        self.allowed_roots += [os.path.realpath(root) for root in list(self.file_monitor.watched_paths)]
         logging.info("File monitor started")
+        self.metrics_task = asyncio.create_task(self.push_metrics())
+        self.journal_task = asyncio.create_task(self.flush_journal()) if self.journal is not None else None
+
+        stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # No signal handlers on Windows event loops; Ctrl+C still cancels us.
+        try:
+            # permessage-deflate off: frames are already compressed per client by the wire format, when it pays.
+            async with websockets.serve(self.handler, host, port, compression=None):
+                logging.info(f"WebSocket server started on ws://{host}:{port} "
+                             f"{(time.perf_counter() - LAUNCHED_AT) * 1000:.0f} ms after launch")
+                await stopping.wait()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Stop the background work and write out the journal and indexes."""
+        for task in (self.metrics_task, self.journal_task):
+            if task is not None:
+                task.cancel()
+        # Monitor first, so no change arrives after the stores below are closed.
+        await self.loop.run_in_executor(None, self.file_monitor.stop)
+        if self.analysis is not None:
+            self.analysis.stop()
+        if self.symbol_indexer is not None:
+            await self.loop.run_in_executor(None, self.symbol_indexer.stop)
+            self.symbols.close()
+        if self.search_indexer is not None:
+            await self.loop.run_in_executor(None, self.search_indexer.stop)
+        if self.metrics_started:
+            self.metrics.stop()
+        if self.journal is not None:
+            self.journal.close()
+        logging.info("WebSocket server stopped")
+
+    async def flush_journal(self):
+        """Flush the journal on its interval, so a burst's last records are on disk without waiting for the next."""
+        while True:
+            await asyncio.sleep(self.journal.flush_interval)
+            try:
+                self.journal.flush()
+            except OSError as e:
+                logging.error(f"Error flushing event journal: {e}")
 
-        async with websockets.serve(self.handler, "localhost", 8765):
-            logging.info("WebSocket server started on ws://localhost:8765")
-            await asyncio.Future()  # run forever
+def parse_args():
+    parser = argparse.ArgumentParser(description='Ender WebSocket Server')
+    parser.add_argument('--host', default='localhost', help='Host to bind the WebSocket server to')
+    parser.add_argument('--port', type=int, default=8765, help='Port for the WebSocket server')
+    parser.add_argument('--watch-paths', nargs='+', default=[], help='Paths to watch with the file monitor')
+    parser.add_argument('--index-path', default=DEFAULT_INDEX_PATH, help='Location of the persistent file index')
+    parser.add_argument('--no-index', action='store_true', help='Disable the persistent file index')
+    parser.add_argument('--journal-path', default=DEFAULT_JOURNAL_PATH, help='Directory of the event journal')
+    parser.add_argument('--no-journal', action='store_true', help='Disable the event journal and resume')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Number of worker processes to split watch roots across (1 = in-process)')
+    parser.add_argument('--metrics-interval', type=float, default=0.1,
+                        help='Seconds between system metrics samples (sampling starts on first subscriber)')
+    parser.add_argument('--symbol-index-path', default=DEFAULT_SYMBOL_INDEX_PATH,
+                        help='Location of the persistent symbol index')
+    parser.add_argument('--no-symbols', action='store_true', help='Disable symbol indexing and queries')
+    parser.add_argument('--search-path', default=DEFAULT_SEARCH_PATH, help='Directory of the search index')
+    parser.add_argument('--no-search', action='store_true', help='Disable the full-text search index')
+    parser.add_argument('--search-memory-mb', type=int, default=64,
+                        help='Heap budget of the search index before it compacts to disk')
+    parser.add_argument('--metrics-port', type=int, default=9108,
+                        help='Port for the Prometheus /metrics endpoint (0 disables it)')
+    parser.add_argument('--allowed-origins', nargs='*', default=None,
+                        help='Origins allowed to connect (default: the Vite dev server and the Electron app); '
+                             'connections without an Origin header, from native clients, are always allowed')
+    parser.add_argument('--token', default=os.environ.get('ENDER_TOKEN'),
+                        help='Require clients to connect with ?token=<value> (default: $ENDER_TOKEN)')
+    parser.add_argument('--allowed-roots', nargs='*', default=[],
+                        help='Directories under which clients may add watch roots, besides the startup ones')
+    parser.add_argument('--allow-trace', action='store_true',
+                        help='Let clients run scripts under the watched paths with the trace recorder')
+    parser.add_argument('--tree-cache-entries', type=int, default=500_000,
+                        help='Directory entries kept in the file tree cache')
+    parser.add_argument('--analysis-backend', choices=sorted(ANALYSIS_BACKENDS), default=None,
+                        help='Model backend that analyzes changed files (off by default)')
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     logging.basicConfig(level=logging.INFO)
-    server = WebSocketServer()
-    asyncio.run(server.start())
+    server = WebSocketServer(index_path=None if args.no_index else args.index_path, shards=args.shards,
+                             journal_path=None if args.no_journal else args.journal_path,
+                             metrics_interval=args.metrics_interval, symbol_index_path=args.symbol_index_path,
+                             symbols=not args.no_symbols, search_path=args.search_path, search=not args.no_search,
+                             search_memory_budget=args.search_memory_mb * 1024 * 1024,
+                             analysis_backend=args.analysis_backend, tree_cache_entries=args.tree_cache_entries,
+                             allowed_origins=args.allowed_origins, token=args.token,
+                             allowed_roots=args.allowed_roots, allow_trace=args.allow_trace)
+    try:
+        asyncio.run(server.start(args.host, args.port, args.watch_paths, args.metrics_port))
+    except KeyboardInterrupt:
+        pass  # Already stopped cleanly by start()'s finally.
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,151 @@
+import json
+import time
+import zlib
+import importlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+from instrumentation import ENCODE_SECONDS
+
+FORMAT_JSON = 'json'
+FORMAT_MSGPACK = 'msgpack'
+FORMAT_CBOR = 'cbor'
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_ZSTD = 'zstd'
+
+# Every binary frame starts with one byte naming how the rest is compressed.
+_HEADERS = {COMPRESSION_NONE: b'\x00', COMPRESSION_ZLIB: b'\x01', COMPRESSION_ZSTD: b'\x02'}
+_HEADER_NAMES = {header[0]: name for name, header in _HEADERS.items()}
+
+Frame = Union[str, bytes]
+
+@lru_cache(maxsize=None)
+def _optional(name: str):
+    """Import an optional codec on first use (not at server start); None when it is not installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+def available_formats() -> List[str]:
+    formats = [FORMAT_JSON]
+    if _optional('msgpack') is not None:
+        formats.append(FORMAT_MSGPACK)
+    if _optional('cbor2') is not None:
+        formats.append(FORMAT_CBOR)
+    return formats
+
+def available_compressions() -> List[str]:
+    compressions = [COMPRESSION_NONE, COMPRESSION_ZLIB]
+    if _optional('zstandard') is not None:
+        compressions.append(COMPRESSION_ZSTD)
+    return compressions
+
+class Wire:
+    """How one client wants its frames: a serialization plus size-gated compression.
+
+    JSON below ``compress_threshold`` bytes stays a text frame, so the default
+    wire is exactly the old protocol. Everything else is a binary frame: a
+    compression byte (0 none, 1 zlib, 2 zstd) followed by the payload.
+    Payloads under the threshold are never compressed; for small events the
+    CPU costs more than the bytes saved.
+    """
+
+    def __init__(self, format: str = FORMAT_JSON, compression: str = COMPRESSION_NONE,
+                 compress_threshold: int = 4096, level: int = 3):
+        # The default JSON wire is built at import, so it must not probe the optional codecs.
+        if format != FORMAT_JSON and format not in available_formats():
+            raise ValueError(f"Unsupported wire format: {format}")
+        if compression not in (COMPRESSION_NONE, COMPRESSION_ZLIB) and compression not in available_compressions():
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.format = format
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.level = level
+        self.key: Tuple[str, str, int, int] = (format, compression, compress_threshold, level)
+        self._encode_seconds = ENCODE_SECONDS.labels(format)
+        zstandard = _optional('zstandard') if compression == COMPRESSION_ZSTD else None
+        self._zstd_compressor = zstandard.ZstdCompressor(level=level) if zstandard is not None else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def describe(self) -> Dict[str, Any]:
+        return {'format': self.format, 'compression': self.compression,
+                'compress_threshold': self.compress_threshold}
+
+    def _serialize(self, message: Dict[str, Any]) -> Frame:
+        if self.format == FORMAT_MSGPACK:
+            return _optional('msgpack').packb(message, use_bin_type=True)
+        if self.format == FORMAT_CBOR:
+            return _optional('cbor2').dumps(message)
+        return json.dumps(message)
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        started = time.perf_counter()
+        frame = self._encode(message)
+        self._encode_seconds.observe(time.perf_counter() - started)
+        return frame
+
+    def _encode(self, message: Dict[str, Any]) -> Frame:
+        payload = self._serialize(message)
+        if self.compression != COMPRESSION_NONE and len(payload) >= self.compress_threshold:
+            data = payload.encode('utf-8') if isinstance(payload, str) else payload
+            if self.compression == COMPRESSION_ZSTD:
+                return _HEADERS[COMPRESSION_ZSTD] + self._zstd_compressor.compress(data)
+            return _HEADERS[COMPRESSION_ZLIB] + zlib.compress(data, self.level)
+        if isinstance(payload, str):
+            return payload
+        return _HEADERS[COMPRESSION_NONE] + payload
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        """Parse a frame from the client; raises ValueError on anything malformed."""
+        if isinstance(frame, str):
+            return json.loads(frame)
+        if not frame:
+            raise ValueError("Empty binary frame")
+        compression = _HEADER_NAMES.get(frame[0])
+        data = frame[1:]
+        if compression is None or (compression == COMPRESSION_ZSTD and self._zstd_decompressor is None):
+            raise ValueError(f"Unexpected frame header: {frame[0]}")
+        # Each codec raises its own error type (zlib.error, ZstdError, msgpack's and cbor2's); report them all alike.
+        try:
+            if compression == COMPRESSION_ZLIB:
+                data = zlib.decompress(data)
+            elif compression == COMPRESSION_ZSTD:
+                data = self._zstd_decompressor.decompress(data)
+        except Exception as e:
+            raise ValueError(f"Corrupt compressed frame: {e}")
+        try:
+            if self.format == FORMAT_MSGPACK:
+                return _optional('msgpack').unpackb(data, raw=False)
+            if self.format == FORMAT_CBOR:
+                return _optional('cbor2').loads(data)
+            return json.loads(data)
+        except Exception as e:
+            raise ValueError(f"Malformed {self.format} payload: {e}")
+
+JSON_WIRE = Wire()
+
+def negotiate(formats: Optional[List[str]], compressions: Optional[List[str]],
+              compress_threshold: int = 4096) -> Wire:
+    """Pick the first format and compression the client listed that we support."""
+    format = next((name for name in formats or [] if name in available_formats()), FORMAT_JSON)
+    compression = next((name for name in compressions or [] if name in available_compressions()),
+                       COMPRESSION_NONE)
+    if format == FORMAT_JSON and compression == COMPRESSION_NONE:
+        return JSON_WIRE
+    return Wire(format, compression, compress_threshold)
+
+class WireMessage:
+    """A message encoded lazily, at most once per distinct wire, however many clients receive it."""
+    __slots__ = ('message', '_frames')
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._frames: Dict[Tuple[str, str, int, int], Frame] = {}
+
+    def frame(self, wire: Wire) -> Frame:
+        frame = self._frames.get(wire.key)
+        if frame is None:
+            frame = self._frames[wire.key] = wire.encode(self.message)
+        return frame
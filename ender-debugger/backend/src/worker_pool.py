@@ -0,0 +1,138 @@
+import queue
+import threading
+import logging
+import zlib
+from typing import Any, Callable, Dict, List, Tuple
+
+_STOP = object()
+
+class OrderedWorkerPool:
+    """Bounded thread pool that keeps tasks for the same key in submission order.
+
+    Each key is hashed to one worker, and each worker drains its own bounded
+    queue, so two changes to one path can never be processed out of order
+    while different paths proceed in parallel. ``submit`` waits up to
+    ``block_timeout`` seconds for room (backpressure on the producer) and then
+    drops the task and counts it.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 256,
+                 block_timeout: float = 0.5, name: str = 'file-worker'):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.block_timeout = block_timeout
+        self.name = name
+        self._queues: List[queue.Queue] = []
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def start(self):
+        if self._threads:
+            return
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(work_queue,),
+                                      name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain: bool = True):
+        """Stop the workers; with ``drain`` the already queued tasks still run."""
+        if not self._threads:
+            return
+        for work_queue in self._queues:
+            if not drain:
+                self._clear(work_queue)
+            work_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._queues = []
+
+    def submit(self, key: str, func: Callable[..., Any], *args) -> bool:
+        """Queue ``func(*args)`` behind earlier tasks for ``key``; False if it was dropped."""
+        if not self._queues:
+            func(*args)
+            return True
+        return self._put(self._queues[self._worker(key)], key, func, args)
+
+    def submit_grouped(self, items: List[Tuple[str, Any]], func: Callable[[List[Tuple[str, Any]]], Any]) -> int:
+        """Split ``(key, value)`` items by worker and queue ``func(group)`` on each.
+
+        Every item is handled behind earlier tasks for its key, so a batch
+        never overtakes single changes to the same paths. Returns how many
+        items were dropped.
+        """
+        if not self._queues:
+            func(items)
+            return 0
+        groups: Dict[int, List[Tuple[str, Any]]] = {}
+        for item in items:
+            groups.setdefault(self._worker(item[0]), []).append(item)
+        dropped = 0
+        for index, group in groups.items():
+            if not self._put(self._queues[index], f'{len(group)} batched keys', func, (group,)):
+                dropped += len(group)
+        return dropped
+
+    def _worker(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8', 'surrogatepass')) % self.workers
+
+    def _put(self, work_queue: queue.Queue, key: str, func: Callable[..., Any], args: tuple) -> bool:
+        try:
+            work_queue.put((func, args), timeout=self.block_timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logging.warning(f"Worker queue full, dropping task for {key}")
+            return False
+        with self._lock:
+            self.submitted += 1
+            depth = self.queue_depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def queue_depth(self) -> int:
+        return sum(work_queue.qsize() for work_queue in self._queues)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth(),
+                'max_queue_depth': self.max_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'dropped': self.dropped,
+                'failed': self.failed
+            }
+
+    @staticmethod
+    def _clear(work_queue: queue.Queue):
+        while True:
+            try:
+                work_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self, work_queue: queue.Queue):
+        while True:
+            task = work_queue.get()
+            if task is _STOP:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"Error in {self.name} task: {e}")
+                with self._lock:
+                    self.failed += 1
+            else:
+                with self._lock:
+                    self.completed += 1
@@ -5,8 +5,11 @@ import subprocess
 import argparse
 import time
 import signal
-import platform
 import logging
+import re
+import ast
+import asyncio
+from importlib import metadata
 
 # Configure logging
 logging.basicConfig(
@@ -17,30 +20,101 @@ logging.basicConfig(
 logger = logging.getLogger("server_launcher")
 
 # Default ports
-DEFAULT_DEBUGGER_PORT = 9229
 DEFAULT_FILE_MONITOR_PORT = 9230
+DEFAULT_WEBSOCKET_PORT = 8765
+
+# Service name -> (script relative to the project root, readiness port argument or None).
+SERVICES = {
+    'monitor': (os.path.join('backend', 'src', 'main.py'), None),
+    'websocket': (os.path.join('backend', 'src', 'websocket_server.py'), 'websocket_port'),
+}
+
+# Service name -> state option -> file or directory name under the service's own state directory,
+# so two services never open the same SQLite index or journal.
+STATE_OPTIONS = {
+    'monitor': {'--index-path': 'file_index.sqlite3'},
+    'websocket': {'--index-path': 'file_index.sqlite3', '--journal-path': 'journal',
+                  '--symbol-index-path': 'symbols.sqlite3', '--search-path': 'search'},
+}
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.ender-debugger')
 
 def parse_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Start Ender Debugger backend servers')
     parser.add_argument('--host', default='localhost', help='Host to bind the servers to')
-    parser.add_argument('--debugger-port', type=int, default=DEFAULT_DEBUGGER_PORT, help='Port for the debugger server')
     parser.add_argument('--file-monitor-port', type=int, default=DEFAULT_FILE_MONITOR_PORT, help='Port for the file monitor server')
+    parser.add_argument('--websocket-port', type=int, default=DEFAULT_WEBSOCKET_PORT, help='Port for the WebSocket server')
     parser.add_argument('--watch-paths', nargs='+', default=[], help='Paths to watch with the file monitor')
+    parser.add_argument('--state-dir', default=DEFAULT_STATE_DIR,
+                        help='Directory holding one subdirectory of indexes and journal per service')
+    parser.add_argument('--services', nargs='+', default=['websocket'], choices=sorted(SERVICES),
+                        help='Backend processes to run and supervise')
+    parser.add_argument('--ready-timeout', type=float, default=30.0,
+                        help='Seconds a service may take to accept connections before it is restarted')
+    parser.add_argument('--max-backoff', type=float, default=30.0, help='Longest delay between restarts')
     parser.add_argument('--no-install', action='store_true', help='Skip package installation')
+    parser.add_argument('--force-install', action='store_true',
+                        help='Upgrade all packages even if the installed versions are fine')
     return parser.parse_args()
 
-def install_dependencies():
+REQUIREMENTS = [
+    "websockets",
+    "watchdog",
+    "debugpy",
+    "pygments",
+    "psutil"
+]
+
+def version_tuple(version):
+    """Leading numeric components of a version string: '12.0.post1' -> (12, 0)."""
+    parts = []
+    for part in version.split('.'):
+        match = re.match(r'\d+', part)
+        if not match:
+            break
+        parts.append(int(match.group()))
+    return tuple(parts)
+
+def requirement_versions():
+    """Minimum versions for REQUIREMENTS taken from backend/requirements.txt, where it lists one."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(script_dir, '..', 'backend', 'requirements.txt')
+    versions = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                match = re.match(r'\s*([A-Za-z0-9_.-]+)\s*(==|>=)\s*([^\s;#]+)', line)
+                if match and match.group(1).lower() in REQUIREMENTS:
+                    # Pins are treated as minimums: never downgrade a newer install on launch.
+                    versions[match.group(1).lower()] = match.group(3)
+    except OSError:
+        pass
+    return versions
+
+def check_dependencies():
+    """Requirements that are missing or older than requirements.txt asks for, without touching the network."""
+    minimums = requirement_versions()
+    outdated = []
+    for name in REQUIREMENTS:
+        try:
+            installed = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            outdated.append(name)
+            continue
+        minimum = minimums.get(name)
+        if minimum and version_tuple(installed) < version_tuple(minimum):
+            logger.info(f"{name} {installed} is older than required {minimum}")
+            outdated.append(name)
+    return outdated
+
+def install_dependencies(packages=None):
     """Install required Python packages"""
-    logger.info("Installing required Python packages...")
-    requirements = [
-        "websockets",
-        "watchdog",
-        "debugpy",
-        "pygments",
-        "psutil"
-    ]
-    
+    minimums = requirement_versions()
+    requirements = [f"{name}>={minimums[name]}" if name in minimums else name
+                    for name in (packages or REQUIREMENTS)]
+    logger.info(f"Installing required Python packages: {' '.join(requirements)}")
+
     try:
         subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade"] + requirements)
         logger.info("Dependencies installed successfully")
@@ -49,95 +123,214 @@ def install_dependencies():
         logger.error(f"Failed to install dependencies: {e}")
         return False
 
-def get_server_path():
-    """Get the path to the backend server script"""
+def get_script_path(relative_path):
+    """Get the absolute path to a backend script"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.abspath(os.path.join(script_dir, '..'))
-    
-    server_path = os.path.join(project_root, 'backend', 'src', 'main.py')
-    
+
+    server_path = os.path.join(project_root, relative_path)
+
     if not os.path.exists(server_path):
         logger.error(f"Server script not found at {server_path}")
         sys.exit(1)
-    
+
     return server_path
 
-def start_server(args):
-    """Start the backend server"""
-    server_path = get_server_path()
-    logger.info(f"Starting server from {server_path}")
-    
-    # Build command
-    cmd = [
-        sys.executable,
-        server_path,
-        "--host", args.host,
-        "--port", str(args.debugger_port),
-        "--file-monitor-port", str(args.file_monitor_port)
-    ]
-    
-    # Add watch paths if specified
+def accepted_options(script_path):
+    """Option strings the script's argparse parser declares, read from its source without running it."""
+    with open(script_path, encoding='utf-8') as file:
+        tree = ast.parse(file.read(), script_path)
+    options = set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr == 'add_argument'):
+            options.update(arg.value for arg in node.args
+                           if isinstance(arg, ast.Constant) and isinstance(arg.value, str) and arg.value.startswith('-'))
+    return options
+
+def build_command(name, args):
+    """Command line for a service, checked against the options its script accepts."""
+    script_path = get_script_path(SERVICES[name][0])
+    options = {'--host': args.host}
+    if name == 'monitor':
+        options['--port'] = args.file_monitor_port
+    elif name == 'websocket':
+        options['--port'] = args.websocket_port
     if args.watch_paths:
-        cmd.extend(["--watch-paths"] + args.watch_paths)
-    
-    logger.info(f"Running command: {' '.join(cmd)}")
-    
-    # Start the server process
-    try:
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
-        )
-        
-        # Set up a handler for graceful shutdown
-        def signal_handler(sig, frame):
-            logger.info("Shutting down server...")
-            process.terminate()
-            process.wait(timeout=5)
-            sys.exit(0)
-        
-        signal.signal(signal.SIGINT, signal_handler)
-        if platform.system() != 'Windows':
-            signal.signal(signal.SIGTERM, signal_handler)
-        
-        # Print server output
+        options['--watch-paths'] = args.watch_paths
+    state_dir = os.path.join(args.state_dir, name)
+    for option, filename in STATE_OPTIONS[name].items():
+        options[option] = os.path.join(state_dir, filename)
+
+    unknown = sorted(option for option in options if option not in accepted_options(script_path))
+    if unknown:
+        raise ValueError(f"{os.path.basename(script_path)} does not accept {', '.join(unknown)}")
+    cmd = [sys.executable, script_path]
+    for option, value in options.items():
+        cmd.append(option)
+        if isinstance(value, list):
+            cmd.extend(str(item) for item in value)
+        else:
+            cmd.append(str(value))
+    return cmd
+
+class Service:
+    """One supervised backend process."""
+
+    def __init__(self, name, cmd, host, ready_port=None):
+        self.name = name
+        self.cmd = cmd
+        self.host = host
+        self.ready_port = ready_port
+        self.process = None
+        self.restarts = 0
+        self.failures = 0
+
+class Supervisor:
+    """Starts each service, probes readiness, forwards output and restarts crashes with exponential backoff.
+
+    A failure counts towards the backoff only when the process died (or never
+    became ready) within ``stable_after`` seconds of starting; a service that
+    ran for longer starts over at the shortest delay, ``base_backoff``.
+    """
+
+    def __init__(self, services, ready_timeout=30.0, base_backoff=0.5, max_backoff=30.0, stable_after=30.0):
+        self.services = services
+        self.ready_timeout = ready_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.stopping = None
+        self.output = sys.stdout.buffer
+
+    async def run(self):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except (NotImplementedError, AttributeError, ValueError):
+                # Windows has no loop signal handlers; Ctrl+C arrives as KeyboardInterrupt instead.
+                pass
+        await asyncio.gather(*(self.supervise(service) for service in self.services))
+
+    async def supervise(self, service):
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            logger.info(f"Starting {service.name}: {' '.join(service.cmd)}")
+            try:
+                service.process = await asyncio.create_subprocess_exec(
+                    *service.cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            except OSError as e:
+                logger.error(f"Failed to start {service.name}: {e}")
+                service.process = None
+            if service.process is not None:
+                forward = asyncio.ensure_future(self.forward_output(service))
+                ready = await self.wait_ready(service, started)
+                if ready:
+                    await self.wait_exit(service)
+                else:
+                    await self.terminate(service)
+                await forward
+                code = service.process.returncode
+                if self.stopping.is_set():
+                    break
+                if ready:
+                    logger.error(f"{service.name} exited with code {code}")
+                elif code is not None and code >= 0:
+                    logger.error(f"{service.name} exited with code {code} before it was ready")
+                else:
+                    logger.error(f"{service.name} did not become ready within {self.ready_timeout:.0f}s")
+            if time.monotonic() - started >= self.stable_after:
+                service.failures = 0
+            delay = min(self.max_backoff, self.base_backoff * 2 ** service.failures)
+            service.failures += 1
+            service.restarts += 1
+            logger.info(f"Restarting {service.name} in {delay:.1f}s (restart {service.restarts})")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_ready(self, service, started):
+        """Poll the service's port until it accepts a connection, it exits, or the timeout passes."""
+        if service.ready_port is None:
+            return True
+        deadline = started + self.ready_timeout
+        while time.monotonic() < deadline and service.process.returncode is None and not self.stopping.is_set():
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(service.host, service.ready_port), 1.0)
+                writer.close()
+                logger.info(f"{service.name} ready on {service.host}:{service.ready_port} "
+                            f"in {(time.monotonic() - started) * 1000:.0f} ms")
+                return True
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(0.1)
+        return self.stopping.is_set() and service.process.returncode is None
+
+    async def wait_exit(self, service):
+        exit_task = asyncio.ensure_future(service.process.wait())
+        stop_task = asyncio.ensure_future(self.stopping.wait())
+        await asyncio.wait([exit_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        if not exit_task.done():
+            await self.terminate(service)
+
+    async def terminate(self, service, timeout=5.0):
+        if service.process.returncode is not None:
+            return
+        service.process.terminate()
+        try:
+            await asyncio.wait_for(service.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{service.name} did not stop in {timeout:.0f}s, killing it")
+            service.process.kill()
+            await service.process.wait()
+
+    async def forward_output(self, service):
+        """Copy the child's output in blocks, prefixing each line with the service name."""
+        prefix = f"[{service.name}] ".encode()
+        at_line_start = True
         while True:
-            line = process.stdout.readline()
-            if not line:
+            data = await service.process.stdout.read(64 * 1024)
+            if not data:
                 break
-            print(line.rstrip())
-        
-        # Wait for process to complete
-        return_code = process.wait()
-        
-        if return_code != 0:
-            logger.error(f"Server exited with code {return_code}")
-            return False
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to start server: {e}")
-        return False
+            if at_line_start:
+                data = prefix + data
+            at_line_start = data.endswith(b'\n')
+            body = data[:-1] if at_line_start else data
+            self.output.write(body.replace(b'\n', b'\n' + prefix) + (b'\n' if at_line_start else b''))
+            self.output.flush()
 
 def main():
     args = parse_args()
     
-    # Install dependencies if needed
+    # Install dependencies only when the installed versions do not satisfy the requirements
     if not args.no_install:
-        if not install_dependencies():
+        started = time.perf_counter()
+        missing = REQUIREMENTS if args.force_install else check_dependencies()
+        if not missing:
+            logger.info(f"Dependencies satisfied (checked in {(time.perf_counter() - started) * 1000:.0f} ms)")
+        elif not install_dependencies(missing):
             logger.error("Failed to install dependencies. Run with --no-install to skip this step.")
             return 1
-    
-    # Start the server
-    if not start_server(args):
-        logger.error("Server failed to start or ended with an error")
-        return 1
-    
+
+    services = []
+    for name in dict.fromkeys(args.services):
+        try:
+            cmd = build_command(name, args)
+        except ValueError as e:
+            logger.error(f"Invalid arguments for {name}: {e}")
+            return 2
+        port_attr = SERVICES[name][1]
+        services.append(Service(name, cmd, args.host, getattr(args, port_attr) if port_attr else None))
+
+    supervisor = Supervisor(services, ready_timeout=args.ready_timeout, max_backoff=args.max_backoff)
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        logger.info("Shutting down servers...")
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main()) 
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file